@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from itertools import count
+from multiprocessing.sharedctypes import Synchronized
+from typing import List
+
+from aiohttp import web
+
+from bygeon.message import Message
+from bygeon.messenger.cqhttp import CQHttp
+from bygeon.messenger.messenger import Hub, Messenger
+from bygeon.pipeline import Pipeline
+from bygeon.store.database import Database
+from .cqhttp import AsyncCQHttp
+from .hub import AsyncHub
+from .pipeline import AsyncPipeline
+
+# A fake go-cqhttp HTTP API answers every call after a fixed delay, in a
+# separate process so that its threads are not counted. Each hub links an
+# origin that never receives anything with one CQHttp group, so every
+# message is sent once.
+
+
+def serve(port: int, latency: float, sent: Synchronized) -> None:
+    ids = count()
+
+    async def send(request: web.Request) -> web.Response:
+        await request.read()
+        await asyncio.sleep(latency)
+        with sent.get_lock():
+            sent.value += 1
+        return web.json_response({"status": "ok", "data": {"message_id": next(ids)}})
+
+    async def members(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "data": []})
+
+    app = web.Application()
+    app.router.add_post("/send_group_msg", send)
+    app.router.add_post("/get_group_member_list", members)
+    app.router.add_route("HEAD", "/", members)
+    web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+
+class Origin(Messenger):
+    def __init__(self) -> None:
+        self.hubs = {}
+        self.log = self.get_logger()
+
+
+class Sampler(threading.Thread):
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.peak = 0
+        self.running = True
+
+    def run(self) -> None:
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.005)
+
+
+def wait_for(sent: Synchronized, total: int) -> None:
+    while sent.value < total:
+        time.sleep(0.005)
+
+
+def link(hubs: List[Hub], cqhttp: CQHttp) -> None:
+    for i, hub in enumerate(hubs):
+        origin = Origin()
+        hub.add_linkee(origin, "0")
+        cqhttp.add_hub(str(i + 1), hub)
+        hub.add_linkee(cqhttp, str(i + 1))
+        hub.init_database(False)
+
+
+def messages(hubs: List[Hub], n: int) -> List[tuple]:
+    return [
+        (hub, Message("Origin", "0", str(j), None, "bench", f"message {j}", []))
+        for j in range(n)
+        for hub in hubs
+    ]
+
+
+def run_threads(url: str, directory: str, hubs: int, n: int, sent: Synchronized) -> None:
+    database = Database(os.path.join(directory, "threads.db"), shared=True)
+    pipeline = Pipeline(4, 8)
+    cqhttp = CQHttp("", url, rate_limit=1e9, burst=1_000_000)
+    cqhttp.pipeline = pipeline
+    hub_list = [Hub(f"HUB-{i}", database=database, pipeline=pipeline) for i in range(hubs)]
+    link(hub_list, cqhttp)
+
+    sampler = Sampler()
+    sampler.start()
+    start = time.perf_counter()
+    for hub, m in messages(hub_list, n):
+        hub.new_hub_message(m)
+    wait_for(sent, hubs * n)
+    report("threads", hubs * n, time.perf_counter() - start, sampler)
+
+
+def run_asyncio(url: str, directory: str, hubs: int, n: int, sent: Synchronized) -> None:
+    database = Database(os.path.join(directory, "asyncio.db"), shared=True)
+    pipeline = AsyncPipeline(64)
+    cqhttp = AsyncCQHttp("", url, rate_limit=1e9, burst=1_000_000)
+    cqhttp.pipeline = pipeline
+    hub_list = [
+        AsyncHub(f"HUB-{i}", database=database, pipeline=pipeline)  # type: ignore[arg-type]
+        for i in range(hubs)
+    ]
+    link(hub_list, cqhttp)
+
+    async def drive() -> None:
+        for hub, m in messages(hub_list, n):
+            await hub.new_hub_message(m)
+        while sent.value < hubs * n:
+            await asyncio.sleep(0.005)
+
+    sampler = Sampler()
+    sampler.start()
+    start = time.perf_counter()
+    pipeline.loop.run_until_complete(drive())
+    report("asyncio", hubs * n, time.perf_counter() - start, sampler)
+
+
+def report(engine: str, total: int, elapsed: float, sampler: Sampler) -> None:
+    sampler.running = False
+    print(
+        f"{engine:>8} {total:>7} sends {total / elapsed:>10,.0f} msg/s  "
+        f"peak threads {sampler.peak:>4}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the threaded and asyncio engines against a fake API"
+    )
+    parser.add_argument("--hubs", type=int, default=32)
+    parser.add_argument("-n", "--messages", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--port", type=int, default=18571)
+    parser.add_argument(
+        "-e", "--engines", nargs="+", default=["threads", "asyncio"]
+    )
+    args = parser.parse_args()
+
+    for engine in args.engines:
+        sent: Synchronized = multiprocessing.Value("i", 0)  # type: ignore[assignment]
+        server = multiprocessing.Process(
+            target=serve, args=(args.port, args.latency, sent), daemon=True
+        )
+        server.start()
+        time.sleep(1)
+        url = f"http://127.0.0.1:{args.port}/"
+        # each engine runs in a fresh process, so that threads left behind by
+        # the previous one are not counted
+        run = run_threads if engine == "threads" else run_asyncio
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                bench = multiprocessing.Process(
+                    target=run,
+                    args=(url, directory, args.hubs, args.messages, sent),
+                )
+                bench.start()
+                bench.join()
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import asyncio
+
+import aiohttp
+import orjson
+
+from bygeon.fileserver import FileServer
+from bygeon.message import Message
+from bygeon.messenger.cqhttp import CQHttp
+from bygeon.messenger.definition.cqhttp import WSMessage, PostType, MetaEventType
+from .messenger import AsyncMessenger
+from .ratelimit import AsyncLimiter
+from .transport import transport
+
+
+class AsyncCQHttp(AsyncMessenger, CQHttp):
+    def __init__(
+        self,
+        ws_url: str,
+        http_url: str,
+        rate_limit: float = 5,
+        burst: int = 5,
+        file_server: FileServer | None = None,
+    ) -> None:
+        super().__init__(ws_url, http_url, rate_limit, burst, file_server)
+        self.api = AsyncLimiter(self.limiter)
+
+    async def start(self) -> None:
+        await transport.prewarm(self.http_url)
+        if self.file_server is not None:
+            # a thread of its own, file transfers stay off the loop
+            self.file_server.start()
+        self.pipeline.spawn(self.connect(lambda: self.ws_url))
+        self.pipeline.spawn(self.watch())
+
+    # drops a connection go-cqhttp stopped sending heartbeats on, connect
+    # then opens a new one
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval or 5)
+            if (ws := self.socket) is not None and self.stale:
+                await ws.close()
+
+    async def on_frame(self, ws: aiohttp.ClientWebSocketResponse, message: str) -> None:
+        ws_message: WSMessage = orjson.loads(message)
+        self.log.debug(message)
+
+        key = f"{self.name}:{ws_message.get('group_id')}"
+        match ws_message["post_type"]:
+            case PostType.MESSAGE:
+                self.pipeline.submit(key, self.dispatch_message, ws_message)
+            case PostType.NOTICE:
+                self.pipeline.submit(key, self.dispatch_notice, ws_message)
+            case PostType.META_EVENT:
+                if ws_message["meta_event_type"] == MetaEventType.HEARTBEAT:
+                    self.on_heartbeat(ws_message)
+
+    async def dispatch_message(self, wsm: WSMessage) -> None:
+        if (parsed := self.parse_message(wsm)) is None:
+            return None
+        hub, m = parsed
+        await hub.new_hub_message(m)
+
+    async def dispatch_notice(self, wsm: WSMessage) -> None:
+        if (parsed := self.parse_notice(wsm)) is not None:
+            hub, recalled_id = parsed
+            await hub.recall_hub_message(self.name, recalled_id)
+
+    async def send_message(self, m: Message, c_id: str, ref_id=None) -> None:
+        if (hub := self.hubs.get(c_id)) is None:
+            return None
+        payload = {"group_id": int(c_id), "message": self.format_message(m, ref_id)}
+        r = await self.api.request("POST", self.send_url, json=payload)
+        response = self.check_response(r)  # type: ignore[arg-type]
+        message_id = response.get("data").get("message_id")
+        hub.update_entry(m, self.name, message_id)
+
+    async def recall_message(self, m_id: str, c_id: None | str) -> None:
+        payload = {"message_id": m_id}
+        r = await self.api.request("POST", self.recall_url, json=payload)
+        self.log.info("Trying to recall: " + m_id)
+        self.check_response(r)  # type: ignore[arg-type]
+
+    async def modify_message(self, m: Message, c_id: str, m_id: str) -> None:
+        await self.recall_message(m_id, c_id)
+        await self.send_message(m, c_id)
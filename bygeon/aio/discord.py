@@ -0,0 +1,228 @@
+import asyncio
+import random
+from os.path import basename
+from typing import Dict, Union, cast
+
+import aiohttp
+import orjson
+
+from bygeon.message import Message
+from bygeon.relay import relay
+from bygeon.messenger.discord import Discord, Shard, RESUME_CLOSE
+from bygeon.messenger.definition.discord import (
+    Endpoints,
+    EventName,
+    GatewayBot,
+    Hello,
+    MessageCreateEvent,
+    MessageDeleteEvent,
+    MessageUpdateEvent,
+    Opcode,
+    ReadyEvent,
+    WebsocketMessage,
+)
+from .messenger import AsyncMessenger
+from .ratelimit import AsyncLimiter
+from .transport import transport
+
+
+class AsyncShard(Shard):
+    client: "AsyncDiscord"
+
+    def __init__(self, client: "AsyncDiscord", shard_id: int, count: int) -> None:
+        super().__init__(client, shard_id, count)
+        self.socket: aiohttp.ClientWebSocketResponse | None = None
+        self.heartbeat_task: asyncio.Future | None = None
+        self.handshake_task: asyncio.Future | None = None
+
+    async def beat(self, ws: aiohttp.ClientWebSocketResponse, interval: int) -> None:
+        await asyncio.sleep(interval / 1000 * random.random())
+        while not ws.closed:
+            if (payload := self.next_heartbeat()) is None:
+                await ws.close(code=RESUME_CLOSE)
+                return None
+            self.log.debug("Sending heartbeat")
+            await ws.send_str(payload.decode())
+            await asyncio.sleep(interval / 1000)
+
+    async def handshake(
+        self, ws: aiohttp.ClientWebSocketResponse, delay: float = 0
+    ) -> None:
+        await asyncio.sleep(delay + self.handshake_delay())
+        await ws.send_str(self.handshake_payload.decode())
+
+    # A handshake still waiting for its bucket belongs to the previous HELLO
+    # or session, it must not identify a second time.
+    def start_handshake(
+        self, ws: aiohttp.ClientWebSocketResponse, delay: float = 0
+    ) -> None:
+        if self.handshake_task is not None:
+            self.handshake_task.cancel()
+        self.handshake_task = self.client.pipeline.spawn(self.handshake(ws, delay))
+
+    def reconnect_delay(self, code: int | None) -> float | None:
+        for task in (self.handshake_task, self.heartbeat_task):
+            if task is not None:
+                task.cancel()
+        self.handshake_task = self.heartbeat_task = None
+        return super().reconnect_delay(code)
+
+    async def on_frame(self, ws: aiohttp.ClientWebSocketResponse, message: str) -> None:
+        if not self.screen(message):
+            return None
+        self.log.debug(message)
+        ws_message: WebsocketMessage = orjson.loads(message)
+        pipeline = self.client.pipeline
+
+        match ws_message["op"]:
+            case Opcode.HELLO:
+                hello = cast(Hello, ws_message["d"])
+                # identifying may wait for the bucket, frames keep flowing
+                self.start_handshake(ws)
+                if self.heartbeat_task is not None:
+                    self.heartbeat_task.cancel()
+                self.heartbeat_task = pipeline.spawn(
+                    self.beat(ws, hello["heartbeat_interval"])
+                )
+            case Opcode.HEARTBEAT:
+                await ws.send_str(self.heartbeat_payload.decode())
+            case Opcode.HEARTBEAT_ACK:
+                self.heartbeat_ack()
+            case Opcode.DISPATCH:
+                self.sequence = ws_message["s"]
+                if ws_message["t"] == EventName.READY:
+                    self.ready(cast(ReadyEvent, ws_message["d"]))
+                elif ws_message["t"] == EventName.RESUMED:
+                    self.log.info("Resumed session, missed events are replayed")
+                else:
+                    pipeline.submit(
+                        self.key(ws_message), self.client.dispatch, ws_message
+                    )
+            case Opcode.RECONNECT:
+                self.log.info("Gateway asked to reconnect")
+                await ws.close(code=RESUME_CLOSE)
+            case Opcode.INVALID_SESSION:
+                again, delay = self.invalid_session(bool(ws_message["d"]))
+                if again:
+                    await ws.close(code=RESUME_CLOSE)
+                else:
+                    self.start_handshake(ws, delay)
+
+
+class AsyncDiscord(AsyncMessenger, Discord):
+    shard_class = AsyncShard
+
+    def __init__(
+        self, bot_token: str, compress: bool = False, shards: int | None = 1
+    ) -> None:
+        super().__init__(bot_token, compress, shards)
+        self.api = AsyncLimiter(self.limiter)
+
+    async def start(self) -> None:
+        await transport.prewarm(Endpoints.API)
+        if not self.shards:
+            info = await self.gateway_bot_async() if self.sharded else None
+            self.shards = self.create_shards(info)
+        for shard in self.shards:
+            self.pipeline.spawn(self.connect(lambda s=shard: s.gateway_url, shard))
+
+    async def gateway_bot_async(self) -> GatewayBot | None:
+        try:
+            r = await self.api.request(
+                "GET",
+                Endpoints.GATEWAY_BOT,
+                route="GET /gateway/bot",
+                headers=self.headers,
+            )
+            r.raise_for_status()
+            return cast(GatewayBot, r.json())
+        except aiohttp.ClientError as e:
+            self.log.error(f"Could not get the recommended shard count: {e}")
+            return None
+
+    async def dispatch(self, ws_message: WebsocketMessage) -> None:
+        match ws_message["t"]:
+            case EventName.MESSAGE_CREATE:
+                create_event = cast(MessageCreateEvent, ws_message["d"])
+                if (parsed := self.parse_message_create(create_event)) is None:
+                    return None
+                hub, m = parsed
+                await hub.new_hub_message(m)
+
+            case EventName.MESSAGE_UPDATE:
+                update_event = cast(MessageUpdateEvent, ws_message["d"])
+                if (parsed_update := self.parse_message_update(update_event)) is None:
+                    return None
+                hub, m = parsed_update
+                await hub.modify_hub_message(m)
+
+            case EventName.MESSAGE_DELETE:
+                delete_event = cast(MessageDeleteEvent, ws_message["d"])
+                if (hub := self.hubs.get(delete_event["channel_id"])) is None:
+                    return None
+                await hub.recall_hub_message(self.name, delete_event["id"])
+
+    async def send_message(self, m: Message, c_id: str, ref_id=None) -> None:
+        hub = self.hubs[c_id]
+
+        payload: Dict[str, Union[str, dict]] = {
+            "content": f"[{m.author_username}]: {m.text}"
+        }
+        if ref_id is not None:
+            payload["message_reference"] = {
+                "channel_id": c_id,
+                "message_id": ref_id,
+            }
+
+        with relay.held(a.file_path for a in m.attachments):
+            body: dict = {"json": payload}
+            if m.attachments:
+                files = [
+                    (
+                        f"files[{i}]",
+                        (basename(a.file_path), relay.reader(a.file_path), a.type),
+                    )
+                    for i, a in enumerate(m.attachments)
+                ]
+                files.append(
+                    ("payload_json", (None, orjson.dumps(payload), "application/json"))  # type: ignore[arg-type]
+                )
+                body = {"files": files}
+            r = await self.api.request(
+                "POST",
+                Endpoints.SEND_MESSAGE.format(c_id),
+                route="POST /channels/messages",
+                major=c_id,
+                headers=self.headers,
+                **body,
+            )
+
+        self.log_response(r)  # type: ignore[arg-type]
+        r.raise_for_status()
+
+        if (message_id := r.json().get("id")) is not None:
+            hub.update_entry(m, self.name, message_id)
+
+    async def modify_message(self, m: Message, c_id: str, m_id: str) -> None:
+        r = await self.api.request(
+            "PATCH",
+            Endpoints.EDIT_MESSAGE.format(c_id, m_id),
+            route="PATCH /channels/messages",
+            major=c_id,
+            headers=self.headers,
+            json={"content": f"[{m.author_username}]: {m.text}"},
+        )
+        self.log_response(r)  # type: ignore[arg-type]
+        r.raise_for_status()
+
+    async def recall_message(self, m_id: str, c_id: None | str) -> None:
+        r = await self.api.request(
+            "DELETE",
+            Endpoints.DELETE_MESSAGE.format(c_id, m_id),
+            route="DELETE /channels/messages",
+            major=str(c_id),
+            headers=self.headers,
+        )
+        self.log_response(r)  # type: ignore[arg-type]
+        if r.status_code != 404:
+            r.raise_for_status()
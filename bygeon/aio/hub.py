@@ -0,0 +1,127 @@
+import asyncio
+from typing import TYPE_CHECKING, Awaitable, List, cast
+
+import aiohttp
+import orjson
+
+from bygeon.filecache import files
+from bygeon.media import transcoder
+from bygeon.message import Message, Download, dump_message, load_message
+from bygeon.messenger.messenger import Hub, permanent
+from bygeon.relay import relay
+from bygeon.store.outbox import Delivery, SEND, MODIFY, RECALL
+from .pipeline import AsyncPipeline, blocking
+from .transport import transport
+
+if TYPE_CHECKING:
+    from .messenger import AsyncMessenger
+
+
+def refused(e: Exception) -> bool:
+    match e:
+        case aiohttp.ClientResponseError(status=status):
+            return 400 <= status < 500 and status != 429
+    return permanent(e)
+
+
+class AsyncHub(Hub):
+    # Hub for the asyncio engine. Id mapping, cache and outbox are shared
+    # with Hub; deliveries are coroutines gathered on the pipeline's loop.
+    pipeline: AsyncPipeline  # type: ignore[assignment]
+
+    async def new_hub_message(self, m: Message):
+        m = await self.materialize(m)
+        async with self.pipeline.turn():
+            self.new_entry(m)
+            await self.fan_out(SEND, m.origin, dump_message(m), (m,))
+
+    async def modify_hub_message(self, m: Message) -> None:
+        async with self.pipeline.turn():
+            await self.fan_out(MODIFY, m.origin, dump_message(m), (m,))
+
+    async def recall_hub_message(self, orig: str, recalled_id: str) -> None:
+        async with self.pipeline.turn():
+            payload = orjson.dumps([orig, recalled_id])
+            await self.fan_out(RECALL, orig, payload, (orig, recalled_id))
+
+    async def materialize(self, m: Message) -> Message:  # type: ignore[override]
+        if not (wanted := self.wanted(m)):
+            return m
+        sources = [cast(Download, m.attachments[i].source) for i in wanted]
+        return self.fill(m, wanted, await transport.download_all(sources))
+
+    async def fan_out(  # type: ignore[override]
+        self, kind: str, origin: str, payload: bytes, args: tuple
+    ) -> None:
+        clients = [c for c in self.clients if c.name != origin]
+        deliveries = [(c.name, kind, payload) for c in clients]
+        ids = await blocking(self.database.outbox.add, self.name, deliveries)
+        relay.hold(self.attachment_paths(kind, args), len(clients))
+        sends: List[Awaitable] = [
+            self.pipeline.deliver(self.lane(c), self.attempt, delivery_id, c, kind, args)
+            for delivery_id, c in zip(ids, clients)
+        ]
+        self.pipeline.spawn(asyncio.gather(*sends))
+
+    async def attempt(
+        self, delivery_id: int, client: "AsyncMessenger", kind: str, args: tuple
+    ) -> None:
+        action = {SEND: self.send, MODIFY: self.modify, RECALL: self.recall}[kind]
+        paths = self.attachment_paths(kind, args)
+        try:
+            with files.pinned(paths):
+                await action(client, *args)
+        except Exception as e:
+            self.log.error(f"Failed to {kind} with {client.name}")
+            self.log.exception(e)
+            if refused(e):
+                self.log.error(f"{client.name} refused delivery {delivery_id}")
+                await blocking(self.database.outbox.done, delivery_id)
+            elif not await blocking(self.database.outbox.retry, delivery_id):
+                self.log.error(f"Gave up on delivery {delivery_id} to {client.name}")
+        else:
+            await blocking(self.database.outbox.done, delivery_id)
+        finally:
+            relay.release(paths)
+
+    # called from the outbox thread, handing over to the loop never blocks
+    def redeliver(self, delivery: Delivery) -> bool:
+        clients = {c.name: c for c in self.clients}
+        if (client := clients.get(delivery.destination)) is None:
+            self.log.warning(f"Dropping delivery to unlinked {delivery.destination}")
+            self.database.outbox.done(delivery.id)
+            return True
+        if delivery.kind == RECALL:
+            args = tuple(orjson.loads(delivery.payload))
+        else:
+            args = (load_message(delivery.payload),)
+        self.log.info(f"Retrying {delivery.kind} with {client.name}")
+        relay.hold(self.attachment_paths(delivery.kind, args))
+        asyncio.run_coroutine_threadsafe(
+            self.pipeline.deliver(
+                self.lane(client), self.attempt, delivery.id, client, delivery.kind, args
+            ),
+            self.pipeline.loop,
+        )
+        return True
+
+    async def send(self, client: "AsyncMessenger", m: Message) -> None:
+        ref_id = None
+        if (ref := m.origin_ref_id) is not None:
+            ref_id = await blocking(self.find_id, m.origin, ref, client.name)
+        m = self.adapt(client, await transcoder.fit_async(m, client.capabilities))
+        await client.send_message(m, self.links[client], ref_id)
+
+    async def modify(self, client: "AsyncMessenger", m: Message) -> None:
+        m_id = await blocking(self.find_id, m.origin, m.origin_m_id, client.name)
+        if m_id is None:
+            self.log.debug(f"No {client.name} message to modify for {m.origin_m_id}")
+            return None
+        await client.modify_message(m, self.links[client], m_id)
+
+    async def recall(self, client: "AsyncMessenger", orig: str, recalled_id: str) -> None:
+        m_id = await blocking(self.find_id, orig, recalled_id, client.name)
+        if m_id is None:
+            self.log.debug(f"No {client.name} message to recall for {recalled_id}")
+            return None
+        await client.recall_message(m_id, self.links[client])
@@ -0,0 +1,20 @@
+import asyncio
+from typing import List
+
+from .messenger import AsyncMessenger
+from .pipeline import AsyncPipeline
+from .transport import transport
+
+
+async def serve(clients: List[AsyncMessenger], pipeline: AsyncPipeline) -> None:
+    for client in clients:
+        client.pipeline = pipeline
+        await client.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await transport.close()
+
+
+def run(clients: List[AsyncMessenger], pipeline: AsyncPipeline) -> None:
+    pipeline.loop.run_until_complete(serve(clients, pipeline))
@@ -0,0 +1,84 @@
+import asyncio
+from typing import Any, Callable
+
+import aiohttp
+
+from bygeon.message import Message
+from bygeon.messenger.messenger import Messenger
+from .pipeline import AsyncPipeline
+from .transport import transport
+
+
+class AsyncMessenger(Messenger):
+    # Mixed in before a threaded messenger, whose parsing and payloads it
+    # reuses; the gateway and every REST call run on the pipeline's loop.
+    pipeline: AsyncPipeline  # type: ignore[assignment]
+    socket: aiohttp.ClientWebSocketResponse | None = None
+
+    # keep the name of the threaded messenger, the id mapping is keyed by it
+    @property
+    def name(self) -> str:
+        return self.__class__.__name__.removeprefix("Async")
+
+    # url is called for every connection, it may change between them. The
+    # frames go to conn, the messenger itself unless it keeps several
+    # connections such as Discord's shards.
+    async def connect(self, url: Callable[[], str], conn: Any = None) -> None:
+        conn = self if conn is None else conn
+        failures = 0
+        while True:
+            code = None
+            try:
+                async with transport.session().ws_connect(url()) as ws:
+                    conn.socket = ws
+                    conn.log.info("Opened WebSocket connection")
+                    conn.opened()
+                    failures = 0
+                    async for frame in ws:
+                        if frame.type == aiohttp.WSMsgType.ERROR:
+                            break
+                        # like websocket-client's on_error, a frame that
+                        # cannot be handled does not end the connection
+                        try:
+                            await self.receive(conn, ws, frame)
+                        except Exception as e:
+                            conn.log.error("Failed to handle a frame")
+                            conn.log.exception(e)
+                code = ws.close_code
+                conn.log.error(f"WebSocket closed: {code}")
+            except Exception as e:
+                conn.log.error("WebSocket encountered error")
+                conn.log.exception(e)
+                failures += 1
+            conn.socket = None
+            if (delay := conn.reconnect_delay(code)) is None:
+                return None
+            # a gateway that cannot be reached is not retried in a tight loop
+            if failures:
+                delay = max(delay, min(2 ** (failures - 1), 60))
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def receive(
+        conn: Any, ws: aiohttp.ClientWebSocketResponse, frame: aiohttp.WSMessage
+    ) -> None:
+        if frame.type == aiohttp.WSMsgType.TEXT:
+            await conn.on_frame(ws, frame.data)
+        elif frame.type == aiohttp.WSMsgType.BINARY:
+            if (message := conn.decode(frame.data)) is not None:
+                await conn.on_frame(ws, message)
+
+    async def on_frame(self, ws: aiohttp.ClientWebSocketResponse, message: str) -> None:
+        ...
+
+    async def send_message(self, m: Message, c_id: str, ref_id=None) -> None:  # type: ignore[override]
+        ...
+
+    async def modify_message(self, m: Message, c_id, m_id: str) -> None:  # type: ignore[override]
+        ...
+
+    async def recall_message(self, m_id: str, c_id: None | str) -> None:  # type: ignore[override]
+        ...
+
+    async def start(self) -> None:  # type: ignore[override]
+        ...
@@ -0,0 +1,83 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Set, TypeVar
+
+import bygeon.logger as logger
+
+Job = Callable[..., Awaitable[None]]
+T = TypeVar("T")
+
+
+# SQLite calls, hashing and disk writes run on the loop's executor; a slow
+# disk or a locked database must not stall every gateway and REST call.
+async def blocking(func: Callable[..., T], *args: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class AsyncPipeline:
+    # Same stages as bygeon.pipeline.Pipeline, as tasks on one loop.
+    #
+    # Every event runs in its own task. A task waits for the previous event
+    # of its key before it reaches a hub, and deliveries to one destination
+    # channel take its lane lock in the order they were fanned out. The
+    # semaphore bounds how many deliveries are in flight at once.
+    #
+    # The loop is created up front so that threads such as the outbox can
+    # schedule work on it before it starts running.
+    def __init__(self, concurrency: int = 64) -> None:
+        self.log = logger.log.bind(Pipeline="asyncio")
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tails: Dict[str, asyncio.Future] = {}
+        self.lanes: Dict[str, asyncio.Lock] = {}
+        self.tasks: Set[asyncio.Future] = set()
+        self.previous: ContextVar[asyncio.Future | None] = ContextVar(
+            "previous", default=None
+        )
+
+    def spawn(self, coro: Awaitable) -> asyncio.Future:
+        task = asyncio.ensure_future(coro, loop=self.loop)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def submit(self, key: str, func: Job, *args) -> None:
+        previous = self.tails.get(key)
+        done = self.loop.create_future()
+        self.tails[key] = done
+        self.spawn(self.work(key, previous, done, func, args))
+
+    async def work(
+        self,
+        key: str,
+        previous: asyncio.Future | None,
+        done: asyncio.Future,
+        func: Job,
+        args: tuple,
+    ) -> None:
+        self.previous.set(previous)
+        try:
+            await func(*args)
+        except Exception as e:
+            self.log.error(f"Failed to handle event from {key}")
+            self.log.exception(e)
+        finally:
+            done.set_result(None)
+            if self.tails.get(key) is done:
+                del self.tails[key]
+
+    @asynccontextmanager
+    async def turn(self) -> AsyncIterator[None]:
+        if (previous := self.previous.get()) is not None:
+            await previous
+        yield
+
+    async def deliver(self, key: str, func: Job, *args) -> None:
+        lane = self.lanes.setdefault(key, asyncio.Lock())
+        async with lane, self.semaphore:
+            try:
+                await func(*args)
+            except Exception as e:
+                self.log.error(f"Failed to deliver with {func.__qualname__}")
+                self.log.exception(e)
@@ -0,0 +1,38 @@
+import asyncio
+
+from bygeon.ratelimit import RateLimiter, rewind
+from .transport import Response, transport
+
+
+class AsyncLimiter:
+    # Drives a RateLimiter from the event loop: waits are awaited instead of
+    # slept, so a limited route only holds up the calls that use it.
+    def __init__(self, limiter: RateLimiter) -> None:
+        self.limiter = limiter
+
+    async def acquire(self, route: str, major: str) -> None:
+        while (wait := self.limiter.poll(route, major)) > 0:
+            await asyncio.sleep(wait)
+        if (wait := self.limiter.throttle()) > 0:
+            await asyncio.sleep(wait)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        route: str | None = None,
+        major: str = "",
+        **kwargs,
+    ) -> Response:
+        route = route or f"{method} {url}"
+        endpoint = f"{self.limiter.name} {route}"
+        while True:
+            await self.acquire(route, major)
+            rewind(kwargs)
+            r = await transport.request(method, url, endpoint, **kwargs)
+            if (retry := self.limiter.update(route, major, r)) is None:  # type: ignore[arg-type]
+                return r
+            self.limiter.log.warning(
+                f"Rate limited on {route}, retrying in {retry:.2f}s"
+            )
+            await asyncio.sleep(retry)
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from typing import Dict, List
+
+import aiohttp
+import orjson
+from multidict import CIMultiDictProxy
+
+import bygeon.logger as logger
+from bygeon.metrics import registry
+from bygeon.filecache import files, downloads
+from bygeon.message import Download
+from .pipeline import blocking
+
+
+class Response:
+    # the parts of requests.Response the limiters and messengers read,
+    # with the body already read
+    def __init__(self, status: int, headers: CIMultiDictProxy, content: bytes) -> None:
+        self.status_code = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(errors="replace")
+
+    def json(self):
+        return orjson.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise aiohttp.ClientResponseError(
+                None,  # type: ignore[arg-type]
+                (),
+                status=self.status_code,
+                message=self.text,
+            )
+
+
+class AsyncTransport:
+    # Counterpart of bygeon.transport.Transport for the asyncio engine: one
+    # session whose connector keeps a pool of connections per host.
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+    ) -> None:
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.client: aiohttp.ClientSession | None = None
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.log = logger.log.bind(Transport="asyncio")
+
+    def configure(
+        self,
+        pool_size: int | None = None,
+        connect_timeout: float | None = None,
+        read_timeout: float | None = None,
+    ) -> None:
+        if pool_size is not None:
+            self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout or self.timeout.sock_connect,
+            sock_read=read_timeout or self.timeout.sock_read,
+        )
+
+    # created lazily, a session has to be opened inside the running loop
+    def session(self) -> aiohttp.ClientSession:
+        if self.client is None or self.client.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size)
+            self.client = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self.client
+
+    async def request(
+        self, method: str, url: str, endpoint: str | None = None, **kwargs
+    ) -> Response:
+        if (files := kwargs.pop("files", None)) is not None:
+            kwargs["data"] = form_data(files)
+        histogram = registry.histogram("http_request_seconds", endpoint or method)
+        start = time.perf_counter()
+        try:
+            async with self.session().request(method, url, **kwargs) as r:
+                return Response(r.status, r.headers, await r.read())
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    # goes through the same content-addressed cache as threaded downloads
+    async def download(self, url: str, directory: str, filename: str) -> str:
+        if (path := await blocking(files.lookup, url, directory, filename)) is not None:
+            return path
+
+        pending = await blocking(files.begin)
+        histogram = registry.histogram("http_request_seconds", "download")
+        start = time.perf_counter()
+        try:
+            async with self.session().get(url) as r:
+                r.raise_for_status()
+                # larger chunks than the threaded download, each write is
+                # a hop to the executor
+                async for chunk in r.content.iter_chunked(65536):
+                    await blocking(pending.write, chunk)
+                content_type = r.headers["content-type"]
+        except BaseException:
+            await asyncio.shield(blocking(pending.discard))
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+        return await blocking(
+            files.commit, pending, url, content_type, directory, filename
+        )
+
+    # the asyncio side of DownloadPool.fetch_all: concurrent, in order, None
+    # for downloads that failed or ran out of time
+    async def download_all(self, sources: List[Download]) -> List[str | None]:
+        results = await asyncio.gather(
+            *(self.download_shared(d) for d in sources), return_exceptions=True
+        )
+        paths: List[str | None] = []
+        for d, result in zip(sources, results):
+            if isinstance(result, BaseException):
+                self.log.error(
+                    f"Failed to download {d.url}: {type(result).__name__} {result}"
+                )
+                downloads.failures.inc()
+                paths.append(None)
+            else:
+                paths.append(result)
+        return paths
+
+    # a URL being downloaded already is awaited rather than fetched again
+    async def download_shared(self, d: Download) -> str:
+        if (task := self.inflight.get(d.url)) is not None:
+            await asyncio.shield(task)
+            # linked under the name the other download asked for
+            path = await blocking(files.lookup, d.url, d.directory, d.filename)
+            if path is not None:
+                return path
+        task = asyncio.ensure_future(
+            asyncio.wait_for(
+                self.download(d.url, d.directory, d.filename), downloads.timeout
+            )
+        )
+        self.inflight[d.url] = task
+        task.add_done_callback(lambda _: self.inflight.pop(d.url, None))
+        return await task
+
+    async def prewarm(self, url: str) -> None:
+        try:
+            await self.request("HEAD", url, "prewarm", allow_redirects=False)
+        except aiohttp.ClientError as e:
+            self.log.warning(f"Could not prewarm {url}: {e}")
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.close()
+
+
+# requests style multipart files, rebuilt for every attempt
+def form_data(files) -> aiohttp.FormData:
+    form = aiohttp.FormData()
+    for name, (filename, f, content_type) in files:
+        form.add_field(name, f, filename=filename, content_type=content_type)
+    return form
+
+
+transport = AsyncTransport()
@@ -0,0 +1,501 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+import bygeon.logger as logger
+import bygeon.util as util
+from bygeon.message import Download
+from bygeon.metrics import registry
+from bygeon.scheduler import scheduler, Timer
+from bygeon.store.pool import ConnectionPool
+from bygeon.transport import transport
+
+
+class Entry(NamedTuple):
+    digest: str
+    content_type: str
+
+
+class Pending:
+    # a download being written to a temporary file and hashed on the way
+    def __init__(self, directory: str) -> None:
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        self.hash = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+        self.hash.update(chunk)
+
+    def discard(self) -> None:
+        self.file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class FileCache:
+    # Downloads are stored once under objects/<sha256>. An index maps each
+    # source URL to the digest and content type, so a URL seen before never
+    # hits the network again. Callers get a hard link to the object named
+    # <directory>/<digest prefix>/<filename>, which keeps the file name for
+    # uploads without two downloads of the same name colliding.
+    #
+    # Every object's size and last use are tracked for the janitor, which
+    # evicts objects by age and then least recently used first until the
+    # cache fits its byte budget. Files being uploaded are pinned, and
+    # objects used within the grace period are never evicted, which also
+    # covers uploads running in other processes.
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int | None = None,
+        max_age: float | None = None,
+        grace: float = 600,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.grace = grace
+        self.pool: ConnectionPool | None = None
+        self.lock = Lock()
+        self.pins: Dict[str, int] = {}
+
+        self.hits = registry.counter("file_cache_hits")
+        self.misses = registry.counter("file_cache_misses")
+        self.evictions = registry.counter("file_cache_evictions")
+        self.evicted_bytes = registry.counter("file_cache_evicted_bytes")
+        self.size = registry.gauge("file_cache_bytes")
+
+    def configure(
+        self,
+        root: str | None = None,
+        max_bytes: int | None = None,
+        max_age: float | None = None,
+    ) -> None:
+        with self.lock:
+            if root is not None and root != self.root:
+                if self.pool is not None:
+                    self.pool.close()
+                    self.pool = None
+                self.root = root
+            self.max_bytes = max_bytes
+            self.max_age = max_age
+
+    @property
+    def objects(self) -> str:
+        return os.path.join(self.root, "objects")
+
+    def index(self) -> ConnectionPool:
+        with self.lock:
+            if self.pool is None:
+                Path(self.objects).mkdir(parents=True, exist_ok=True)
+                self.pool = ConnectionPool(os.path.join(self.root, "index.db"), 2)
+                with self.pool.writer() as conn:
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS "urls" ('
+                        '"url" TEXT PRIMARY KEY, '
+                        '"digest" TEXT NOT NULL, '
+                        '"content_type" TEXT NOT NULL)'
+                    )
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS "objects" ('
+                        '"digest" TEXT PRIMARY KEY, '
+                        '"size" INTEGER NOT NULL, '
+                        '"accessed" REAL NOT NULL)'
+                    )
+                    conn.execute(
+                        'CREATE INDEX IF NOT EXISTS "objects_accessed" '
+                        'ON "objects" ("accessed")'
+                    )
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS "links" ('
+                        '"path" TEXT PRIMARY KEY, '
+                        '"digest" TEXT NOT NULL)'
+                    )
+                    conn.execute(
+                        'CREATE INDEX IF NOT EXISTS "links_digest" ON "links" ("digest")'
+                    )
+                    # converted or downscaled copies, by source and variant
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS "derivatives" ('
+                        '"digest" TEXT NOT NULL, '
+                        '"variant" TEXT NOT NULL, '
+                        '"derived" TEXT NOT NULL, '
+                        '"content_type" TEXT NOT NULL, '
+                        'PRIMARY KEY ("digest", "variant"))'
+                    )
+            return self.pool
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def link(self, entry: Entry, directory: str, filename: str) -> str:
+        filename = util.rename_with_proper_suffix(filename, entry.content_type)
+        link_dir = os.path.join(directory, entry.digest[:16])
+        path = os.path.join(link_dir, filename)
+        if not os.path.exists(path):
+            Path(link_dir).mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(self.object_path(entry.digest), path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # e.g. the cache spans file systems
+                shutil.copyfile(self.object_path(entry.digest), path)
+            with self.index().writer() as conn:
+                conn.execute(
+                    'INSERT OR IGNORE INTO "links" ("path", "digest") VALUES (?, ?)',
+                    (path, entry.digest),
+                )
+        return path
+
+    def touch(self, digest: str) -> None:
+        now = time.time()
+        with self.index().writer() as conn:
+            cur = conn.execute(
+                'UPDATE "objects" SET "accessed" = ? WHERE "digest" = ?', (now, digest)
+            )
+            if cur.rowcount == 0:
+                size = os.path.getsize(self.object_path(digest))
+                conn.execute(
+                    'INSERT OR REPLACE INTO "objects" ("digest", "size", "accessed") '
+                    "VALUES (?, ?, ?)",
+                    (digest, size, now),
+                )
+
+    def lookup(self, url: str, directory: str, filename: str) -> str | None:
+        with self.index().reader() as conn:
+            row = conn.execute(
+                'SELECT "digest", "content_type" FROM "urls" WHERE "url" = ?', (url,)
+            ).fetchone()
+        if row is None:
+            self.misses.inc()
+            return None
+        entry = Entry(*row)
+        if not os.path.exists(self.object_path(entry.digest)):
+            self.misses.inc()
+            return None
+        self.hits.inc()
+        self.touch(entry.digest)
+        return self.link(entry, directory, filename)
+
+    def begin(self) -> Pending:
+        self.index()
+        return Pending(self.objects)
+
+    # move a finished temporary file in place as the object for digest
+    def adopt(self, path: str, digest: str) -> None:
+        target = self.object_path(digest)
+        if os.path.exists(target):
+            # the same bytes are stored already
+            os.unlink(path)
+        else:
+            Path(os.path.dirname(target)).mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+        self.touch(digest)
+
+    def commit(
+        self,
+        pending: Pending,
+        url: str,
+        content_type: str,
+        directory: str,
+        filename: str,
+    ) -> str:
+        pending.file.close()
+        entry = Entry(pending.hash.hexdigest(), content_type)
+        self.adopt(pending.path, entry.digest)
+        with self.index().writer() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO "urls" ("url", "digest", "content_type") '
+                "VALUES (?, ?, ?)",
+                (url, entry.digest, entry.content_type),
+            )
+        return self.link(entry, directory, filename)
+
+    def digest_of(self, path: str) -> str | None:
+        with self.index().reader() as conn:
+            row = conn.execute(
+                'SELECT "digest" FROM "links" WHERE "path" = ?', (path,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def derivative(self, digest: str, variant: str) -> Entry | None:
+        with self.index().reader() as conn:
+            row = conn.execute(
+                'SELECT "derived", "content_type" FROM "derivatives" '
+                'WHERE "digest" = ? AND "variant" = ?',
+                (digest, variant),
+            ).fetchone()
+        if row is None or not os.path.exists(self.object_path(row[0])):
+            return None
+        self.touch(row[0])
+        return Entry(*row)
+
+    def add_derivative(
+        self, digest: str, variant: str, path: str, derived: Entry
+    ) -> None:
+        self.adopt(path, derived.digest)
+        with self.index().writer() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO "derivatives" '
+                '("digest", "variant", "derived", "content_type") VALUES (?, ?, ?, ?)',
+                (digest, variant, *derived),
+            )
+
+    def fetch(
+        self,
+        url: str,
+        directory: str,
+        filename: str,
+        headers=None,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> str:
+        if (path := self.lookup(url, directory, filename)) is not None:
+            return path
+
+        # The transport's timeouts only bound each read, not the download.
+        # No read may wait past the deadline, and a response still open
+        # then is shut down so a stalled one frees its worker.
+        if deadline is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+        request_timeout = transport.timeout
+        if deadline is not None:
+            if (remaining := deadline - time.monotonic()) <= 0:
+                raise TimeoutError(f"No time left to download {url}")
+            request_timeout = (request_timeout[0], min(request_timeout[1], remaining))
+        pending = self.begin()
+        watchdog: Timer | None = None
+        try:
+            with transport.get(
+                url, "download", stream=True, headers=headers, timeout=request_timeout
+            ) as r:
+                if deadline is not None:
+                    # urllib3 before 2.3 can only close, which waits for the read
+                    stop = getattr(r.raw, "shutdown", r.close)
+                    watchdog = scheduler.call_later(
+                        deadline - time.monotonic(), stop, urgent=True
+                    )
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=8192):
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError(f"Downloading {url} ran past its deadline")
+                    pending.write(chunk)
+                content_type = r.headers["content-type"]
+        except BaseException:
+            pending.discard()
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        return self.commit(pending, url, content_type, directory, filename)
+
+    # keep files from being evicted while they are uploaded
+    @contextmanager
+    def pinned(self, paths: Iterable[str]) -> Iterator[None]:
+        paths = list(paths)
+        with self.lock:
+            for path in paths:
+                self.pins[path] = self.pins.get(path, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                for path in paths:
+                    if (n := self.pins[path] - 1) > 0:
+                        self.pins[path] = n
+                    else:
+                        del self.pins[path]
+
+    def evict(self, digest: str, links: List[str]) -> None:
+        for path in links:
+            try:
+                os.unlink(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        try:
+            os.unlink(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+        with self.index().writer() as conn:
+            conn.execute("BEGIN")
+            try:
+                conn.execute('DELETE FROM "urls" WHERE "digest" = ?', (digest,))
+                conn.execute('DELETE FROM "links" WHERE "digest" = ?', (digest,))
+                conn.execute(
+                    'DELETE FROM "derivatives" WHERE "digest" = ? OR "derived" = ?',
+                    (digest, digest),
+                )
+                conn.execute('DELETE FROM "objects" WHERE "digest" = ?', (digest,))
+                conn.execute("COMMIT")
+            except BaseException:
+                # every lookup and commit shares this connection
+                conn.execute("ROLLBACK")
+                raise
+
+    # evict aged objects, then least recently used ones until the cache
+    # fits the budget; returns the number of bytes freed
+    def clean(self, batch_size: int = 100) -> int:
+        now = time.time()
+        pool = self.index()
+        with pool.reader() as conn:
+            total = conn.execute('SELECT COALESCE(SUM("size"), 0) FROM "objects"').fetchone()[0]
+        cutoff = 0.0 if self.max_age is None else now - self.max_age
+        freed = 0
+        # position after the last object looked at, pinned ones are skipped
+        position = (0.0, "")
+        while True:
+            with pool.reader() as conn:
+                rows = conn.execute(
+                    'SELECT "digest", "size", "accessed" FROM "objects" '
+                    'WHERE ("accessed", "digest") > (?, ?) AND "accessed" < ? '
+                    'ORDER BY "accessed", "digest" LIMIT ?',
+                    (*position, now - self.grace, batch_size),
+                ).fetchall()
+            for digest, size, accessed in rows:
+                over = self.max_bytes is not None and total - freed > self.max_bytes
+                if not over and accessed >= cutoff:
+                    rows = []
+                    break
+                position = (accessed, digest)
+                with pool.reader() as conn:
+                    links = [
+                        path
+                        for (path,) in conn.execute(
+                            'SELECT "path" FROM "links" WHERE "digest" = ?', (digest,)
+                        )
+                    ]
+                with self.lock:
+                    if any(path in self.pins for path in links):
+                        continue
+                self.evict(digest, links)
+                self.evictions.inc()
+                self.evicted_bytes.inc(size)
+                freed += size
+            if len(rows) < batch_size:
+                break
+        self.size.set(total - freed)
+        return freed
+
+    def stats(self) -> Dict[str, float]:
+        hits, misses = self.hits.value, self.misses.value
+        return {
+            "bytes": self.size.value,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "evictions": self.evictions.value,
+        }
+
+
+class DownloadPool:
+    # Runs the downloads of one inbound message side by side, so bridging
+    # it waits for the slowest download rather than for all of them in a
+    # row. A download that fails or runs out of time is left out, the
+    # others are returned in their original order. A URL that is being
+    # downloaded already is waited for instead of fetched a second time.
+    def __init__(self, cache: FileCache, workers: int = 8, timeout: float = 60) -> None:
+        self.cache = cache
+        self.workers = workers
+        self.timeout = timeout
+        self.executor: ThreadPoolExecutor | None = None
+        self.inflight: Dict[str, Future] = {}
+        self.lock = Lock()
+        self.log = logger.log.bind(DownloadPool="")
+        self.failures = registry.counter("download_failures")
+
+    def configure(self, workers: int | None = None, timeout: float | None = None) -> None:
+        with self.lock:
+            if workers is not None and workers != self.workers:
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+                self.workers = workers
+            if timeout is not None:
+                self.timeout = timeout
+
+    def pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="download"
+                )
+            return self.executor
+
+    # the deadline runs from submission, a download that waited for a
+    # worker past it is not started at all
+    def fetch(self, d: Download, deadline: float) -> str:
+        return self.cache.fetch(d.url, d.directory, d.filename, deadline=deadline)
+
+    def submit(self, d: Download) -> Tuple[Future, bool]:
+        pool = self.pool()
+        with self.lock:
+            if (future := self.inflight.get(d.url)) is not None:
+                return future, True
+            future = pool.submit(self.fetch, d, time.monotonic() + self.timeout)
+            self.inflight[d.url] = future
+        future.add_done_callback(lambda _: self.forget(d.url, future))
+        return future, False
+
+    def forget(self, url: str, future: Future) -> None:
+        with self.lock:
+            if self.inflight.get(url) is future:
+                del self.inflight[url]
+
+    def fetch_all(self, downloads: List[Download]) -> List[str | None]:
+        if not downloads:
+            return []
+        futures = [self.submit(d) for d in downloads]
+        # a little slack for the one that timed out on its own
+        wait([future for future, _ in futures], timeout=self.timeout + 1)
+
+        paths: List[str | None] = []
+        for d, (future, shared) in zip(downloads, futures):
+            try:
+                path = future.result(timeout=0)
+                if shared:
+                    # linked under the name the other download asked for
+                    path = self.cache.lookup(d.url, d.directory, d.filename) or path
+                paths.append(path)
+            except Exception as e:
+                self.log.error(f"Failed to download {d.url}: {type(e).__name__} {e}")
+                self.failures.inc()
+                paths.append(None)
+        return paths
+
+
+class Janitor:
+    def __init__(self, cache: FileCache, interval: float = 300) -> None:
+        self.cache = cache
+        self.interval = interval
+        self.log = logger.log.bind(Janitor=cache.root)
+        self.timer: Timer | None = None
+
+    def start(self) -> None:
+        if self.timer is None:
+            self.timer = scheduler.call_every(self.interval, self.run, delay=0)
+
+    def run(self) -> None:
+        try:
+            freed = self.cache.clean()
+            stats = self.cache.stats()
+            self.log.info(
+                f"Cache holds {stats['bytes'] / 2**20:.1f} MiB, "
+                f"hit ratio {stats['hit_ratio']:.2f}, "
+                f"freed {freed / 2**20:.1f} MiB, "
+                f"{stats['evictions']} evictions so far"
+            )
+        except Exception as e:
+            self.log.error("Cleaning the file cache failed")
+            self.log.exception(e)
+
+
+files = FileCache(os.path.join(os.getcwd(), "cache"))
+downloads = DownloadPool(files)
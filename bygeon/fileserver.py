@@ -0,0 +1,184 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+import secrets
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Tuple
+from urllib.parse import quote, unquote
+
+import bygeon.logger as logger
+from bygeon.filecache import FileCache, files
+from bygeon.metrics import registry
+
+
+class FileServer:
+    # Serves the attachment cache over HTTP, so a destination running on
+    # another host or in another container pulls files by URL rather than
+    # needing bygeon's file system or base64 payloads. Only files under the
+    # cache are served, and only through URLs carrying an expiry and an HMAC
+    # of the path, which go stale after ttl seconds.
+    def __init__(
+        self,
+        listen: str,
+        public_url: str,
+        cache: FileCache = files,
+        secret: str | None = None,
+        ttl: float = 600,
+    ) -> None:
+        host, _, port = listen.rpartition(":")
+        self.address = (host or "0.0.0.0", int(port))
+        self.public_url = public_url.rstrip("/")
+        self.cache = cache
+        self.secret = secret.encode() if secret else secrets.token_bytes(32)
+        self.ttl = ttl
+        self.log = logger.log.bind(FileServer=listen)
+        self.server: ThreadingHTTPServer | None = None
+
+    def sign(self, path: str, expires: int) -> str:
+        message = f"{expires}:{path}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:32]
+
+    # a URL for a file in the cache that stays valid for ttl seconds
+    def url(self, file_path: str) -> str:
+        path = os.path.relpath(file_path, self.cache.root)
+        expires = int(time.time() + self.ttl)
+        token = f"{expires}.{self.sign(path, expires)}"
+        return f"{self.public_url}/files/{token}/{quote(path)}"
+
+    # the file a request path stands for, None if it is not to be served
+    def resolve(self, request_path: str) -> str | None:
+        prefix, _, rest = request_path.lstrip("/").partition("/")
+        token, _, path = rest.partition("/")
+        path = unquote(path.partition("?")[0])
+        expires, _, signature = token.partition(".")
+        if prefix != "files" or not expires.isdigit():
+            return None
+        if int(expires) < time.time():
+            return None
+        if not hmac.compare_digest(signature, self.sign(path, int(expires))):
+            return None
+        root = os.path.realpath(self.cache.root)
+        file_path = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, file_path]) != root:
+            return None
+        return file_path if os.path.isfile(file_path) else None
+
+    def start(self) -> None:
+        if self.server is not None:
+            return None
+        self.server = ThreadingHTTPServer(self.address, handler(self))
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, name="fileserver", daemon=True).start()
+        self.log.info(f"Serving {self.cache.root} as {self.public_url}")
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# the byte range asked for, None for the whole file, ValueError if it cannot
+# be satisfied
+def parse_range(header: str, size: int) -> Tuple[int, int] | None:
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        # several ranges are answered with the whole file
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def handler(server: FileServer) -> type:
+    requests = registry.counter("file_server_requests")
+    sent = registry.counter("file_server_bytes")
+
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so large media is pulled over one connection
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self) -> None:
+            self.serve(body=False)
+
+        def do_GET(self) -> None:
+            self.serve(body=True)
+
+        def serve(self, body: bool) -> None:
+            requests.inc()
+            if (file_path := server.resolve(self.path)) is None:
+                self.send_error(404)
+                return None
+            stat = os.stat(file_path)
+            size = stat.st_size
+            # cached files are never written to again, so this stays valid
+            etag = f'"{stat.st_ino:x}-{size:x}"'
+            last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+            if self.not_modified(etag, stat.st_mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+
+            span = None
+            if (header := self.headers.get("Range")) is not None and self.fresh(etag):
+                try:
+                    span = parse_range(header, size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return None
+
+            start, end = span if span is not None else (0, size - 1)
+            length = end - start + 1 if size else 0
+            self.send_response(206 if span is not None else 200)
+            content_type = mimetypes.guess_type(file_path)[0]
+            self.send_header("Content-Type", content_type or "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Cache-Control", "private, max-age=600, immutable")
+            if span is not None:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if body and length:
+                with open(file_path, "rb") as f:
+                    self.wfile.flush()
+                    self.connection.sendfile(f, start, length)
+                sent.inc(length)
+
+        def not_modified(self, etag: str, mtime: float) -> bool:
+            if (match := self.headers.get("If-None-Match")) is not None:
+                return etag in match or match.strip() == "*"
+            if (since := self.headers.get("If-Modified-Since")) is not None:
+                try:
+                    return int(mtime) <= parsedate_to_datetime(since).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        # a range only applies to the version named by If-Range, if any
+        def fresh(self, etag: str) -> bool:
+            return self.headers.get("If-Range", etag) == etag
+
+        def log_message(self, format: str, *args) -> None:
+            server.log.debug(format % args)
+
+    return Handler
@@ -0,0 +1,24 @@
+from multiprocessing.connection import Connection
+from threading import Lock
+
+import orjson
+
+
+class Channel:
+    # A frame is the name of the worker it is meant for, a newline and an
+    # orjson list, so the supervisor routes frames without decoding them.
+    def __init__(self, conn: Connection) -> None:
+        self.conn = conn
+        self.lock = Lock()
+
+    def send(self, worker: str, *frame) -> None:
+        data = worker.encode() + b"\n" + orjson.dumps(frame)
+        with self.lock:
+            self.conn.send_bytes(data)
+
+    def recv(self) -> list:
+        return orjson.loads(self.conn.recv_bytes().partition(b"\n")[2])
+
+
+def destination(data: bytes) -> str:
+    return data.partition(b"\n")[0].decode()
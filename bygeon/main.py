@@ -1,69 +1,208 @@
+import os
 import tomli
 from time import sleep
 # from .messenger.slack import Slack
 from .messenger.discord import Discord
 from .messenger.cqhttp import CQHttp
 from .messenger.messenger import Messenger, Hub
-from typing import List
+from .store.retention import RetentionPolicy
+from .store.database import Database
+from .pipeline import Pipeline
+from .transport import transport
+from .metrics import registry
+from .filecache import files, downloads, Janitor
+from .media import transcoder
+from .scheduler import scheduler
+from .fileserver import FileServer
+from typing import Dict, TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from .aio.pipeline import AsyncPipeline
 
+# the key of the channel a hub links for each client
+LINKS = {
+    "Discord": "channel_id",
+    "CQHttp": "group_id",
+    # "Slack": "channel_id",
+}
 
-def main() -> None:
+
+def load_config() -> dict:
     with open("bygeon.toml", "rb") as f:
-        config = tomli.load(f)
+        return tomli.load(f)
+
+
+# Workers of the processes engine pass their name: the supervisor alone
+# cleans the shared file cache, while every process reports its own metrics.
+def configure(bygeon_config: dict, worker: str | None = None) -> None:
+    scheduler.configure(bygeon_config.get("scheduler_workers"))
+    transport.configure(
+        bygeon_config.get("http_pool_size"),
+        bygeon_config.get("connect_timeout"),
+        bygeon_config.get("read_timeout"),
+    )
+    if (metrics_interval := bygeon_config.get("metrics_interval")) is not None:
+        registry.report(metrics_interval, worker or "")
+
+    max_size = bygeon_config.get("cache_max_size")
+    max_age = bygeon_config.get("cache_max_age_days")
+    files.configure(
+        os.path.abspath(bygeon_config.get("cache_path", "cache")),
+        None if max_size is None else max_size * 2**20,
+        None if max_age is None else max_age * 86400,
+    )
+    if worker is None:
+        Janitor(files, bygeon_config.get("cache_janitor_interval", 300)).start()
+    downloads.configure(
+        bygeon_config.get("download_workers"),
+        bygeon_config.get("download_timeout"),
+    )
+    transcoder.configure(bygeon_config.get("media_workers"))
+
+
+def create_client(
+    name: str, client_config: dict, discord_class=Discord, cqhttp_class=CQHttp
+) -> Messenger:
+    match name:
+        case "Discord":
+            shards = client_config.get("shards", 1)
+            return discord_class(
+                client_config["bot_token"],
+                client_config.get("compress", False),
+                None if shards == "auto" else shards,
+            )
+        case "CQHttp":
+            ws_url = client_config.get("ws_url", "ws://localhost:8080/")
+            http_url = client_config.get("http_url", "http://localhost:5700/")
+
+            file_server = None
+            if (listen := client_config.get("file_server")) is not None:
+                file_server = FileServer(
+                    listen,
+                    client_config["file_server_url"],
+                    secret=client_config.get("file_server_secret"),
+                    ttl=client_config.get("file_server_ttl", 600),
+                )
+
+            return cqhttp_class(
+                ws_url,
+                http_url,
+                client_config.get("rate_limit", 5),
+                client_config.get("burst", 5),
+                file_server,
+            )
+        # case "Slack":
+        #     return Slack(
+        #         client_config["app_token"],
+        #         client_config["bot_token"],
+        #         client_config["channel_id"]
+        #     )
+        case _:
+            raise ValueError(f"Unknown client: {name}")
+
+
+def hub_name(i: int, hub_config: dict) -> str:
+    return hub_config.get("name", f"HUB-{i}")
+
+
+def create_database(bygeon_config: dict) -> Database | None:
+    if (database_path := bygeon_config.get("database")) is None:
+        return None
+    readers = bygeon_config.get("database_readers", 4)
+    backend = bygeon_config.get("backend", "sqlite")
+    return Database(database_path, True, readers, backend)
+
+
+def create_hub(
+    i: int,
+    hub_config: dict,
+    bygeon_config: dict,
+    database: Database | None,
+    pipeline,
+    hub_class=Hub,
+) -> Hub:
+    cache_size = hub_config.get("cache_size", 4096)
+    retention_days = hub_config.get("retention_days")
+    retention = RetentionPolicy(
+        retention_days * 86400 if retention_days is not None else None,
+        hub_config.get("retention_rows"),
+    )
+    return hub_class(
+        hub_name(i, hub_config),
+        hub_config.get("keep_data", True),
+        cache_size,
+        retention,
+        database,
+        hub_config.get("backend", bygeon_config.get("backend", "sqlite")),
+        pipeline,
+    )
+
+
+def main() -> None:
+    config = load_config()
 
     client_configs = config["Clients"]
+    bygeon_config = config.get("Bygeon", {})
+    engine = bygeon_config.get("engine", "threads")
+
+    configure(bygeon_config)
+
+    if engine == "processes":
+        from .supervisor import Supervisor
 
-    clients: List[Messenger] = []
+        Supervisor(config).run()
+        return None
 
-    if discord_config := client_configs.get("Discord"):
-        discord = Discord(
-            discord_config["bot_token"]
+    discord_class, cqhttp_class, hub_class = Discord, CQHttp, Hub
+    pipeline: Pipeline | AsyncPipeline
+    if engine == "asyncio":
+        # aiohttp is only needed by this engine
+        from .aio.discord import AsyncDiscord
+        from .aio.cqhttp import AsyncCQHttp
+        from .aio.hub import AsyncHub
+        from .aio.pipeline import AsyncPipeline
+        from .aio.transport import transport as async_transport
+
+        discord_class, cqhttp_class, hub_class = AsyncDiscord, AsyncCQHttp, AsyncHub
+        pipeline = AsyncPipeline(bygeon_config.get("concurrency", 64))
+        async_transport.configure(
+            bygeon_config.get("http_pool_size"),
+            bygeon_config.get("connect_timeout"),
+            bygeon_config.get("read_timeout"),
         )
-        clients.append(discord)
-
-    """
-    if slack_config := client_configs.get("Slack"):
-        slack = Slack(
-            slack_config["app_token"],
-            slack_config["bot_token"],
-            slack_config["channel_id"]
+    else:
+        pipeline = Pipeline(
+            bygeon_config.get("workers", 4),
+            bygeon_config.get("lanes", 8),
         )
-        clients.append(slack)
-    """
 
-    if cqhttp_config := client_configs.get("CQHttp"):
-        ws_url = cqhttp_config.get("ws_url", "ws://localhost:8080/")
-        http_url = cqhttp_config.get("http_url", "http://localhost:5700/")
+    clients: Dict[str, Messenger] = {
+        name: create_client(name, client_config, discord_class, cqhttp_class)
+        for name, client_config in client_configs.items()
+        if name in LINKS and client_config
+    }
+
+    database = create_database(bygeon_config)
 
-        cqhttp = CQHttp(
-            ws_url,
-            http_url
-        )
-        clients.append(cqhttp)
-    
     hub_configs = config["Hubs"]
     for (i, hub_config) in enumerate(hub_configs):
-        hub_name = hub_config.get("name", f"HUB-{i}")
-        keep_data = hub_config.get("keep_data", True)
-        hub = Hub(hub_name, keep_data)
-        """
-        if hub_slack := hub_config.get("Slack"):
-            c_id = hub_slack["channel_id"]
-            slack.add_hub(c_id, hub)
-            hub.add_linkee(slack, c_id)
-        """
-        if hub_discord := hub_config.get("Discord"):
-            c_id = hub_discord["channel_id"]
-            discord.add_hub(c_id, hub)
-            hub.add_linkee(discord, c_id)
-        if hub_cqhttp := hub_config.get("CQHttp"):
-            c_id = hub_cqhttp["group_id"]
-            cqhttp.add_hub(c_id, hub)
-            hub.add_linkee(cqhttp, c_id)
-        hub.init_database(keep_data)
-
-    for client in clients:
+        hub = create_hub(i, hub_config, bygeon_config, database, pipeline, hub_class)
+        # disable messengers by leaving out their block in the hub
+        for name, key in LINKS.items():
+            if (link := hub_config.get(name)) is not None and name in clients:
+                c_id = link[key]
+                clients[name].add_hub(c_id, hub)
+                hub.add_linkee(clients[name], c_id)
+        hub.init_database(hub_config.get("keep_data", True))
+
+    if engine == "asyncio":
+        from .aio.main import run
+
+        run(list(clients.values()), pipeline)  # type: ignore[arg-type]
+        return None
+
+    for client in clients.values():
+        client.pipeline = pipeline
         client.start()
 
     # XXX
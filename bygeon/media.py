@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock
+from typing import TYPE_CHECKING, Dict, List, Tuple, cast
+
+import bygeon.logger as logger
+from bygeon.filecache import Entry, FileCache, files
+from bygeon.message import Attachment, Message
+from bygeon.metrics import registry
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # pip install bygeon[media]
+    Image = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+    from bygeon.messenger.messenger import Capabilities
+
+# the types Pillow is asked to read and write
+FORMATS = {
+    "image/png": "PNG",
+    "image/apng": "PNG",
+    "image/gif": "GIF",
+    "image/jpeg": "JPEG",
+    "image/webp": "WEBP",
+}
+
+# attempts at shrinking an image below a size limit
+SHRINK_STEPS = 8
+
+
+def encode(frames: List, durations: List[int], fmt: str) -> bytes:
+    first, rest = frames[0], frames[1:]
+    if fmt == "JPEG":
+        first = first.convert("RGB")
+    options: dict = {}
+    if rest:
+        options = dict(save_all=True, append_images=rest, duration=durations, loop=0)
+        if fmt == "GIF":
+            options["disposal"] = 2
+    out = io.BytesIO()
+    first.save(out, fmt, **options)
+    return out.getvalue()
+
+
+# Runs in the pool's processes. Returns the temporary file written next to
+# the cache objects, its digest and its type, or None if it cannot be made
+# to fit.
+def transcode(
+    source: str, directory: str, content_type: str, max_size: int | None
+) -> Tuple[str, str, str] | None:
+    with Image.open(source) as image:
+        frames, durations = [], []
+        for frame in ImageSequence.Iterator(image):
+            durations.append(frame.info.get("duration", 100))
+            frames.append(frame.convert("RGBA"))
+    if len(frames) > 1 and content_type in ("image/png", "image/jpeg"):
+        # keep it animated
+        content_type = "image/gif"
+    fmt = FORMATS[content_type]
+
+    data = encode(frames, durations, fmt)
+    steps = 0
+    while max_size is not None and len(data) > max_size:
+        if steps == SHRINK_STEPS:
+            return None
+        steps += 1
+        scale = max(0.1, (max_size / len(data)) ** 0.5 * 0.9)
+        frames = [
+            f.resize(
+                (max(1, int(f.width * scale)), max(1, int(f.height * scale))),
+                Image.LANCZOS,
+            )
+            for f in frames
+        ]
+        data = encode(frames, durations, fmt)
+
+    fd, path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path, hashlib.sha256(data).hexdigest(), content_type
+
+
+class Transcoder:
+    # Converts images to types a destination handles better and shrinks the
+    # ones over its upload limit, on a pool of processes so the work never
+    # holds the GIL of the gateway and lane threads. Results are cached by
+    # the digest of their source and the variant asked for, so every
+    # derivative is made once however many destinations and retries ask.
+    # Without Pillow attachments are passed on as they are.
+    def __init__(self, cache: FileCache, workers: int = 2) -> None:
+        self.cache = cache
+        self.workers = workers
+        self.executor: ProcessPoolExecutor | None = None
+        self.inflight: Dict[Tuple[str, str], Future] = {}
+        self.lock = Lock()
+        self.log = logger.log.bind(Transcoder="")
+        self.derived = registry.counter("media_derived")
+        self.reused = registry.counter("media_reused")
+        self.failures = registry.counter("media_failures")
+
+    def configure(self, workers: int | None = None) -> None:
+        with self.lock:
+            if workers is not None and workers != self.workers:
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+                self.workers = workers
+
+    @property
+    def available(self) -> bool:
+        return Image is not None and self.workers > 0
+
+    def pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    # the type and size limit to produce for a destination, None to pass
+    # the attachment on as it is
+    def target(
+        self, a: Attachment, capabilities: "Capabilities"
+    ) -> Tuple[str, int | None] | None:
+        if not self.available or a.type not in FORMATS:
+            return None
+        content_type = capabilities.convert.get(a.type, a.type)
+        limit = capabilities.max_size
+        oversized = limit is not None and a.size is not None and a.size > limit
+        if content_type == a.type and not oversized:
+            return None
+        return content_type, limit
+
+    def submit(self, a: Attachment, target: Tuple[str, int | None]) -> Future:
+        result: Future = Future()
+        if a.file_path is None or (digest := self.cache.digest_of(a.file_path)) is None:
+            result.set_result(None)
+            return result
+        content_type, limit = target
+        variant = f"{content_type}:{limit}"
+        if (entry := self.cache.derivative(digest, variant)) is not None:
+            self.reused.inc()
+            result.set_result(entry)
+            return result
+
+        pool = self.pool()
+        with self.lock:
+            if (shared := self.inflight.get((digest, variant))) is not None:
+                return shared
+            self.inflight[(digest, variant)] = result
+
+        def done(job: Future) -> None:
+            try:
+                if (made := job.result()) is None:
+                    result.set_result(None)
+                else:
+                    path, derived, made_type = made
+                    entry = Entry(derived, made_type)
+                    self.cache.add_derivative(digest, variant, path, entry)
+                    self.derived.inc()
+                    result.set_result(entry)
+            except Exception as e:
+                result.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.inflight[(digest, variant)]
+
+        try:
+            job = pool.submit(
+                transcode, a.file_path, self.cache.objects, content_type, limit
+            )
+        except Exception as e:
+            # e.g. a pool process died
+            done_with_error: Future = Future()
+            done_with_error.set_exception(e)
+            job = done_with_error
+            with self.lock:
+                self.executor = None
+        job.add_done_callback(done)
+        return result
+
+    def apply(self, a: Attachment, future: Future | None) -> Attachment:
+        if future is None:
+            return a
+        try:
+            entry = future.result()
+        except Exception as e:
+            self.log.error(f"Failed to transcode {a.name}: {type(e).__name__} {e}")
+            self.failures.inc()
+            return a
+        if entry is None:
+            # cannot be made to fit, the hub links it instead
+            return a
+        path = cast(str, a.file_path)
+        directory = os.path.dirname(os.path.dirname(path))
+        filename = os.path.splitext(os.path.basename(path))[0]
+        path = self.cache.link(entry, directory, filename)
+        return a._replace(
+            type=entry.content_type, file_path=path, size=os.path.getsize(path)
+        )
+
+    def futures(self, m: Message, capabilities: "Capabilities") -> List[Future | None]:
+        return [
+            None if (target := self.target(a, capabilities)) is None
+            else self.submit(a, target)
+            for a in m.attachments
+        ]
+
+    # the message with its attachments fitted to a destination
+    def fit(self, m: Message, capabilities: "Capabilities") -> Message:
+        if not self.available:
+            return m
+        futures = self.futures(m, capabilities)
+        if not any(futures):
+            return m
+        attachments = [self.apply(a, f) for a, f in zip(m.attachments, futures)]
+        return m._replace(attachments=attachments)
+
+    # Hashing, the derivative index and linking touch the disk and index.db,
+    # they run on the executor; only the wait for the pool is on the loop.
+    async def fit_async(self, m: Message, capabilities: "Capabilities") -> Message:
+        from bygeon.aio.pipeline import blocking
+
+        if not self.available:
+            return m
+        futures = await blocking(self.futures, m, capabilities)
+        if not any(futures):
+            return m
+        # errors are read and logged by apply
+        await asyncio.gather(
+            *(asyncio.wrap_future(f) for f in futures if f is not None),
+            return_exceptions=True,
+        )
+        attachments = await blocking(
+            lambda: [self.apply(a, f) for a, f in zip(m.attachments, futures)]
+        )
+        return m._replace(attachments=attachments)
+
+
+transcoder = Transcoder(files)
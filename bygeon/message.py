@@ -1,15 +1,30 @@
 from typing import NamedTuple, List
 from enum import Enum
 
+import orjson
+
 class AttachmentType(Enum):
     IMAGE = "image"
     VIDEO = "video"
     AUDIO = "audio"
 
+# how to download an attachment into the file cache
+class Download(NamedTuple):
+    name: str
+    type: str | None
+    url: str
+    directory: str
+    filename: str
+
+# Attachments arrive as handles on their source and are only fetched, by
+# the hub, when some destination needs the bytes; file_path is None until
+# then.
 class Attachment(NamedTuple):
     name: str
     type: str | None
-    file_path: str
+    file_path: str | None
+    source: Download | None = None
+    size: int | None = None
 
 class Message(NamedTuple):
     origin: str
@@ -19,3 +34,35 @@ class Message(NamedTuple):
     author_username: str
     text: str
     attachments: List[Attachment]
+
+
+def attachment_to_dict(a: Attachment) -> dict:
+    data = a._asdict()
+    if a.source is not None:
+        data["source"] = a.source._asdict()
+    return data
+
+
+def attachment_from_dict(data: dict) -> Attachment:
+    if (source := data.get("source")) is not None:
+        data = {**data, "source": Download(**source)}
+    return Attachment(**data)
+
+
+def message_to_dict(m: Message) -> dict:
+    data = m._asdict()
+    data["attachments"] = [attachment_to_dict(a) for a in m.attachments]
+    return data
+
+
+def message_from_dict(data: dict) -> Message:
+    attachments = [attachment_from_dict(a) for a in data["attachments"]]
+    return Message(**{**data, "attachments": attachments})
+
+
+def dump_message(m: Message) -> bytes:
+    return orjson.dumps(message_to_dict(m))
+
+
+def load_message(raw: bytes) -> Message:
+    return message_from_dict(orjson.loads(raw))
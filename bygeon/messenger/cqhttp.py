@@ -1,5 +1,6 @@
 import threading
-from typing import Dict, Union, cast
+import time
+from typing import Dict, List, Tuple, Union, cast
 from urllib.parse import urljoin
 
 from websocket import WebSocketApp as WSApp
@@ -7,13 +8,31 @@ from websocket import WebSocketApp as WSApp
 import orjson
 import requests
 
-import bygeon.util as util
-from bygeon.message import Message, Attachment
-from .definition.cqhttp import WSMessage, PostType, Endpoints
-from .messenger import Messenger, Hub
+from bygeon.fileserver import FileServer
+from bygeon.metrics import registry
+from bygeon.ratelimit import TokenBucketLimiter
+from bygeon.scheduler import scheduler, Timer
+from bygeon.transport import transport
+from bygeon.message import Message, Attachment, Download
+from .definition.cqhttp import WSMessage, PostType, Endpoints, MetaEventType
+from .messenger import Messenger, Hub, Capabilities, DeliveryError
+
+# heartbeat intervals without a heartbeat after which the connection is
+# taken for dead
+STALE_AFTER = 3
 
 
 class CQHttp(Messenger):
+    # go-cqhttp fetches remote files itself, and only images and videos
+    # map to a CQ code of their own; QQ shows APNG and WebP poorly and
+    # chokes on large images
+    capabilities = Capabilities(
+        frozenset({"image", "video"}),
+        max_size=20 * 2**20,
+        urls=True,
+        convert={"image/apng": "image/gif", "image/webp": "image/png"},
+    )
+
     @property
     def send_url(self) -> str:
         return urljoin(self.http_url, Endpoints.SEND_GROUP_MESSAGE)
@@ -26,31 +45,76 @@ class CQHttp(Messenger):
     def member_list_url(self) -> str:
         return urljoin(self.http_url, Endpoints.GET_GROUP_MEMBER_LIST)
 
-    def __init__(self, ws_url: str, http_url: str) -> None:
+    def __init__(
+        self,
+        ws_url: str,
+        http_url: str,
+        rate_limit: float = 5,
+        burst: int = 5,
+        file_server: FileServer | None = None,
+    ) -> None:
         self.log = self.get_logger()
+        # hands go-cqhttp URLs instead of local paths when set
+        self.file_server = file_server
+        self.limiter = TokenBucketLimiter(self.name, rate_limit, burst)
         self.ws_url = ws_url
         self.http_url = http_url
         self.nickname_dict: Dict[str, Dict[int, str]] = {}
+        # go-cqhttp sends a heartbeat meta event every interval, if enabled
+        self.heartbeat_interval: float | None = None
+        self.last_heartbeat = time.monotonic()
+        self.missed_heartbeats = registry.counter("cqhttp_missed_heartbeats", self.name)
+        self.watchdog_timer: Timer | None = None
 
         self.hubs = {}
 
     def get_nicknames(self, c_id) -> dict:
         payload = {"group_id": int(c_id)}
-        r = requests.post(self.member_list_url, json=payload)
+        r = self.limiter.request("POST", self.member_list_url, json=payload)
         member_list = orjson.loads(r.text)["data"]
         nickname_dict: Dict[int, str] = {}
         for member in member_list:
             nickname_dict[member["user_id"]] = member["card"]
         return nickname_dict
 
+    def opened(self) -> None:
+        self.last_heartbeat = time.monotonic()
+
+    def on_heartbeat(self, wsm: WSMessage) -> None:
+        self.last_heartbeat = time.monotonic()
+        self.heartbeat_interval = wsm.get("interval", 5000) / 1000
+
+    # True once heartbeats were seen and then stopped coming
+    @property
+    def stale(self) -> bool:
+        if self.heartbeat_interval is None:
+            return False
+        elapsed = time.monotonic() - self.last_heartbeat
+        if elapsed < self.heartbeat_interval * STALE_AFTER:
+            return False
+        self.log.warning(f"No heartbeat for {elapsed:.0f}s, reconnecting")
+        self.missed_heartbeats.inc()
+        return True
+
+    def watchdog(self, ws: WSApp) -> None:
+        if self.stale:
+            self.drop(ws)
+
     def on_open(self, ws) -> None:
         self._on_open(ws)
+        self.opened()
+        self.watchdog_timer = scheduler.call_every(
+            self.heartbeat_interval or 5, self.watchdog, ws, urgent=True
+        )
 
     def on_error(self, ws, e) -> None:
         self._on_error(ws, e)
 
     def on_close(self, ws, close_status_code, close_msg) -> None:
         self._on_close(ws, close_status_code, close_msg)
+        if self.watchdog_timer is not None:
+            self.watchdog_timer.cancel()
+            self.watchdog_timer = None
         self.reconnect()
 
     def on_message(self, ws: WSApp, message: str) -> None:
@@ -58,15 +122,23 @@ class CQHttp(Messenger):
         self.log.debug(message)
 
         post_type = ws_message["post_type"]
+        key = f"{self.name}:{ws_message.get('group_id')}"
 
         match post_type:
             case PostType.MESSAGE:
-                self.handle_message(ws_message)
+                self.pipeline.submit(key, self.handle_message, ws_message)
             case PostType.NOTICE:
-                self.handle_notice(ws_message)
-                
+                self.pipeline.submit(key, self.handle_notice, ws_message)
+            case PostType.META_EVENT:
+                if ws_message["meta_event_type"] == MetaEventType.HEARTBEAT:
+                    self.on_heartbeat(ws_message)
 
     def handle_notice(self, wsm: WSMessage):
+        if (parsed := self.parse_notice(wsm)) is not None:
+            hub, recalled_id = parsed
+            hub.recall_hub_message(self.name, recalled_id)
+
+    def parse_notice(self, wsm: WSMessage) -> Tuple[Hub, str] | None:
         if (group_id := wsm.get("group_id")) is None:
             return None
         c_id = str(group_id)
@@ -74,10 +146,15 @@ class CQHttp(Messenger):
             return None
         if wsm["self_id"] == wsm["user_id"]:
             return None
-        recalled_id = wsm["message_id"]
-        hub.recall_hub_message(self.name, recalled_id)
+        return hub, wsm["message_id"]
 
     def handle_message(self, wsm: WSMessage):
+        if (parsed := self.parse_message(wsm)) is None:
+            return None
+        hub, m = parsed
+        hub.new_hub_message(m)
+
+    def parse_message(self, wsm: WSMessage) -> Tuple[Hub, Message] | None:
         ref_id = None
         message_id = wsm["message_id"]
         self.log.info(f"Handling message {message_id}")
@@ -97,7 +174,7 @@ class CQHttp(Messenger):
 
         data = wsm["message"]
         text = ""
-        attachments = []
+        attachments: List[Attachment] = []
         for d in data:
             if d["type"] == "reply":
                 is_reply = True
@@ -112,17 +189,18 @@ class CQHttp(Messenger):
                 fn = d["data"]["file"]
                 filename = f"{self.name}_{fn}"
                 path = self.generate_cache_path(self.name)
-                file_path = util.download_to_cache(url, path, filename)
-                attachments.append(Attachment(fn, "image", file_path))
+                d = Download(fn, "image", url, path, filename)
+                attachments.append(Attachment(fn, "image", None, d))
         m = Message(self.name, c_id, m_id, ref_id, author, text, attachments)
-        hub.new_hub_message(m)
+        return hub, m
 
     def recall_message(self, m_id: str, c_id: None | str) -> None:
         payload = {
             "message_id": m_id,
         }
-        r = requests.post(self.recall_url, json=payload)
+        r = self.limiter.request("POST", self.recall_url, json=payload)
         self.log.info("Trying to recall: " + m_id)
+        self.check_response(r)
 
     def modify_message(self, m: Message, c_id: str, m_id: str) -> None:
         self.recall_message(m_id, c_id)
@@ -142,32 +220,49 @@ class CQHttp(Messenger):
 
         payload: dict[str, Union[str, int]] = {
             "group_id": int(c_id),
-            "message": "",
+            "message": self.format_message(m, ref_id),
         }
+
+        r = self.limiter.request("POST", self.send_url, json=payload)
+        
+
+        response = self.check_response(r)
+        message_id = response.get("data").get("message_id")
+        hub.update_entry(m, self.name, message_id)
+
+    def format_message(self, m: Message, ref_id=None) -> str:
         message_string = ""
         for attachment in m.attachments:
-            main_type = attachment.type.split("/")[0]
-            message_string += f"[CQ:{main_type},file=file:{attachment.file_path}]"
+            main_type = (attachment.type or "image").split("/")[0]
+            if attachment.file_path is not None and self.file_server is not None:
+                file = escape(self.file_server.url(attachment.file_path))
+            elif attachment.file_path is not None:
+                file = f"file:{attachment.file_path}"
+            else:
+                file = escape(cast(Download, attachment.source).url)
+            message_string += f"[CQ:{main_type},file={file}]"
 
         if ref_id is not None:
             message_string += f"[CQ:reply,id={ref_id}]"
         message_string += f"[{m.author_username}]: {m.text}"
         self.log.info(f"Sending message with CQCode: {message_string}")
-        payload["message"] = message_string
-        
-
-        r = requests.post(self.send_url, json=payload)
-        
+        return message_string
 
+    def check_response(self, r: requests.Response) -> dict:
+        r.raise_for_status()
         response = r.json()
-        message_id = response.get("data").get("message_id")
-        hub.update_entry(m, self.name, message_id)
+        if response.get("status") == "failed":
+            raise DeliveryError(response.get("wording") or response.get("msg"))
+        return response
     def add_hub(self, c_id: str , hub: Hub):
         self.hubs[c_id] = hub
 
         self.nickname_dict[c_id] = self.get_nicknames(c_id)
 
     def start(self) -> None:
+        transport.prewarm(self.http_url)
+        if self.file_server is not None:
+            self.file_server.start()
         self.ws = WSApp(
             self.ws_url,
             on_open=self.on_open,
@@ -179,3 +274,12 @@ class CQHttp(Messenger):
         self.thread.daemon = True
         self.thread.start()
 
+
+# escape a CQ code parameter
+def escape(value: str) -> str:
+    return (
+        value.replace("&", "&amp;")
+        .replace("[", "&#91;")
+        .replace("]", "&#93;")
+        .replace(",", "&#44;")
+    )
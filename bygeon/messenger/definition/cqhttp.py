@@ -57,3 +57,4 @@ class WSMessage(TypedDict):
     message: List[CQMessage]
     self_id: NotRequired[int]
     user_id: NotRequired[int]
+    interval: NotRequired[int]
@@ -4,10 +4,15 @@ from typing_extensions import NotRequired
 
 class Endpoints:
     GATEWAY = "wss://gateway.discord.gg/?v=10&encoding=json"
+    # appended to the resume_gateway_url from READY
+    GATEWAY_QUERY = "/?v=10&encoding=json"
+    API = "https://discordapp.com/api"
+    GATEWAY_BOT = "https://discordapp.com/api/gateway/bot"
     SEND_MESSAGE = "https://discordapp.com/api/channels/{}/messages"
     DELETE_MESSAGE = "https://discordapp.com/api/channels/{}/messages/{}"
     EDIT_MESSAGE = "https://discordapp.com/api/channels/{}/messages/{}"
     GET_EMOJI = "https://cdn.discordapp.com/emojis/{}"
+    GET_STICKER = "https://media.discordapp.net/stickers/{}"
     GET_CHANNEL = "https://discordapp.com/api/channels/{}"
     LIST_GUILD_MEMBERS = "https://discordapp.com/api/guilds/{}/members"
 
@@ -40,6 +45,19 @@ class GatewayEvent(TypedDict):
     heartbeat_interval: int
 
 
+class SessionStartLimit(TypedDict):
+    total: int
+    remaining: int
+    reset_after: int
+    max_concurrency: int
+
+
+class GatewayBot(TypedDict):
+    url: str
+    shards: int
+    session_start_limit: SessionStartLimit
+
+
 class UnavailableGuild(TypedDict):
     id: str
     unavailable: bool
@@ -182,6 +200,7 @@ class ReadyEvent(TypedDict):
     user: User
     guilds: List[UnavailableGuild]
     session_id: str
+    resume_gateway_url: str
     shard: Optional[List[int]]
     application: Application
 
@@ -200,12 +219,19 @@ class Opcode:
     PRESENCE_UPDATE = 3
     RESUME = 6
     RECONNECT = 7
+    INVALID_SESSION = 9
     HELLO = 10
     HEARTBEAT_ACK = 11
 
 
+class Intent:
+    GUILD_MESSAGES = 1 << 9
+    MESSAGE_CONTENT = 1 << 15
+
+
 class EventName:
     MESSAGE_CREATE = "MESSAGE_CREATE"
     MESSAGE_UPDATE = "MESSAGE_UPDATE"
     MESSAGE_DELETE = "MESSAGE_DELETE"
     READY = "READY"
+    RESUMED = "RESUMED"
@@ -1,22 +1,28 @@
+import random
 import threading
 import time
 import re
-from io import BytesIO
+import zlib
 from os.path import basename
-from typing import cast, List, Dict, Any, Union, Optional
+from typing import cast, List, Dict, Tuple, Any, Union, Iterator
 
 from websocket import WebSocketApp as WSApp
 
 import requests
 import orjson
 
-import bygeon.util as util
-from bygeon.message import Message, Attachment
-from .messenger import Messenger, Hub
+from bygeon.metrics import registry
+from bygeon.ratelimit import DiscordLimiter
+from bygeon.transport import transport
+from bygeon.message import Message, Attachment, Download
+from bygeon.relay import relay, Field, Multipart
+from bygeon.scheduler import scheduler, Timer
+from .messenger import Messenger, Hub, Capabilities
 from .definition.discord import (
     MessageUpdateEvent,
     Opcode,
     EventName,
+    Intent,
     WebsocketMessage,
     Endpoints,
     GuildMember,
@@ -26,59 +32,320 @@ from .definition.discord import (
     ReadyEvent,
     Hello,
     MessageDeleteEvent,
+    GatewayBot,
 )
 
 
-class Discord(Messenger):
-    session_id: Optional[str]
-    sequence: Optional[int]
+# close codes after which the session cannot be resumed
+FRESH_SESSION = {4007, 4009}
+# close codes after which connecting again is pointless
+FATAL = {4004, 4010, 4011, 4012, 4013, 4014}
+# closing with 1000 or 1001 would end the session, so it is closed with
+# this to resume it
+RESUME_CLOSE = 4000
+
+# dispatches bygeon acts on, any other is dropped without being decoded
+HANDLED = {
+    EventName.READY,
+    EventName.RESUMED,
+    EventName.MESSAGE_CREATE,
+    EventName.MESSAGE_UPDATE,
+    EventName.MESSAGE_DELETE,
+}
+# Discord puts the event name and sequence of a dispatch before its data
+DISPATCH_HEAD = re.compile(r'\{"t":"(\w+)","s":(\d+),"op":0,')
+CHANNEL_ID = '"channel_id":"'
+
+# every compressed gateway message ends with a Z_SYNC_FLUSH
+ZLIB_SUFFIX = b"\x00\x00\xff\xff"
+
+
+# the channel ids a raw dispatch names, str.find outruns a regex on long text
+def channel_ids(message: str) -> Iterator[str]:
+    i = message.find(CHANNEL_ID)
+    while i != -1:
+        start = i + len(CHANNEL_ID)
+        end = message.find('"', start)
+        yield message[start:end]
+        i = message.find(CHANNEL_ID, end)
+
+
+class ZlibStream:
+    # zlib-stream transport compression: one zlib context spans the whole
+    # connection, and a message may arrive in several frames, complete once
+    # the buffer ends with the flush suffix.
+    def __init__(self) -> None:
+        self.inflator = zlib.decompressobj()
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> bytes | None:
+        self.buffer += data
+        if self.buffer[-4:] != ZLIB_SUFFIX:
+            return None
+        message = self.inflator.decompress(self.buffer)
+        self.buffer.clear()
+        return message
+
+
+# seconds between two IDENTIFYs of one bucket
+IDENTIFY_INTERVAL = 5
+
+
+class IdentifyBuckets:
+    # Discord lets max_concurrency shards identify every five seconds, shard
+    # i in bucket i % max_concurrency. Resuming is not limited.
+    def __init__(self, max_concurrency: int = 1) -> None:
+        self.max_concurrency = max_concurrency
+        self.next: Dict[int, float] = {}
+        self.lock = threading.Lock()
+
+    # seconds shard_id waits before it identifies, taking its bucket's turn
+    def reserve(self, shard_id: int) -> float:
+        key = shard_id % self.max_concurrency
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next.get(key, now))
+            self.next[key] = at + IDENTIFY_INTERVAL
+        return at - now
+
+
+class Shard:
+    # One gateway connection of a Discord client, with a session, sequence
+    # and heartbeat of its own. Discord sends the events of a guild on shard
+    # (guild_id >> 22) % count only, so every channel is served by one shard
+    # and shards share nothing but the client's hubs and pipeline.
+    def __init__(self, client: "Discord", shard_id: int, count: int) -> None:
+        self.client = client
+        self.id = shard_id
+        self.count = count
+        self.sequence: int | None = None
+        self.session_id: str | None = None
+        self.resume_url: str | None = None
+        # zlib-stream transport compression, with a context per connection
+        self.stream: ZlibStream | None = None
+        label = f"{client.name}:{shard_id}"
+        self.wire_bytes = registry.counter("gateway_wire_bytes", label)
+        self.message_bytes = registry.counter("gateway_message_bytes", label)
+        # a heartbeat goes unanswered only on a dead connection
+        self.acked = True
+        self.beat_sent: float | None = None
+        self.latency = registry.histogram("gateway_latency", label)
+        self.missed_acks = registry.counter("gateway_missed_acks", label)
+        self.dropped = registry.counter("gateway_frames_dropped", label)
+        self.processed = registry.counter("gateway_frames_processed", label)
+        # delayed jobs of the current connection
+        self.timers: List[Timer] = []
+        self.handshake_timer: Timer | None = None
+        self.log = client.log.bind(Shard=f"{shard_id}/{count}")
+
+    # A session is resumed on the gateway READY named, with the sequence of
+    # the last event seen; Discord then replays what was missed in between
+    # as ordinary dispatches.
+    @property
+    def resumable(self) -> bool:
+        return None not in (self.session_id, self.sequence, self.resume_url)
 
-    def __init__(self, bot_token: str) -> None:
-        self.token = bot_token
-        self.sequence = None
+    def forget_session(self) -> None:
         self.session_id = None
+        self.sequence = None
+        self.resume_url = None
 
-        self.hubs = {}
-        self.nickname_dict: Dict[str, Dict[str, str]] = {}
+    @property
+    def gateway_url(self) -> str:
+        url = self.client.gateway
+        if self.resumable:
+            url = cast(str, self.resume_url).rstrip("/") + Endpoints.GATEWAY_QUERY
+        if self.client.compress:
+            url += "&compress=zlib-stream"
+        return url
+
+    def reconnect_delay(self, code: int | None) -> float | None:
+        if code in FATAL:
+            self.log.error(f"Gateway refused the connection with {code}, giving up")
+            return None
+        if code in FRESH_SESSION:
+            self.forget_session()
+        return 0 if self.resumable else 1
 
-        self.log = self.get_logger()
+    # what to answer HELLO with
+    @property
+    def handshake_payload(self) -> bytes:
+        if self.resumable:
+            self.log.info(f"Resuming session after {self.sequence}")
+            return self.resume_payload
+        return self.identity_payload
 
-    def add_hub(self, c_id: str, hub: Hub):
-        self.hubs[c_id] = hub
+    # seconds to wait before the handshake, only IDENTIFY has to wait
+    def handshake_delay(self) -> float:
+        return 0 if self.resumable else self.client.buckets.reserve(self.id)
 
-        self.nickname_dict[c_id] = self.get_nicknames(c_id)
+    @property
+    def identity_payload(self) -> bytes:
+        payload: Dict[str, Union[dict, Any]] = {
+            "op": Opcode.IDENTIFY,
+            "d": {
+                "token": self.client.token,
+                "properties": {
+                    "os": "linux",
+                    "browser": "bygeon",
+                    "device": "bygeon",
+                },
+                "large_threshold": 250,
+                "compress": False,
+                "intents": self.client.intents,
+                "shard": [self.id, self.count],
+            },
+        }
+        return orjson.dumps(payload)
 
     @property
-    def headers(self):
-        return {"Authorization": f"Bot {self.token}"}
+    def resume_payload(self) -> bytes:
+        payload = {
+            "op": Opcode.RESUME,
+            "d": {
+                "token": self.client.token,
+                "session_id": self.session_id,
+                "seq": self.sequence,
+            },
+        }
+        return orjson.dumps(payload)
+
+    # True to reconnect and resume, False to identify again on this
+    # connection once the returned delay has passed
+    def invalid_session(self, resumable: bool) -> Tuple[bool, float]:
+        if resumable and self.resumable:
+            return True, 0
+        self.log.warning("Session invalidated, identifying again")
+        self.forget_session()
+        # Discord asks for a random wait of one to five seconds
+        return False, random.uniform(1, 5)
+
+    def ready(self, data: ReadyEvent) -> None:
+        self.client.bot_id = data["user"]["id"]
+        self.session_id = data["session_id"]
+        self.resume_url = data["resume_gateway_url"]
+
+    def opened(self) -> None:
+        self.stream = ZlibStream() if self.client.compress else None
+        self.acked = True
+        self.beat_sent = None
+
+    def decode(self, data: bytes) -> str | None:
+        self.wire_bytes.inc(len(data))
+        if self.stream is not None:
+            if (message := self.stream.feed(data)) is None:
+                return None
+            data = message
+        self.message_bytes.inc(len(data))
+        return data.decode()
+
+    @property
+    def heartbeat_payload(self) -> bytes:
+        return orjson.dumps({"op": Opcode.HEARTBEAT, "d": self.sequence})
+
+    # the next heartbeat, None if the last one was never acknowledged and the
+    # connection is to be dropped
+    def next_heartbeat(self) -> bytes | None:
+        if not self.acked:
+            self.log.warning("Heartbeat not acknowledged, reconnecting")
+            self.missed_acks.inc()
+            return None
+        self.acked = False
+        self.beat_sent = time.monotonic()
+        return self.heartbeat_payload
+
+    def heartbeat_ack(self) -> None:
+        # heartbeats asked for by the gateway are acknowledged as well
+        if self.beat_sent is not None:
+            self.latency.observe(time.monotonic() - self.beat_sent)
+            self.beat_sent = None
+        self.acked = True
+
+    # Most of the gateway's traffic is of no use to any hub, so dispatches
+    # are screened by their name and the channels they mention, read off the
+    # raw frame, and dropped before the frame is decoded. A dispatch counts
+    # as seen for resuming all the same. Frames laid out differently are
+    # decoded as usual.
+    def screen(self, message: str) -> bool:
+        if (head := DISPATCH_HEAD.match(message)) is None:
+            self.processed.inc()
+            return True
+        event = head[1]
+        wanted = event in HANDLED
+        if wanted and event.startswith("MESSAGE_"):
+            # a reply names the channel of the message it replies to as well
+            wanted = any(c in self.client.hubs for c in channel_ids(message))
+        if not wanted:
+            self.sequence = int(head[2])
+            self.dropped.inc()
+            return False
+        self.processed.inc()
+        return True
+
+    # the pipeline key of a dispatch, events of one channel keep their order
+    def key(self, ws_message: WebsocketMessage) -> str:
+        c_id = cast(dict, ws_message["d"]).get("channel_id")
+        return f"{self.client.name}:{c_id}"
+
+    def cancel_timers(self) -> None:
+        for timer in self.timers:
+            timer.cancel()
+        self.timers.clear()
+        if self.handshake_timer is not None:
+            self.handshake_timer.cancel()
+            self.handshake_timer = None
 
     def on_open(self, ws) -> None:
-        self._on_open(ws)
+        self.log.info("Opened WebSocket connection")
+        self.opened()
 
     def on_error(self, ws, e) -> None:
-        self._on_error(ws, e)
+        self.log.error("WebSocket encountered error")
+        self.log.exception(e)
 
     def on_close(self, ws, close_status_code, close_msg) -> None:
-        self._on_close(ws, close_status_code, close_msg)
-        self.reconnect()
+        self.log.error(f"WebSocket closed: {close_msg}")
+        self.cancel_timers()
+        if (delay := self.reconnect_delay(close_status_code)) is not None:
+            scheduler.call_later(delay, self.start)
+
+    # A handshake still waiting for its bucket belongs to the previous HELLO
+    # or session and is replaced, so only one IDENTIFY or RESUME is sent.
+    # The payload is built when it is sent, with the session as it is then.
+    def handshake(self, ws: WSApp, delay: float = 0) -> None:
+        if self.handshake_timer is not None:
+            self.handshake_timer.cancel()
+            self.handshake_timer = None
+        if (delay := delay + self.handshake_delay()) > 0:
+            self.log.info(f"Sending handshake in {delay:.1f}s")
+            self.handshake_timer = scheduler.call_later(
+                delay, self.send_handshake, ws, urgent=True
+            )
+        else:
+            ws.send(self.handshake_payload)
 
-    def heartbeat(self, ws: WSApp, interval: int) -> None:
-        log = self.log.bind(Action="Heartbeat")
-        payload = {
-            "op": 1,
-            "d": None,
-        }
-        while True:
-            time.sleep(interval / 1000)
-            if ws.sock is not None:
-                log.debug("Sending heartbeat")
-                ws.send(orjson.dumps(payload))
-            else:
-                break
-
-    def on_message(self, ws: WSApp, message: str) -> None:
+    def send_handshake(self, ws: WSApp) -> None:
+        self.handshake_timer = None
+        ws.send(self.handshake_payload)
+
+    def heartbeat(self, ws: WSApp) -> None:
+        if (payload := self.next_heartbeat()) is None:
+            self.cancel_timers()
+            self.client.drop(ws)
+            return None
+        self.log.debug("Sending heartbeat", Action="Heartbeat")
+        ws.send(payload)
+
+    def on_message(self, ws: WSApp, message: str | bytes) -> None:
         log = self.log.bind(Action="OnMessage")
 
+        if isinstance(message, bytes):
+            if (text := self.decode(message)) is None:
+                return None
+            message = text
+
+        if not self.screen(message):
+            return None
         log.debug(message)
 
         ws_message: WebsocketMessage = orjson.loads(message)
@@ -87,25 +354,132 @@ class Discord(Messenger):
         match opcode:
             case Opcode.HELLO:
                 hello = cast(Hello, ws_message["d"])
-                heartbeat_interval = hello["heartbeat_interval"]
-                self.send_identity(ws)
-                threading.Thread(
-                    target=self.heartbeat, args=(ws, heartbeat_interval), daemon=True
-                ).start()
+                interval = hello["heartbeat_interval"] / 1000
+                self.handshake(ws)
+                # the first one is jittered, so clients reconnecting together
+                # spread out
+                self.timers.append(
+                    scheduler.call_every(
+                        interval,
+                        self.heartbeat,
+                        ws,
+                        delay=interval * random.random(),
+                        urgent=True,
+                    )
+                )
             case Opcode.HEARTBEAT:
-                # TODO
-                pass
+                ws.send(self.heartbeat_payload)
+            case Opcode.HEARTBEAT_ACK:
+                self.heartbeat_ack()
+            case Opcode.RECONNECT:
+                log.info("Gateway asked to reconnect")
+                ws.close(status=RESUME_CLOSE)
+            case Opcode.INVALID_SESSION:
+                again, delay = self.invalid_session(bool(ws_message["d"]))
+                if again:
+                    ws.close(status=RESUME_CLOSE)
+                else:
+                    self.handshake(ws, delay)
             case Opcode.DISPATCH:
-
-                self.handle_dispatch(ws_message)
+                self.sequence = ws_message["s"]
+                # READY sets up state every later event relies on
+                if ws_message["t"] == EventName.READY:
+                    self.ready(cast(ReadyEvent, ws_message["d"]))
+                elif ws_message["t"] == EventName.RESUMED:
+                    log.info("Resumed session, missed events are replayed")
+                else:
+                    self.client.pipeline.submit(
+                        self.key(ws_message), self.client.handle_dispatch, ws_message
+                    )
             case _:
                 return None
 
-    def handle_dispatch(self, ws_message: WebsocketMessage) -> None:
-        self.log.debug(str(ws_message))
+    def start(self) -> None:
+        self.ws = WSApp(
+            self.gateway_url,
+            on_open=self.on_open,
+            on_message=self.on_message,
+            on_error=self.on_error,
+            on_close=self.on_close,
+        )
+        self.thread = threading.Thread(target=self.ws.run_forever, daemon=True)
+        self.thread.start()
+
+
+class Discord(Messenger):
+    # the upload limit of servers without boosts
+    capabilities = Capabilities(max_size=10 * 2**20)
+    shard_class: type = Shard
+
+    # shards is the number of gateway connections, None for the number
+    # Discord recommends
+    def __init__(
+        self, bot_token: str, compress: bool = False, shards: int | None = 1
+    ) -> None:
+        self.token = bot_token
+        self.compress = compress
+        self.shard_count = shards
+        self.shards: List[Shard] = []
+        self.gateway = Endpoints.GATEWAY
+        self.buckets = IdentifyBuckets()
+
+        self.hubs = {}
+        self.nickname_dict: Dict[str, Dict[str, str]] = {}
 
+        self.log = self.get_logger()
+        self.limiter = DiscordLimiter(self.name)
+
+    def add_hub(self, c_id: str, hub: Hub):
+        self.hubs[c_id] = hub
+
+        self.nickname_dict[c_id] = self.get_nicknames(c_id)
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bot {self.token}"}
+
+    # message events of guild channels and their text, nothing without hubs
+    @property
+    def intents(self) -> int:
+        if not self.hubs:
+            return 0
+        return Intent.GUILD_MESSAGES | Intent.MESSAGE_CONTENT
+
+    # /gateway/bot is only asked when sharding, a single connection needs
+    # neither its shard count nor its identify concurrency
+    @property
+    def sharded(self) -> bool:
+        return self.shard_count != 1
+
+    def create_shards(self, info: GatewayBot | None) -> List[Shard]:
+        count = self.shard_count or 1
+        if info is not None:
+            limit = info["session_start_limit"]
+            self.gateway = info["url"].rstrip("/") + Endpoints.GATEWAY_QUERY
+            self.buckets = IdentifyBuckets(limit["max_concurrency"])
+            count = self.shard_count or info["shards"]
+            self.log.info(
+                f"Running {count} shards, Discord recommends {info['shards']}, "
+                f"{limit['remaining']} of {limit['total']} session starts left"
+            )
+        return [self.shard_class(self, i, count) for i in range(count)]
+
+    def gateway_bot(self) -> GatewayBot | None:
+        try:
+            r = self.limiter.request(
+                "GET",
+                Endpoints.GATEWAY_BOT,
+                route="GET /gateway/bot",
+                headers=self.headers,
+            )
+            r.raise_for_status()
+            return cast(GatewayBot, r.json())
+        except requests.RequestException as e:
+            self.log.error(f"Could not get the recommended shard count: {e}")
+            return None
+
+    def handle_dispatch(self, ws_message: WebsocketMessage) -> None:
         t = ws_message["t"]
-        self.sequence = ws_message["s"]
 
         match t:
             case EventName.MESSAGE_CREATE:
@@ -116,10 +490,6 @@ class Discord(Messenger):
                 delete_event = cast(MessageDeleteEvent, ws_message["d"])
                 self.handle_message_delete(delete_event)
 
-            case EventName.READY:
-                ready_event = cast(ReadyEvent, ws_message["d"])
-                self.handle_ready(ready_event)
-
             case EventName.MESSAGE_UPDATE:
                 update_event = cast(MessageUpdateEvent, ws_message["d"])
                 self.handle_message_update(update_event)
@@ -128,6 +498,11 @@ class Discord(Messenger):
                 return None
 
     def handle_message_update(self, d: MessageUpdateEvent):
+        if (parsed := self.parse_message_update(d)) is not None:
+            hub, m = parsed
+            hub.modify_hub_message(m)
+
+    def parse_message_update(self, d: MessageUpdateEvent) -> Tuple[Hub, Message] | None:
         c_id = d["channel_id"]
         if (hub := self.hubs.get(c_id)) is None:
             return None
@@ -136,8 +511,7 @@ class Discord(Messenger):
         text = d["content"]
         username = d["author"]["username"]
         m_id = d["id"]
-        m = Message(self.name, c_id, m_id, None, username, text, [])
-        hub.modify_hub_message(m)
+        return hub, Message(self.name, c_id, m_id, None, username, text, [])
 
     def handle_message_delete(self, d: MessageDeleteEvent):
         c_id = d["channel_id"]
@@ -146,10 +520,6 @@ class Discord(Messenger):
 
         hub.recall_hub_message(self.name, d["id"])
 
-    def handle_ready(self, data: ReadyEvent) -> None:
-        self.bot_id = data["user"]["id"]
-        self.session_id = data["session_id"]
-
     def handle_modify(self, d: MessageUpdateEvent) -> None:
         c_id = d["channel_id"]
         if (hub := self.hubs.get(c_id)) is None:
@@ -170,9 +540,26 @@ class Discord(Messenger):
             "content": f"[{m.author_username}]: {m.text}",
         }
 
-        requests.patch(url, headers=self.headers, json=payload)
+        r = self.limiter.request(
+            "PATCH",
+            url,
+            route="PATCH /channels/messages",
+            major=c_id,
+            headers=self.headers,
+            json=payload,
+        )
+        self.log_response(r)
+        r.raise_for_status()
 
     def handle_message_create(self, data: MessageCreateEvent) -> None:
+        if (parsed := self.parse_message_create(data)) is None:
+            return None
+        hub, m = parsed
+        hub.new_hub_message(m)
+
+    def parse_message_create(
+        self, data: MessageCreateEvent
+    ) -> Tuple[Hub, Message] | None:
         c_id = data["channel_id"]
         hub = self.hubs.get(c_id)
 
@@ -198,8 +585,8 @@ class Discord(Messenger):
             full_type = attachment.get("content_type")
 
             path = self.generate_cache_path(self.name)
-            file_path = util.download_to_cache(url, path, filename)
-            attachments.append(Attachment(fn, full_type, file_path))
+            d = Download(fn, full_type, url, path, filename)
+            attachments.append(Attachment(fn, full_type, None, d, attachment["size"]))
 
         emoji_regex = r"<:(.+):(\d+)>"
         emoji_re = re.compile(emoji_regex)
@@ -212,18 +599,18 @@ class Discord(Messenger):
             fn = f"{a_emoji_name}_{a_emoji_id}.gif"
             url = Endpoints.GET_EMOJI.format(a_emoji_id) + ".gif"
             path = self.generate_cache_path(self.name)
-            file_path = util.download_to_cache(url, path, fn)
             full_type = "image/gif"
-            attachments.append(Attachment(fn, full_type, file_path))
+            d = Download(fn, full_type, url, path, fn)
+            attachments.append(Attachment(fn, full_type, None, d))
             text = text.replace(f"<a:{a_emoji_name}:{a_emoji_id}>", "")
 
         for emoji_name, emoji_id in emoji_list:
             fn = f"{emoji_name}_{emoji_id}.png"
             url = Endpoints.GET_EMOJI.format(emoji_id) + ".png"
             path = self.generate_cache_path(self.name)
-            file_path = util.download_to_cache(url, path, fn)
             full_type = "image/png"
-            attachments.append(Attachment(fn, full_type, file_path))
+            d = Download(fn, full_type, url, path, fn)
+            attachments.append(Attachment(fn, full_type, None, d))
             text = text.replace(f"<:{emoji_name}:{emoji_id}>", "")
 
         if (sticker_items := data.get("sticker_items")) is not None:
@@ -236,27 +623,38 @@ class Discord(Messenger):
                     case 2:
                         fn += ".apng"
                         full_type = "image/apng"
-                    case 3:
+                    case 4:
+                        fn += ".gif"
+                        full_type = "image/gif"
+                    case _:
+                        # Lottie stickers have no image to post
                         continue
-                        # fn += ".lottie"
-                        # full_type = "application/json"
+                # APNG stickers are served with a .png suffix too
+                suffix = ".gif" if full_type == "image/gif" else ".png"
+                url = Endpoints.GET_STICKER.format(sticker["id"]) + suffix
                 path = self.generate_cache_path(self.name)
-                file_path = util.download_to_cache(url, path, filename)
-                attachments.append(Attachment(fn, full_type, file_path))
+                d = Download(fn, full_type, url, path, fn)
+                attachments.append(Attachment(fn, full_type, None, d))
 
         ref_id = None
         if (ref_message := data["referenced_message"]) is not None:
             ref_id = ref_message["id"]
 
         m = Message(self.name, c_id, m_id, ref_id, username, text, attachments)
-        hub.new_hub_message(m)
+        return hub, m
 
     def recall_message(self, m_id: str, c_id: None | str) -> None:
-        r = requests.delete(
+        r = self.limiter.request(
+            "DELETE",
             Endpoints.DELETE_MESSAGE.format(c_id, m_id),
+            route="DELETE /channels/messages",
+            major=str(c_id),
             headers=self.headers,
         )
         self.log_response(r)
+        # already gone, nothing left to retry
+        if r.status_code != 404:
+            r.raise_for_status()
 
     def send_message(self, m: Message, c_id: str, ref_id=None) -> None:
         hub = self.hubs[c_id]
@@ -270,68 +668,41 @@ class Discord(Messenger):
                 "message_id": ref_id,
             }
 
-        files = []
-        for (i, attachment) in enumerate(m.attachments):
-            fn = basename(attachment.file_path)
-            a_type = attachment.type
-            files.append(
-                (f"files[{i}]", (fn, open(attachment.file_path, "rb"), a_type))
-            )
-
-        if len(files) > 0:
-            # XXX
-            payload_io = BytesIO(orjson.dumps(payload))
-            files.append(
-                (
-                    "payload_json",
-                    (None, payload_io, "application/json"),
-                )  # type: ignore[arg-type]
-            )
-            r = requests.post(
-                Endpoints.SEND_MESSAGE.format(c_id),
-                headers=self.headers,
-                files=files,
-            )
+        if m.attachments:
+            paths = [a.file_path for a in m.attachments]
+            # streamed from the relay's shared buffers, released once done
+            with relay.held(paths):
+                fields: List[Field] = [
+                    (f"files[{i}]", basename(path), relay.view(path), a.type)
+                    for i, (a, path) in enumerate(zip(m.attachments, paths))
+                ]
+                fields.append(
+                    ("payload_json", None, orjson.dumps(payload), "application/json")
+                )
+                body = Multipart(fields)
+                r = self.limiter.request(
+                    "POST",
+                    Endpoints.SEND_MESSAGE.format(c_id),
+                    route="POST /channels/messages",
+                    major=c_id,
+                    headers={**self.headers, "Content-Type": body.content_type},
+                    data=body,
+                )
         else:
-            r = requests.post(
+            r = self.limiter.request(
+                "POST",
                 Endpoints.SEND_MESSAGE.format(c_id),
+                route="POST /channels/messages",
+                major=c_id,
                 json=payload,
                 headers=self.headers,
             )
 
         self.log_response(r)
+        r.raise_for_status()
 
-        message_id: str = r.json().get("id")
-        hub.update_entry(m, self.name, message_id)
-
-    def send_identity(self, ws: WSApp) -> None:
-        payload = self.identity_payload
-        ws.send(payload)
-
-    @property
-    def identity_payload(self) -> bytes:
-        # XXX
-        payload: Dict[str, Union[dict, Any]] = {
-            "op": Opcode.IDENTIFY,
-            "d": {
-                "token": self.token,
-                "properties": {
-                    "os": "linux",
-                    "browser": "bygeon",
-                    "device": "bygeon",
-                },
-                "large_threshold": 250,
-                "compress": False,
-                "intents": (1 << 15) + (1 << 9),
-            },
-        }
-
-        if self.sequence is not None:
-            payload["sequence"] = self.sequence
-        if self.session_id is not None:
-            payload["d"]["session_id"] = self.session_id
-
-        return orjson.dumps(payload)
+        if (message_id := r.json().get("id")) is not None:
+            hub.update_entry(m, self.name, message_id)
 
     def log_response(self, r: requests.Response) -> None:
         if r.status_code != 200:
@@ -339,20 +710,25 @@ class Discord(Messenger):
         else:
             self.log.debug(r.text)
 
-    def reconnect(self) -> None:
-        # XXX
-        self.ws.close()
-        self.start()
-
     def get_nicknames(self, c_id) -> Dict[str, str]:
         log = self.log.bind(Action="Get Nicknames")
 
-        r = requests.get(Endpoints.GET_CHANNEL.format(c_id), headers=self.headers)
+        r = self.limiter.request(
+            "GET",
+            Endpoints.GET_CHANNEL.format(c_id),
+            route="GET /channels",
+            major=c_id,
+            headers=self.headers,
+        )
 
         guild_id = r.json()["guild_id"]
 
-        r = requests.get(
-            Endpoints.LIST_GUILD_MEMBERS.format(guild_id), headers=self.headers
+        r = self.limiter.request(
+            "GET",
+            Endpoints.LIST_GUILD_MEMBERS.format(guild_id),
+            route="GET /guilds/members",
+            major=guild_id,
+            headers=self.headers,
         )
         nickname_dict: Dict[str, str] = {}
         guild_members: List[GuildMember] = orjson.loads(r.text)
@@ -367,14 +743,10 @@ class Discord(Messenger):
         return nickname_dict
 
     def start(self) -> None:
-        self.ws = WSApp(
-            Endpoints.GATEWAY,
-            on_open=self.on_open,
-            on_message=self.on_message,
-            on_error=self.on_error,
-            on_close=self.on_close,
-        )
-        self.thread = threading.Thread(target=self.ws.run_forever)
-        self.thread.daemon = True
-        self.thread.start()
-
+        transport.prewarm(Endpoints.API)
+        if not self.shards:
+            self.shards = self.create_shards(
+                self.gateway_bot() if self.sharded else None
+            )
+        for shard in self.shards:
+            shard.start()
@@ -1,36 +1,82 @@
 import os
+import socket
 
+import requests
 from websocket import WebSocketApp as WSApp
 
-from bygeon.message import Message
+import bygeon.filecache as filecache
+import bygeon.media as media
+from bygeon.message import Message, Attachment, Download, dump_message, load_message
 
-from typing import Protocol, List, Dict, Tuple, NamedTuple, cast
+from typing import Protocol, FrozenSet, List, Dict, Tuple, NamedTuple, cast
 
-from pypika import Query, Column, Table
-from sqlite3 import Connection as SQLConn, Cursor as SQLCur, Row as SQLRow,connect
+import orjson
 
-from bygeon.message import Message
 from structlog.typing import BindableLogger
 
-import bygeon.util as util
 import bygeon.logger as logger
+from bygeon.pipeline import Pipeline
+from bygeon.relay import relay
+from bygeon.store.cache import MappingCache
+from bygeon.store.database import Database
+from bygeon.store.retention import RetentionPolicy
+from bygeon.store.outbox import Delivery, SEND, MODIFY, RECALL
+
+
+# raised by a messenger when a destination refused a delivery, or when a
+# worker process failed one on its behalf
+class DeliveryError(Exception):
+    def __init__(self, message: str | None, permanent: bool = True) -> None:
+        super().__init__(message)
+        self.permanent = permanent
+
+
+# A refusal would only be repeated, so such deliveries are dropped; timeouts,
+# connection errors, 5xx and 429 are retried by the outbox.
+def permanent(e: Exception) -> bool:
+    match e:
+        case DeliveryError():
+            return e.permanent
+        case requests.HTTPError(response=requests.Response(status_code=status)):
+            return 400 <= status < 500 and status != 429
+    return False
+
+
+# what a messenger can post as an attachment
+class Capabilities(NamedTuple):
+    # MIME main types, None for any
+    types: FrozenSet[str] | None = None
+    # largest upload in bytes, None for no limit
+    max_size: int | None = None
+    # posts attachments by their source URL, without the bytes
+    urls: bool = False
+    # image types to convert before posting, see bygeon.media
+    convert: Dict[str, str] = {}
 
 
 class Hub:
     links: Dict["Messenger", str]
     log: BindableLogger
 
-    def __init__(self, name: str, keep_data=False):
-        self.conn: SQLConn = connect(
-            f"{name}.db",
-            check_same_thread=False,
-            isolation_level=None,
-        )
-        self.conn.row_factory = SQLRow
+    def __init__(
+        self,
+        name: str,
+        keep_data=False,
+        cache_size=4096,
+        retention: RetentionPolicy = RetentionPolicy(),
+        database: Database | None = None,
+        backend: str = "sqlite",
+        pipeline: Pipeline | None = None,
+    ):
+        self.pipeline = pipeline or Pipeline()
+        self.database = database or Database(f"{name}.db", backend=backend)
+        self.store = self.database.store(name)
+        self.writer = self.database.writer
+        self.cache = MappingCache(cache_size)
+        self.retention = retention
         self.name = name
         self.links = {}
 
-        self.init_database(keep_data)
         self.log = logger.log.bind(Hub=self.name)
 
     def add_linkee(self, msgr: "Messenger", c_id: str):
@@ -44,87 +90,195 @@ class Hub:
     def client_names(self):
         return [c.name for c in self.clients]
 
-    def execute_sql(self, query: str):
-        cur = self.conn.cursor()
-        cur.execute(query)
-        return cur
-
     def init_database(self, keep_data):
-        columns = tuple(
-            Column(s, "VARCHAR(255)", nullable=True) for s in self.client_names
-        )
-        if not keep_data:
-            self.execute_sql('DROP TABLE IF EXISTS "messages"')
-            create_table = Query.create_table("messages").columns(*columns)
-            self.execute_sql(str(create_table))
-        self.table = Table("messages")
+        self.store.init_table(self.client_names, keep_data)
+        self.database.pruner.add(self.store, self.retention)
+        self.database.outbox.add_hub(self.name, self.redeliver, keep_data)
 
+    # Ids are resolved inside the lane, once the earlier sends to the same
+    # destination have completed and recorded theirs.
     def new_hub_message(self, m: Message):
-        ref = m.origin_ref_id
-        ref_id = None
-        self.new_entry(m)
-        for client in self.clients:
-            to_c_id = self.links[client]
-            if m.origin != client.name:
-                if ref is not None:
-                    self.log.debug(f"Find ref_id in original message: {ref}")
-                    self.log.debug(f"Trying to find corresponding ref_id for {client.name}")
-                    ref_id = self.find_id(m.origin, ref, client.name)
-                    if ref_id is not None:
-                        self.log.debug(f"Found corresponding ref_id {ref_id}")
-
-                client.send_message(m, to_c_id, ref_id)
+        m = self.materialize(m)
+        with self.pipeline.turn():
+            self.new_entry(m)
+            self.fan_out(SEND, m.origin, dump_message(m), (m,))
 
     def modify_hub_message(self, m: Message) -> None:
-        for client in self.clients:
-            if client.name != m.origin:
-                to_c_id = self.links[client]
-                m_id = self.find_id(m.origin, m.origin_m_id, client.name)
-                util.run_in_thread(client.modify_message, (m, to_c_id, m_id))
+        with self.pipeline.turn():
+            self.fan_out(MODIFY, m.origin, dump_message(m), (m,))
 
     def recall_hub_message(self, orig: str, recalled_id: str) -> None:
-        for client in self.clients:
-            if client.name != orig:
-                to_c_id = self.links[client]
-                m_id = self.find_id(orig, recalled_id, client.name)
-                util.run_in_thread(client.recall_message, (m_id, to_c_id))
-
-    def find_row(self, fname, m_id) -> SQLRow :
-
-        select_string = ", ".join([f"\"{n}\" AS {n}" for n in self.client_names])
+        with self.pipeline.turn():
+            payload = orjson.dumps([orig, recalled_id])
+            self.fan_out(RECALL, orig, payload, (orig, recalled_id))
+
+    # Deliveries are recorded in the outbox before they are queued, so a
+    # failed or interrupted one is retried by the outbox instead of lost.
+    def fan_out(self, kind: str, origin: str, payload: bytes, args: tuple) -> None:
+        clients = [c for c in self.clients if c.name != origin]
+        deliveries = [(c.name, kind, payload) for c in clients]
+        ids = self.database.outbox.add(self.name, deliveries)
+        # one reference per delivery, dropped by its attempt
+        relay.hold(self.attachment_paths(kind, args), len(clients))
+        for delivery_id, client in zip(ids, clients):
+            self.pipeline.deliver(
+                self.lane(client), self.attempt, delivery_id, client, kind, args
+            )
+
+    def attempt(
+        self, delivery_id: int, client: "Messenger", kind: str, args: tuple
+    ) -> None:
+        action = {SEND: self.send, MODIFY: self.modify, RECALL: self.recall}[kind]
+        # the janitor must not evict attachments while they are uploaded
+        paths = self.attachment_paths(kind, args)
+        try:
+            with filecache.files.pinned(paths):
+                action(client, *args)
+        except Exception as e:
+            self.log.error(f"Failed to {kind} with {client.name}")
+            self.log.exception(e)
+            if permanent(e):
+                self.log.error(f"{client.name} refused delivery {delivery_id}")
+                self.database.outbox.done(delivery_id)
+            elif not self.database.outbox.retry(delivery_id):
+                self.log.error(f"Gave up on delivery {delivery_id} to {client.name}")
+        else:
+            self.database.outbox.done(delivery_id)
+        finally:
+            relay.release(paths)
+
+    @staticmethod
+    def attachment_paths(kind: str, args: tuple) -> List[str]:
+        if kind == RECALL:
+            return []
+        return [a.file_path for a in args[0].attachments if a.file_path is not None]
+
+    # the attachments some destination has to upload, they are fetched once
+    # for all of them
+    def wanted(self, m: Message) -> List[int]:
+        clients = [c for c in self.clients if c.name != m.origin]
+        return [
+            i
+            for i, a in enumerate(m.attachments)
+            if a.file_path is None
+            and a.source is not None
+            and any(c.needs_file(a) for c in clients)
+        ]
+
+    def materialize(self, m: Message) -> Message:
+        if not (wanted := self.wanted(m)):
+            return m
+        sources = [cast(Download, m.attachments[i].source) for i in wanted]
+        paths = filecache.downloads.fetch_all(sources)
+        return self.fill(m, wanted, paths)
+
+    @staticmethod
+    def fill(m: Message, wanted: List[int], paths: List[str | None]) -> Message:
+        attachments = list(m.attachments)
+        for i, path in zip(wanted, paths):
+            # failed ones stay handles and are linked instead
+            if path is not None:
+                size = os.path.getsize(path)
+                attachments[i] = attachments[i]._replace(file_path=path, size=size)
+        return m._replace(attachments=attachments)
+
+    # what a destination gets: the attachments it can post, and links to the
+    # ones it cannot
+    @staticmethod
+    def adapt(client: "Messenger", m: Message) -> Message:
+        attachments: List[Attachment] = []
+        links: List[str] = []
+        for a in m.attachments:
+            if client.accepts(a) and (a.file_path is not None or not client.needs_file(a)):
+                attachments.append(a)
+            elif a.source is not None:
+                links.append(a.source.url)
+        if not links and len(attachments) == len(m.attachments):
+            return m
+        text = "\n".join([m.text, *links]) if links else m.text
+        return m._replace(text=text, attachments=attachments)
+
+    # Called by the outbox for deliveries that are due for another attempt.
+    # It runs on a shared scheduler thread, so a full lane is left for the
+    # next poll instead of waited for.
+    def redeliver(self, delivery: Delivery) -> bool:
+        clients = {c.name: c for c in self.clients}
+        if (client := clients.get(delivery.destination)) is None:
+            self.log.warning(f"Dropping delivery to unlinked {delivery.destination}")
+            self.database.outbox.done(delivery.id)
+            return True
+        if delivery.kind == RECALL:
+            args = tuple(orjson.loads(delivery.payload))
+        else:
+            args = (load_message(delivery.payload),)
+        paths = self.attachment_paths(delivery.kind, args)
+        relay.hold(paths)
+        queued = self.pipeline.offer(
+            self.lane(client), self.attempt, delivery.id, client, delivery.kind, args
+        )
+        if queued:
+            self.log.info(f"Retrying {delivery.kind} with {client.name}")
+        else:
+            relay.release(paths)
+        return queued
 
-        sql = f'SELECT {select_string} FROM "messages" WHERE "{fname}" = \'{m_id}\''
-        cur = self.execute_sql(sql)
-        res = cur.fetchone()
+    def lane(self, client: "Messenger") -> str:
+        return f"{client.name}:{self.links[client]}"
 
-        return res
+    def send(self, client: "Messenger", m: Message) -> None:
+        ref_id = None
+        if (ref := m.origin_ref_id) is not None:
+            self.log.debug(f"Find ref_id in original message: {ref}")
+            ref_id = self.find_id(m.origin, ref, client.name)
+            if ref_id is not None:
+                self.log.debug(f"Found corresponding ref_id {ref_id}")
+
+        m = self.adapt(client, media.transcoder.fit(m, client.capabilities))
+        client.send_message(m, self.links[client], ref_id)
+
+    def modify(self, client: "Messenger", m: Message) -> None:
+        if (m_id := self.find_id(m.origin, m.origin_m_id, client.name)) is None:
+            self.log.debug(f"No {client.name} message to modify for {m.origin_m_id}")
+            return None
+        client.modify_message(m, self.links[client], m_id)
+
+    def recall(self, client: "Messenger", orig: str, recalled_id: str) -> None:
+        if (m_id := self.find_id(orig, recalled_id, client.name)) is None:
+            self.log.debug(f"No {client.name} message to recall for {recalled_id}")
+            return None
+        client.recall_message(m_id, self.links[client])
+
+    # resolve an id to the ids of every linked client at once
+    def translate(self, fname: str, m_id: str) -> Dict[str, str | None] | None:
+        if (row := self.cache.get(fname, m_id)) is not None:
+            return row
+        if (row := self.find_row(fname, m_id)) is not None:
+            self.cache.put(row)
+        return row
+
+    def find_row(self, fname: str, m_id: str) -> Dict[str, str | None] | None:
+        return self.writer.find_row(self.store, fname, m_id)
 
     def find_id(self, fname: str, m_id: str, tname: str) -> str | None:
-        res = self.find_row(fname, m_id)
-        return res[tname] if res is not None else None
-
-
-    
+        res = self.translate(fname, m_id)
+        return res.get(tname) if res is not None else None
 
     def new_entry(self, m: Message) -> None:
-        origin_id = m.origin_m_id
-        origin = m.origin
-
-        entry = (origin_id if origin == s else None for s in self.client_names)
-        q = Query.into(self.table).insert(*tuple(entry))
-        self.execute_sql(str(q))
+        self.writer.insert(self.store, m.origin, m.origin_m_id)
+        row = {c: m.origin_m_id if c == m.origin else None for c in self.client_names}
+        self.cache.put(row)
 
-    # XXX
-    def update_entry(self, m: Message, client_name: str, sent_id: str) -> None:  # noqa
-        sql = f'UPDATE "messages" SET "{client_name}" = \'{sent_id}\' WHERE "{m.origin}" = \'{m.origin_m_id}\''  # noqa
-        # q = Query.update(self.table).set(sent_messenger, sent_id).where(m.origin == m.origin_id) # noqa
-        self.execute_sql(sql)
+    def update_entry(self, m: Message, client_name: str, sent_id: str) -> None:
+        self.writer.update(self.store, m.origin, m.origin_m_id, client_name, sent_id)
+        self.cache.set(m.origin, m.origin_m_id, client_name, sent_id)
 
 
 class Messenger(Protocol):
     log: BindableLogger
     hubs: Dict[str, Hub]
+    pipeline: Pipeline
     ws: WSApp
+    capabilities: Capabilities = Capabilities()
 
     def get_logger(self):
         self.log = logger.log.bind(Client=self.name)
@@ -144,7 +298,7 @@ class Messenger(Protocol):
 
     @property
     def file_cache_path(self) -> str:
-        return os.path.join(os.getcwd(), "cache")
+        return filecache.files.root
 
     @property
     def name(self) -> str:
@@ -153,6 +307,44 @@ class Messenger(Protocol):
     def generate_cache_path(self, hub_name: str) -> str:
         return os.path.join(self.file_cache_path, hub_name)
 
+    def accepts(self, a: Attachment) -> bool:
+        capabilities = self.capabilities
+        main_type = (a.type or "").split("/")[0]
+        if capabilities.types is not None and main_type not in capabilities.types:
+            return False
+        limit = capabilities.max_size
+        return limit is None or a.size is None or a.size <= limit
+
+    def needs_file(self, a: Attachment) -> bool:
+        if media.transcoder.target(a, self.capabilities) is not None:
+            return True
+        return self.accepts(a) and not (self.capabilities.urls and a.source is not None)
+
+    # called for every new gateway connection
+    def opened(self) -> None:
+        ...
+
+    # seconds to wait before connecting again after the connection closed
+    # with code, None to stay disconnected
+    def reconnect_delay(self, code: int | None) -> float | None:
+        return 1
+
+    # the text of a binary frame, None while a message is incomplete
+    def decode(self, data: bytes) -> str | None:
+        return data.decode()
+
+    # Ends a connection that went quiet from another thread. A closing
+    # handshake would not get through, and WSApp.close would stop run_forever
+    # without on_close, so the socket is shut and run_forever tears down and
+    # reconnects as for any drop.
+    def drop(self, ws: WSApp) -> None:
+        if ws.sock is None or ws.sock.sock is None:
+            return None
+        try:
+            ws.sock.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
     def _on_open(self, ws) -> None:
         self.log.info("Opened WebSocket connection")
 
@@ -0,0 +1,100 @@
+from itertools import count
+from queue import Queue, Empty
+from threading import Lock
+from typing import Dict, Tuple
+
+from bygeon.ipc import Channel
+from bygeon.message import Message, message_to_dict
+from bygeon.pipeline import Pipeline
+from .messenger import Messenger, Capabilities, DeliveryError
+
+
+class ProxyHub:
+    # Stands in for a hub that lives in another worker process. Whatever a
+    # messenger reports to its hub is forwarded to that worker, in order.
+    def __init__(self, name: str, worker: str, channel: Channel, pipeline: Pipeline) -> None:
+        self.name = name
+        self.worker = worker
+        self.channel = channel
+        self.pipeline = pipeline
+
+    def new_hub_message(self, m: Message) -> None:
+        with self.pipeline.turn():
+            self.channel.send(self.worker, "new", self.name, message_to_dict(m))
+
+    def modify_hub_message(self, m: Message) -> None:
+        with self.pipeline.turn():
+            self.channel.send(self.worker, "modify", self.name, message_to_dict(m))
+
+    def recall_hub_message(self, orig: str, recalled_id: str) -> None:
+        with self.pipeline.turn():
+            self.channel.send(self.worker, "recall", self.name, orig, recalled_id)
+
+    def update_entry(self, m: Message, client_name: str, sent_id: str) -> None:
+        self.channel.send(
+            self.worker, "update", self.name, message_to_dict(m), client_name, sent_id
+        )
+
+
+class ProxyMessenger(Messenger):
+    # Stands in for a messenger that runs in its own worker process. Calls
+    # block the lane until the worker answers, and raise when it reports an
+    # error or does not answer in time, so the outbox retries them.
+    def __init__(
+        self,
+        name: str,
+        worker: str,
+        channel: Channel,
+        reply_to: str,
+        capabilities: Capabilities = Capabilities(),
+        timeout: float = 60,
+    ) -> None:
+        self.client_name = name
+        self.capabilities = capabilities
+        self.worker = worker
+        self.channel = channel
+        self.reply_to = reply_to
+        self.timeout = timeout
+        self.hubs = {}
+        self.ids = count()
+        self.pending: Dict[int, Queue] = {}
+        self.lock = Lock()
+        self.log = self.get_logger()
+
+    @property
+    def name(self) -> str:
+        return self.client_name
+
+    def call(self, op: str, *args) -> None:
+        request_id = next(self.ids)
+        reply: Queue[Tuple[str | None, bool]] = Queue(1)
+        with self.lock:
+            self.pending[request_id] = reply
+        try:
+            self.channel.send(self.worker, op, self.reply_to, request_id, *args)
+            error, refused = reply.get(timeout=self.timeout)
+        except Empty:
+            raise DeliveryError(f"{self.worker} did not answer {op} in time", False)
+        finally:
+            with self.lock:
+                del self.pending[request_id]
+        if error is not None:
+            raise DeliveryError(error, refused)
+
+    def resolve(self, request_id: int, error: str | None, refused: bool) -> None:
+        with self.lock:
+            reply = self.pending.get(request_id)
+        if reply is not None:
+            reply.put((error, refused))
+
+    def send_message(self, m: Message, c_id: str, ref_id=None) -> None:
+        self.call("send", message_to_dict(m), c_id, ref_id)
+
+    def modify_message(self, m: Message, c_id, m_id: str) -> None:
+        self.call("modify", message_to_dict(m), c_id, m_id)
+
+    def recall_message(self, m_id: str, c_id: None | str) -> None:
+        self.call("recall", m_id, c_id)
+
+    def start(self) -> None:
+        ...
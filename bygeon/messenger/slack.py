@@ -4,10 +4,11 @@ from typing import cast, List
 
 from websocket import WebSocketApp as WSApp
 
-import requests
 import orjson
 
 import bygeon.util as util
+from bygeon.ratelimit import TokenBucketLimiter
+from bygeon.transport import transport
 from bygeon.message import Message, Attachment
 from .messenger import Messenger
 from .definition.slack import WSMessageType, EventType, MessageEventSubtype
@@ -20,7 +21,13 @@ from .definition.slack import (
 
 class Slack(Messenger):
     def __init__(
-        self, app_token: str, bot_token: str, channel_id: str, hub: Hub
+        self,
+        app_token: str,
+        bot_token: str,
+        channel_id: str,
+        hub: Hub,
+        rate_limit: float = 1,
+        burst: int = 3,
     ) -> None:
 
         self.app_token = app_token
@@ -28,6 +35,8 @@ class Slack(Messenger):
         self.channel_id = channel_id
         self.hub = hub
         self.logger = self.get_logger()
+        # chat.postMessage allows about one message per second per channel
+        self.limiter = TokenBucketLimiter(self.name, rate_limit, burst)
 
         self.bot_user_id = self.get_bot_user_id()
 
@@ -142,7 +151,7 @@ class Slack(Messenger):
 
     def get_username(self, id: str) -> str:
         headers = self.get_headers(self.bot_token)
-        r = requests.get(Endpoints.USERS_INFO + "?user=" + id, headers=headers)
+        r = transport.get(Endpoints.USERS_INFO + "?user=" + id, headers=headers)
         response = orjson.loads(r.text)
         self.logger.debug(r.text)
         username = response["user"]["name"]
@@ -155,7 +164,7 @@ class Slack(Messenger):
 
     def get_websocket_url(self) -> str:
         header = self.get_headers(self.app_token)
-        r = requests.post(Endpoints.CONNECTIONS_OPEN, headers=header)
+        r = transport.request("POST", Endpoints.CONNECTIONS_OPEN, headers=header)
         response = orjson.loads(r.text)
         self.logger.debug(response)
 
@@ -182,7 +191,8 @@ class Slack(Messenger):
             payload["initial_comment"] = m.text
             self.upload_files(m)
         self.logger.info("Sending message: {}".format(m.text))
-        r = requests.post(
+        r = self.limiter.request(
+            "POST",
             Endpoints.POST_MESSAGE,
             json=payload,
             headers=self.get_headers(self.bot_token),
@@ -206,7 +216,8 @@ class Slack(Messenger):
             a_type = attachment.type
             file = {"file": (fn, open(attachment.file_path, "rb"), a_type)}
             self.logger.info(attachment.file_path)
-            r = requests.post(
+            r = self.limiter.request(
+                "POST",
                 Endpoints.FILE_UPLOAD,
                 headers=headers,
                 data=payload,
@@ -222,7 +233,8 @@ class Slack(Messenger):
             "channel": self.channel_id,
             "ts": message_id,
         }
-        r = requests.post(
+        r = self.limiter.request(
+            "POST",
             Endpoints.CHAT_DELETE,
             json=payload,
             headers=self.get_headers(self.bot_token),
@@ -236,7 +248,8 @@ class Slack(Messenger):
             "ts": m_id,
             "text": m.text,
         }
-        requests.post(
+        self.limiter.request(
+            "POST",
             Endpoints.CHAT_UPDATE,
             json=payload,
             headers=self.get_headers(self.bot_token),
@@ -257,7 +270,7 @@ class Slack(Messenger):
     def get_bot_user_id(self) -> str:
         headers = self.get_headers(self.bot_token)
 
-        r = requests.get(Endpoints.AUTH_TEST, headers=headers)
+        r = transport.get(Endpoints.AUTH_TEST, headers=headers)
         bot_info = orjson.loads(r.text)
         return bot_info["user_id"]
 
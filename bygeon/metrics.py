@@ -0,0 +1,110 @@
+import bisect
+from threading import Lock
+from typing import Dict, List, Sequence, Tuple
+
+import bygeon.logger as logger
+from bygeon.scheduler import scheduler
+
+# upper bounds in seconds, the last bucket catches everything above
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+
+class Gauge:
+    def __init__(self) -> None:
+        self.value: float = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value: float) -> None:
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    # upper bound of the bucket holding the q-th quantile
+    def quantile(self, q: float) -> float:
+        with self.lock:
+            rank = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                if seen >= rank:
+                    return bound
+        return float("inf")
+
+    def summary(self) -> Dict[str, float]:
+        with self.lock:
+            count, total = self.count, self.sum
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Registry:
+    # Metrics are identified by a name and a label string such as
+    # "Discord POST /channels/messages".
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, str], Counter] = {}
+        self.gauges: Dict[Tuple[str, str], Gauge] = {}
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.lock = Lock()
+
+    def counter(self, name: str, label: str = "") -> Counter:
+        with self.lock:
+            return self.counters.setdefault((name, label), Counter())
+
+    def gauge(self, name: str, label: str = "") -> Gauge:
+        with self.lock:
+            return self.gauges.setdefault((name, label), Gauge())
+
+    def histogram(self, name: str, label: str = "") -> Histogram:
+        with self.lock:
+            return self.histograms.setdefault((name, label), Histogram())
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        with self.lock:
+            values = [*self.counters.items(), *self.gauges.items()]
+            histograms = list(self.histograms.items())
+        metrics: Dict[str, Dict[str, object]] = {}
+        for (name, label), c in values:
+            metrics.setdefault(name, {})[label] = c.value
+        for (name, label), h in histograms:
+            metrics.setdefault(name, {})[label] = h.summary()
+        return metrics
+
+    def report(self, interval: float, name: str = "") -> None:
+        scheduler.call_every(interval, self.emit, name)
+
+    def emit(self, name: str = "") -> None:
+        lines: List[str] = []
+        for metric, values in sorted(self.snapshot().items()):
+            for label, value in sorted(values.items()):
+                lines.append(f"{metric}{{{label}}} {value}")
+        if lines:
+            logger.log.bind(Metrics=name).info("\n".join(lines))
+
+
+registry = Registry()
@@ -0,0 +1,109 @@
+import threading
+from contextlib import contextmanager
+from queue import Queue, Full
+from threading import Thread, Condition
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+
+import bygeon.logger as logger
+
+Task = Tuple[Callable, tuple]
+
+
+class Sequencer:
+    # Hands out tickets per key and releases them strictly in order, so jobs
+    # may finish out of order while their effects stay in arrival order.
+    def __init__(self) -> None:
+        self.cond = Condition()
+        self.issued: Dict[str, int] = {}
+        self.released: Dict[str, int] = {}
+        self.finished: Dict[str, Set[int]] = {}
+
+    def issue(self, key: str) -> int:
+        with self.cond:
+            ticket = self.issued.get(key, 0)
+            self.issued[key] = ticket + 1
+            self.released.setdefault(key, 0)
+            self.finished.setdefault(key, set())
+            return ticket
+
+    def wait(self, key: str, ticket: int) -> None:
+        with self.cond:
+            self.cond.wait_for(lambda: self.released[key] == ticket)
+
+    def release(self, key: str, ticket: int) -> None:
+        with self.cond:
+            finished = self.finished[key]
+            finished.add(ticket)
+            while self.released[key] in finished:
+                finished.remove(self.released[key])
+                self.released[key] += 1
+            if self.released[key] == self.issued[key]:
+                del self.issued[key], self.released[key], self.finished[key]
+            self.cond.notify_all()
+
+
+class Pipeline:
+    # receive thread -> enrich workers (downloads) -> per-destination lanes
+    #
+    # Receive threads only parse and submit. Workers run the messenger's
+    # handler, which may block on downloads; when the handler reaches a hub
+    # it waits for its turn so that messages from one channel are handed to
+    # the lanes in the order they arrived. Each lane runs the sends for a
+    # set of destination channels one after another.
+    def __init__(self, workers: int = 4, lanes: int = 8, queue_size: int = 256) -> None:
+        self.log = logger.log.bind(Pipeline="")
+        self.sequencer = Sequencer()
+        self.local = threading.local()
+
+        self.jobs: Queue[Tuple[str, int, Callable, tuple]] = Queue(queue_size)
+        for i in range(workers):
+            Thread(target=self.work, name=f"enrich-{i}", daemon=True).start()
+
+        self.lanes: List[Queue[Task]] = []
+        for i in range(lanes):
+            lane: Queue[Task] = Queue(queue_size)
+            self.lanes.append(lane)
+            Thread(target=self.drain, args=(lane,), name=f"lane-{i}", daemon=True).start()
+
+    def submit(self, key: str, func: Callable, *args) -> None:
+        ticket = self.sequencer.issue(key)
+        self.jobs.put((key, ticket, func, args))
+
+    def work(self) -> None:
+        while True:
+            key, ticket, func, args = self.jobs.get()
+            self.local.turn = (key, ticket)
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.error(f"Failed to handle event from {key}")
+                self.log.exception(e)
+            finally:
+                self.local.turn = None
+                self.sequencer.release(key, ticket)
+
+    @contextmanager
+    def turn(self) -> Iterator[None]:
+        if (turn := getattr(self.local, "turn", None)) is not None:
+            self.sequencer.wait(*turn)
+        yield
+
+    def deliver(self, key: str, func: Callable, *args) -> None:
+        self.lanes[hash(key) % len(self.lanes)].put((func, args))
+
+    # deliver unless the lane is full, for callers that must not block
+    def offer(self, key: str, func: Callable, *args) -> bool:
+        try:
+            self.lanes[hash(key) % len(self.lanes)].put_nowait((func, args))
+        except Full:
+            return False
+        return True
+
+    def drain(self, lane: "Queue[Task]") -> None:
+        while True:
+            func, args = lane.get()
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.error(f"Failed to deliver with {func.__qualname__}")
+                self.log.exception(e)
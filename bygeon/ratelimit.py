@@ -0,0 +1,197 @@
+import time
+from threading import Lock
+from typing import Dict
+
+import requests
+
+import bygeon.logger as logger
+from bygeon.transport import transport
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    # reserve a token and return how long to wait before using it
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        if (wait := self.reserve()) > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    # Every outbound REST call of a messenger goes through request(), which
+    # blocks the calling lane until the call is allowed and retries it after
+    # a 429 instead of giving up on it.
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.log = logger.log.bind(RateLimiter=name)
+
+    # how long to wait before polling again, 0 once a slot has been taken
+    def poll(self, route: str, major: str) -> float:
+        return 0
+
+    # take a slot of a limit shared by every route and return how long to
+    # wait before using it
+    def throttle(self) -> float:
+        return 0
+
+    def acquire(self, route: str, major: str) -> None:
+        while (wait := self.poll(route, major)) > 0:
+            time.sleep(wait)
+        if (wait := self.throttle()) > 0:
+            time.sleep(wait)
+
+    # returns how long to wait before retrying, None if the call went through
+    def update(self, route: str, major: str, r: requests.Response) -> float | None:
+        return retry_after(r) if r.status_code == 429 else None
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        route: str | None = None,
+        major: str = "",
+        **kwargs,
+    ) -> requests.Response:
+        route = route or f"{method} {url}"
+        while True:
+            self.acquire(route, major)
+            rewind(kwargs)
+            r = transport.request(method, url, f"{self.name} {route}", **kwargs)
+            if (retry := self.update(route, major, r)) is None:
+                return r
+            self.log.warning(f"Rate limited on {route}, retrying in {retry:.2f}s")
+            time.sleep(retry)
+
+
+class TokenBucketLimiter(RateLimiter):
+    def __init__(self, name: str, rate: float, burst: int = 1) -> None:
+        super().__init__(name)
+        self.bucket = TokenBucket(rate, burst)
+
+    def throttle(self) -> float:
+        return self.bucket.reserve()
+
+
+class DiscordBucket:
+    def __init__(self) -> None:
+        self.limit: int | None = None
+        self.remaining = 1
+        self.reset_at = 0.0
+        # longest Reset-After seen, i.e. roughly the length of a window
+        self.window = 1.0
+
+    # reserve a slot and return how long to wait if there is none left
+    def reserve(self, now: float) -> float:
+        if self.reset_at <= now:
+            # until Discord tells us about the bucket, send one call at a time
+            self.remaining = self.limit if self.limit is not None else 1
+            self.reset_at = now + self.window
+        if self.remaining <= 0:
+            return self.reset_at - now
+        self.remaining -= 1
+        return 0
+
+    # Headers do not count calls still in flight, and may belong to a window
+    # that already ended, so they only ever make the bucket stricter.
+    def update(self, headers, now: float) -> None:
+        if (remaining := headers.get("X-RateLimit-Remaining")) is None:
+            return None
+        reset_after = float(headers.get("X-RateLimit-Reset-After", 0))
+        reset_at = now + reset_after
+        if self.limit is None:
+            self.window = reset_after
+            self.remaining, self.reset_at = int(remaining), reset_at
+        else:
+            self.remaining = min(self.remaining, int(remaining))
+            self.reset_at = max(self.reset_at, reset_at)
+            self.window = max(self.window, reset_after)
+        if (limit := headers.get("X-RateLimit-Limit")) is not None:
+            self.limit = int(limit)
+
+
+class DiscordLimiter(RateLimiter):
+    # Routes are mapped to the bucket Discord reports for them. A bucket is
+    # limited per major parameter (the channel or guild), so its state is
+    # kept per (bucket, major) pair. Calls reserve a slot before they are
+    # sent, so concurrent lanes never overdraw a bucket.
+    GLOBAL_RATE = 50
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.lock = Lock()
+        self.routes: Dict[str, str] = {}
+        self.buckets: Dict[str, DiscordBucket] = {}
+        self.global_reset = 0.0
+        self.global_bucket = TokenBucket(self.GLOBAL_RATE, self.GLOBAL_RATE)
+
+    def bucket(self, route: str, major: str) -> DiscordBucket:
+        key = f"{self.routes.get(route, route)}:{major}"
+        return self.buckets.setdefault(key, DiscordBucket())
+
+    def poll(self, route: str, major: str) -> float:
+        with self.lock:
+            now = time.monotonic()
+            if (wait := self.global_reset - now) > 0:
+                return wait
+            return self.bucket(route, major).reserve(now)
+
+    def throttle(self) -> float:
+        return self.global_bucket.reserve()
+
+    def update(self, route: str, major: str, r: requests.Response) -> float | None:
+        headers = r.headers
+        now = time.monotonic()
+        with self.lock:
+            bucket_hash = headers.get("X-RateLimit-Bucket")
+            if bucket_hash is not None and self.routes.get(route) != bucket_hash:
+                # carry over what was learned while the route had no bucket
+                b = self.bucket(route, major)
+                self.routes[route] = bucket_hash
+                self.buckets.setdefault(f"{bucket_hash}:{major}", b)
+            b = self.bucket(route, major)
+            b.update(headers, now)
+
+            if r.status_code != 429:
+                return None
+            retry = retry_after(r)
+            scope = headers.get("X-RateLimit-Scope")
+            if headers.get("X-RateLimit-Global") or scope == "global":
+                self.global_reset = now + retry
+            else:
+                b.remaining = 0
+                b.reset_at = max(b.reset_at, now + retry)
+            return retry
+
+
+def retry_after(r: requests.Response) -> float:
+    try:
+        return float(r.json()["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return float(r.headers.get("Retry-After", 1))
+
+
+# multipart bodies have to be read again when a call is retried
+def rewind(kwargs: dict) -> None:
+    if hasattr(data := kwargs.get("data"), "seek"):
+        data.seek(0)
+    files = kwargs.get("files") or []
+    if isinstance(files, dict):
+        files = files.items()
+    for _, f in files:
+        if isinstance(f, tuple) and len(f) > 1 and hasattr(f[1], "seek"):
+            f[1].seek(0)
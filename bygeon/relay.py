@@ -0,0 +1,177 @@
+import bisect
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import bygeon.logger as logger
+
+# name, filename, content and content type of a form field
+Field = Tuple[str, str | None, bytes | memoryview, str]
+
+
+class Buffer:
+    # One read-only mapping of a cached file, mapped when it is first read.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.map: mmap.mmap | None = None
+        self.view: memoryview | None = None
+        self.refs = 0
+
+    def open(self) -> memoryview:
+        if self.view is None:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size > 0:
+                    self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map if self.map is not None else b"")
+        return self.view
+
+    def close(self) -> None:
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class Reader(io.RawIOBase):
+    # A file object of its own over a shared buffer, so concurrent uploads
+    # of one attachment neither copy it up front nor hold a descriptor.
+    def __init__(self, view: memoryview, name: str) -> None:
+        self.view = view
+        self.name = name
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self.view) - self.position)
+        b[:n] = self.view[self.position : self.position + n]
+        self.position += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        match whence:
+            case io.SEEK_SET:
+                self.position = offset
+            case io.SEEK_CUR:
+                self.position += offset
+            case io.SEEK_END:
+                self.position = len(self.view) + offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+def quote_param(value: str) -> str:
+    # the escaping browsers use for form field names and filenames
+    return value.replace("\"", "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class Multipart(Reader):
+    # A multipart/form-data body read part by part from its fields. requests
+    # joins the files it is given into one bytes object before sending, this
+    # is sent as it is read, so uploads go straight from the mappings.
+    def __init__(self, fields: Sequence[Field]) -> None:
+        super().__init__(memoryview(b""), "body")
+        self.boundary = os.urandom(16).hex()
+        self.parts: List[bytes | memoryview] = []
+        for name, filename, content, content_type in fields:
+            disposition = f'form-data; name="{quote_param(name)}"'
+            if filename is not None:
+                disposition += f'; filename="{quote_param(filename)}"'
+            self.parts.append(
+                f"--{self.boundary}\r\n"
+                f"Content-Disposition: {disposition}\r\n"
+                f"Content-Type: {content_type}\r\n\r\n".encode()
+            )
+            self.parts += [content, b"\r\n"]
+        self.parts.append(f"--{self.boundary}--\r\n".encode())
+        self.starts = [0]
+        for part in self.parts:
+            self.starts.append(self.starts[-1] + len(part))
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    # sent as Content-Length
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def readinto(self, b) -> int:
+        n = 0
+        while n < len(b) and self.position < len(self):
+            i = bisect.bisect_right(self.starts, self.position) - 1
+            offset = self.position - self.starts[i]
+            chunk = memoryview(self.parts[i])[offset : offset + len(b) - n]
+            b[n : n + len(chunk)] = chunk
+            n += len(chunk)
+            self.position += len(chunk)
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            self.position = len(self) + offset
+            return self.position
+        return super().seek(offset, whence)
+
+
+class Relay:
+    # Attachments are relayed from the file cache to every destination
+    # through one mapping each. A hub holds a reference per delivery it
+    # queues and every attempt drops one, so the mapping is released as soon
+    # as the last destination is done with it. Uploads hold their own
+    # reference while they run, which also covers deliveries retried later.
+    def __init__(self) -> None:
+        self.buffers: Dict[str, Buffer] = {}
+        self.lock = Lock()
+        self.log = logger.log.bind(Relay="")
+
+    def hold(self, paths: Iterable[str], count: int = 1) -> None:
+        if count == 0:
+            return None
+        with self.lock:
+            for path in paths:
+                if (buffer := self.buffers.get(path)) is None:
+                    buffer = self.buffers[path] = Buffer(path)
+                buffer.refs += count
+
+    def release(self, paths: Iterable[str]) -> None:
+        with self.lock:
+            for path in paths:
+                if (buffer := self.buffers.get(path)) is None:
+                    self.log.error(f"Released {path} more often than it was held")
+                    continue
+                buffer.refs -= 1
+                if buffer.refs == 0:
+                    del self.buffers[path]
+                    buffer.close()
+
+    @contextmanager
+    def held(self, paths: Iterable[str]) -> Iterator[None]:
+        paths = list(paths)
+        self.hold(paths)
+        try:
+            yield
+        finally:
+            self.release(paths)
+
+    # only valid while the path is held
+    def view(self, path: str) -> memoryview:
+        with self.lock:
+            return self.buffers[path].open()
+
+    def reader(self, path: str) -> Reader:
+        return Reader(self.view(path), os.path.basename(path))
+
+
+relay = Relay()
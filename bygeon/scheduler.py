@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from typing import Any, Callable, List, Tuple
+
+import bygeon.logger as logger
+
+
+class Timer:
+    # A delayed or periodic job. A periodic one is queued again once a run
+    # finished, so runs of one job never overlap and a slow run delays the
+    # next instead of piling up.
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        args: tuple,
+        interval: float | None,
+        urgent: bool = False,
+    ) -> None:
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.urgent = urgent
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Scheduler:
+    # Every delayed and periodic job of the threaded engine: heartbeats,
+    # watchdogs, reconnects, outbox retries, snapshots, pruning and cache
+    # cleaning. One thread waits on a heap of deadlines and hands due jobs
+    # to a fixed pool, so the number of threads stays the same however many
+    # connections, hubs and reconnects there are. Cancelled timers are left
+    # in the heap and skipped when they come up.
+    #
+    # Urgent jobs, heartbeats and watchdogs, have a thread of their own so
+    # outbox polls, pruning or cache scans that block cannot delay them.
+    # They must return quickly.
+    def __init__(self, workers: int = 4) -> None:
+        self.workers = workers
+        self.heap: List[Tuple[float, int, Timer]] = []
+        self.order = itertools.count()
+        self.condition = Condition()
+        self.thread: Thread | None = None
+        self.executor: ThreadPoolExecutor | None = None
+        self.urgent: ThreadPoolExecutor | None = None
+        self.log = logger.log.bind(Scheduler="")
+
+    def configure(self, workers: int | None = None) -> None:
+        with self.condition:
+            if workers is not None and self.executor is None:
+                self.workers = workers
+
+    def call_later(
+        self, delay: float, func: Callable[..., Any], *args, urgent: bool = False
+    ) -> Timer:
+        timer = Timer(func, args, None, urgent)
+        self.push(timer, delay)
+        return timer
+
+    # first runs after delay, interval by default
+    def call_every(
+        self,
+        interval: float,
+        func: Callable[..., Any],
+        *args,
+        delay: float | None = None,
+        urgent: bool = False,
+    ) -> Timer:
+        timer = Timer(func, args, interval, urgent)
+        self.push(timer, interval if delay is None else delay)
+        return timer
+
+    def push(self, timer: Timer, delay: float) -> None:
+        with self.condition:
+            if self.thread is None:
+                self.executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="scheduler"
+                )
+                self.urgent = ThreadPoolExecutor(
+                    1, thread_name_prefix="scheduler-urgent"
+                )
+                self.thread = Thread(target=self.run, name="scheduler", daemon=True)
+                self.thread.start()
+            entry = (time.monotonic() + delay, next(self.order), timer)
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    self.condition.wait(timeout)
+                _, _, timer = heapq.heappop(self.heap)
+                executor = self.urgent if timer.urgent else self.executor
+            if not timer.cancelled and executor is not None:
+                executor.submit(self.execute, timer)
+
+    def execute(self, timer: Timer) -> None:
+        if timer.cancelled:
+            return None
+        try:
+            timer.func(*timer.args)
+        except Exception as e:
+            self.log.error(f"{getattr(timer.func, '__qualname__', timer.func)} failed")
+            self.log.exception(e)
+        if timer.interval is not None and not timer.cancelled:
+            self.push(timer, timer.interval)
+
+
+scheduler = Scheduler()
@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+from .pool import ConnectionPool
+from .store import MappingStore, Insert, Update
+from .sqlite import SQLiteStore, TunedSQLiteStore
+from .memory import MemoryStore
+
+CLIENTS = ["Discord", "CQHttp", "Slack"]
+BATCH_SIZE = 512
+SNOWFLAKE = 1045678901234567890
+
+
+def open_store(backend: str, directory: str) -> MappingStore:
+    path = os.path.join(directory, f"{backend}.db")
+    match backend:
+        case "memory":
+            return MemoryStore(path, snapshot_interval=3600)
+        case "tuned":
+            return TunedSQLiteStore(ConnectionPool(path))
+        case _:
+            return SQLiteStore(ConnectionPool(path))
+
+
+def timed(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def summarize(latencies: List[float], ops: int) -> Tuple[float, float]:
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return ops / sum(latencies), p99 * 1e6
+
+
+def run(backend: str, rows: int, lookups: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        store = open_store(backend, directory)
+        store.init_table(CLIENTS, keep_data=False)
+
+        # writes are timed per batch, the way BatchWriter commits them
+        inserts = []
+        for start in range(0, rows, BATCH_SIZE):
+            ops = [
+                Insert("Discord", str(SNOWFLAKE + i))
+                for i in range(start, min(start + BATCH_SIZE, rows))
+            ]
+            inserts.append(timed(lambda: store.write_batch(ops)))
+
+        updates = []
+        for start in range(0, rows, BATCH_SIZE):
+            ops = [
+                Update("Discord", str(SNOWFLAKE + i), "CQHttp", str(-i))
+                for i in range(start, min(start + BATCH_SIZE, rows))
+            ]
+            updates.append(timed(lambda: store.write_batch(ops)))
+
+        found = []
+        for _ in range(lookups):
+            m_id = str(-random.randrange(rows))
+            found.append(timed(lambda: store.find_row("CQHttp", m_id)))
+
+        store.close()
+
+    for name, latencies, ops, unit in (
+        ("insert", inserts, rows, "batch"),
+        ("update", updates, rows, "batch"),
+        ("lookup", found, lookups, "op"),
+    ):
+        throughput, p99 = summarize(latencies, ops)
+        print(
+            f"{backend:>8} {rows:>9} {name:>7} "
+            f"{throughput:>12,.0f} ops/s  p99 {p99:>10,.1f} us/{unit}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure the message-id mapping store backends"
+    )
+    parser.add_argument(
+        "-n", "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "-b", "--backends", nargs="+", default=["sqlite", "tuned", "memory"]
+    )
+    parser.add_argument("-l", "--lookups", type=int, default=10_000)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        for backend in args.backends:
+            run(backend, rows, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
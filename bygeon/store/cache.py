@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Tuple
+
+Row = Dict[str, str | None]
+Key = Tuple[str, str]
+
+
+class MappingCache:
+    # rows are kept in LRU order under the key they were first seen with,
+    # every (client, id) pair of a row points back to that key
+    rows: "OrderedDict[Key, Row]"
+    index: Dict[Key, Key]
+
+    def __init__(self, size: int = 4096) -> None:
+        self.size = size
+        self.rows = OrderedDict()
+        self.index = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, client: str, m_id: str | int) -> Row | None:
+        with self.lock:
+            key = self.index.get((client, str(m_id)))
+            if key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.rows.move_to_end(key)
+            return dict(self.rows[key])
+
+    def put(self, row: Row) -> None:
+        if self.size <= 0:
+            return None
+        pairs = [(c, str(v)) for c, v in row.items() if v is not None]
+        if not pairs:
+            return None
+        with self.lock:
+            key = next((self.index[p] for p in pairs if p in self.index), pairs[0])
+            cached = self.rows.setdefault(key, {})
+            for c, v in row.items():
+                if v is not None or c not in cached:
+                    cached[c] = None if v is None else str(v)
+            for p in pairs:
+                self.index[p] = key
+            self.rows.move_to_end(key)
+            self.evict()
+
+    def set(
+        self, origin: str, origin_m_id: str | int, client: str, m_id: str | int | None
+    ) -> None:
+        with self.lock:
+            key = self.index.get((origin, str(origin_m_id)))
+            if key is None:
+                return None
+            self.rows[key][client] = None if m_id is None else str(m_id)
+            if m_id is not None:
+                self.index[(client, str(m_id))] = key
+
+    def evict(self) -> None:
+        while len(self.rows) > self.size:
+            key, row = self.rows.popitem(last=False)
+            for c, v in row.items():
+                if v is not None and self.index.get((c, v)) == key:
+                    del self.index[(c, v)]
@@ -0,0 +1,66 @@
+import atexit
+import os
+from typing import List
+
+from .pool import ConnectionPool
+from .store import MappingStore
+from .sqlite import SQLiteStore, TunedSQLiteStore
+from .memory import MemoryStore
+from .writer import BatchWriter
+from .retention import Pruner
+from .outbox import Outbox
+
+BACKENDS = ("sqlite", "tuned", "memory")
+
+
+class Database:
+    # A database file with its connections, writer thread, pruner and
+    # outbox. In shared mode every hub gets a view of the same table.
+    def __init__(
+        self,
+        path: str,
+        shared: bool = False,
+        readers: int = 1,
+        backend: str = "sqlite",
+    ) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown database backend: {backend}")
+        self.path = path
+        self.shared = shared
+        self.backend = backend
+        self.pool = ConnectionPool(path, readers) if backend != "memory" else None
+        self.writer = BatchWriter(path)
+        self.pruner = Pruner(path)
+        # the in-memory backend still keeps pending deliveries on disk
+        outbox_pool = self.pool or ConnectionPool(
+            f"{os.path.splitext(path)[0]}.outbox.db"
+        )
+        self.outbox = Outbox(outbox_pool)
+        self.stores: List[MappingStore] = []
+        # commit what is queued and snapshot the in-memory stores on exit
+        atexit.register(self.close)
+
+    def store(self, hub_name: str) -> MappingStore:
+        store = self.create_store(hub_name)
+        self.stores.append(store)
+        return store
+
+    def create_store(self, hub_name: str) -> MappingStore:
+        hub = hub_name if self.shared else None
+        match self.backend:
+            case "memory":
+                path = os.path.splitext(self.path)[0]
+                if self.shared:
+                    path += f".{hub_name}"
+                return MemoryStore(f"{path}.snapshot", hub)
+            case "tuned":
+                assert self.pool is not None
+                return TunedSQLiteStore(self.pool, hub)
+            case _:
+                assert self.pool is not None
+                return SQLiteStore(self.pool, hub)
+
+    def close(self) -> None:
+        self.writer.flush()
+        for store in self.stores:
+            store.close()
@@ -0,0 +1,151 @@
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Sequence, cast
+
+import orjson
+
+from bygeon.scheduler import scheduler, Timer
+from .store import MappingStore, Row, Insert, Update, Op, encode_id, decode_id
+
+Value = str | int | None
+
+
+class MemoryStore(MappingStore):
+    # Rows live in one append-only list; row n sits at rows[n - offset] and
+    # everything before rows[head] has been pruned. Each client has a dict
+    # from id to row number.
+    rows: List[List[Value]]
+    index: Dict[str, Dict[Value, int]]
+
+    def __init__(
+        self, path: str, hub: str | None = None, snapshot_interval: float = 60
+    ) -> None:
+        self._path = path
+        self.hub = hub
+        self.clients = []
+        self.rows = []
+        self.index = {}
+        self.offset = 0
+        self.head = 0
+        self.lock = Lock()
+        self.dirty = False
+
+        self.snapshot_interval = snapshot_interval
+        self.timer: Timer | None = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def init_table(self, clients: Sequence[str], keep_data: bool) -> None:
+        with self.lock:
+            self.clients = list(clients)
+            self.rows, self.index = [], {c: {} for c in self.clients}
+            self.offset = self.head = 0
+            if keep_data and os.path.exists(self.path):
+                self.load()
+        if self.timer is None:
+            self.timer = scheduler.call_every(self.snapshot_interval, self.snapshot)
+
+    def load(self) -> None:
+        with open(self.path, "rb") as f:
+            snapshot = orjson.loads(f.read())
+        columns = [
+            snapshot["clients"].index(c) if c in snapshot["clients"] else None
+            for c in self.clients
+        ]
+        for saved in snapshot["rows"]:
+            row = [None if i is None else saved[i] for i in columns]
+            self.append(row, saved[-1])
+
+    def append(self, values: List[Value], created_at: int) -> None:
+        n = self.offset + len(self.rows)
+        self.rows.append([*values, created_at])
+        for c, v in zip(self.clients, values):
+            if v is not None:
+                self.index[c][v] = n
+
+    def find_row(self, client: str, m_id: str) -> Row | None:
+        with self.lock:
+            n = self.index.get(client, {}).get(encode_id(m_id))
+            if n is None:
+                return None
+            row = self.rows[n - self.offset]
+            return {c: decode_id(v) for c, v in zip(self.clients, row)}
+
+    def write_batch(self, ops: Sequence[Op]) -> None:
+        now = int(time.time())
+        with self.lock:
+            for op in ops:
+                match op:
+                    case Insert(client, m_id):
+                        values = [
+                            encode_id(m_id) if c == client else None
+                            for c in self.clients
+                        ]
+                        self.append(values, now)
+                    case Update(origin, origin_m_id, client, sent_id):
+                        n = self.index[origin].get(encode_id(origin_m_id))
+                        if n is None:
+                            continue
+                        i = self.clients.index(client)
+                        value = encode_id(sent_id)
+                        self.rows[n - self.offset][i] = value
+                        if value is not None:
+                            self.index[client][value] = n
+            self.dirty = True
+
+    def prune(
+        self, max_age: float | None, max_rows: int | None, batch_size: int
+    ) -> int:
+        cutoff = None if max_age is None else time.time() - max_age
+        deleted = 0
+        with self.lock:
+            while deleted < batch_size and self.head < len(self.rows):
+                row = self.rows[self.head]
+                live = len(self.rows) - self.head
+                too_many = max_rows is not None and live > max_rows
+                too_old = cutoff is not None and cast(int, row[-1]) < cutoff
+                if not (too_many or too_old):
+                    break
+                n = self.offset + self.head
+                for c, v in zip(self.clients, row):
+                    if v is not None and self.index[c].get(v) == n:
+                        del self.index[c][v]
+                self.head += 1
+                deleted += 1
+            if deleted:
+                self.dirty = True
+        return deleted
+
+    # drop the pruned prefix of the row list
+    def vacuum(self, pages: int) -> int:
+        with self.lock:
+            freed = self.head
+            self.rows = self.rows[self.head :]
+            self.offset += self.head
+            self.head = 0
+        return freed
+
+    def snapshot(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return None
+            data = orjson.dumps(
+                {"clients": self.clients, "rows": self.rows[self.head :]}
+            )
+            self.dirty = False
+        # write next to the old snapshot and swap, so a crash never leaves
+        # a truncated file behind
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def close(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.snapshot()
+
@@ -0,0 +1,166 @@
+import time
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple, cast
+
+import bygeon.logger as logger
+from bygeon.scheduler import scheduler, Timer
+from .pool import ConnectionPool
+
+SEND = "send"
+MODIFY = "modify"
+RECALL = "recall"
+
+
+class Delivery(NamedTuple):
+    id: int
+    hub: str
+    destination: str
+    kind: str
+    payload: bytes
+    attempts: int
+
+
+class Outbox:
+    # Every (message, destination) delivery is recorded before it is queued
+    # and deleted once it went through. A delivery that is queued or being
+    # retried holds a lease, so the retry worker only picks up deliveries
+    # that failed or were left over by a previous run. A handler returns
+    # False when it could not queue a delivery, which is then due again at
+    # the next poll.
+    LEASE = 300
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        poll_interval: float = 1,
+        base_delay: float = 2,
+        max_delay: float = 3600,
+        max_attempts: int = 10,
+    ) -> None:
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.handlers: Dict[str, Callable[[Delivery], bool]] = {}
+        self.lock = Lock()
+        self.log = logger.log.bind(Outbox=pool.path)
+
+        with self.pool.writer() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS "outbox" ('
+                '"id" INTEGER PRIMARY KEY, '
+                '"hub" TEXT NOT NULL, '
+                '"destination" TEXT NOT NULL, '
+                '"kind" TEXT NOT NULL, '
+                '"payload" BLOB NOT NULL, '
+                '"attempts" INTEGER NOT NULL DEFAULT 0, '
+                '"next_retry" REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS "outbox_due" '
+                'ON "outbox" ("hub", "next_retry")'
+            )
+
+        self.timer: Timer | None = None
+
+    def add_hub(
+        self, hub: str, handler: Callable[[Delivery], bool], keep_data: bool
+    ) -> None:
+        with self.pool.writer() as conn:
+            if keep_data:
+                # leases of a previous run are stale, replay its deliveries now
+                conn.execute(
+                    'UPDATE "outbox" SET "next_retry" = ? WHERE "hub" = ?',
+                    (time.time(), hub),
+                )
+            else:
+                conn.execute('DELETE FROM "outbox" WHERE "hub" = ?', (hub,))
+        with self.lock:
+            self.handlers[hub] = handler
+            if self.timer is None:
+                self.timer = scheduler.call_every(self.poll_interval, self.run)
+
+    def add(self, hub: str, deliveries: Sequence[Tuple[str, str, bytes]]) -> List[int]:
+        lease = time.time() + self.LEASE
+        ids = []
+        with self.pool.writer() as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                for destination, kind, payload in deliveries:
+                    cur.execute(
+                        'INSERT INTO "outbox" '
+                        '("hub", "destination", "kind", "payload", "next_retry") '
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (hub, destination, kind, payload, lease),
+                    )
+                    ids.append(cast(int, cur.lastrowid))
+                cur.execute("COMMIT")
+            except BaseException:
+                # the connection is shared with the batch writer, it must
+                # not be left inside this transaction
+                cur.execute("ROLLBACK")
+                raise
+        return ids
+
+    def done(self, delivery_id: int) -> None:
+        with self.pool.writer() as conn:
+            conn.execute('DELETE FROM "outbox" WHERE "id" = ?', (delivery_id,))
+
+    # schedule the next attempt, False once the delivery has been given up
+    def retry(self, delivery_id: int) -> bool:
+        with self.pool.writer() as conn:
+            row = conn.execute(
+                'SELECT "attempts" FROM "outbox" WHERE "id" = ?', (delivery_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            attempts = row[0] + 1
+            if attempts >= self.max_attempts:
+                conn.execute('DELETE FROM "outbox" WHERE "id" = ?', (delivery_id,))
+                return False
+            delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+            conn.execute(
+                'UPDATE "outbox" SET "attempts" = ?, "next_retry" = ? WHERE "id" = ?',
+                (attempts, time.time() + delay, delivery_id),
+            )
+        return True
+
+    def due(self, hub: str, limit: int = 100) -> List[Delivery]:
+        now = time.time()
+        with self.pool.writer() as conn:
+            rows = conn.execute(
+                'SELECT "id", "hub", "destination", "kind", "payload", "attempts" '
+                'FROM "outbox" WHERE "hub" = ? AND "next_retry" <= ? '
+                'ORDER BY "next_retry" LIMIT ?',
+                (hub, now, limit),
+            ).fetchall()
+            conn.executemany(
+                'UPDATE "outbox" SET "next_retry" = ? WHERE "id" = ?',
+                [(now + self.LEASE, r[0]) for r in rows],
+            )
+        return [Delivery(*r) for r in rows]
+
+    def run(self) -> None:
+        with self.lock:
+            handlers = list(self.handlers.items())
+        for hub, handler in handlers:
+            skipped: List[int] = []
+            try:
+                for delivery in self.due(hub):
+                    if not handler(delivery):
+                        skipped.append(delivery.id)
+            except Exception as e:
+                self.log.error(f"Failed to replay deliveries of {hub}")
+                self.log.exception(e)
+            if skipped:
+                self.log.warning(f"{len(skipped)} deliveries of {hub} wait for a lane")
+                self.unlease(skipped)
+
+    def unlease(self, ids: Sequence[int]) -> None:
+        with self.pool.writer() as conn:
+            conn.executemany(
+                'UPDATE "outbox" SET "next_retry" = ? WHERE "id" = ?',
+                [(time.time(), i) for i in ids],
+            )
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from queue import Queue
+from sqlite3 import Connection as SQLConn, connect
+from threading import Lock
+from typing import Iterable, Iterator, List
+
+
+class ConnectionPool:
+    # One writer connection guarded by a lock and a fixed set of readers.
+    # WAL lets the readers run while the writer holds a transaction open.
+    def __init__(self, path: str, readers: int = 1) -> None:
+        self.path = path
+        self.write_conn = self.connect()
+        self.write_conn.execute("PRAGMA journal_mode=WAL")
+        self.write_lock = Lock()
+        self.pragmas: List[str] = []
+
+        self.size = max(readers, 1)
+        self.readers: Queue[SQLConn] = Queue()
+        for _ in range(self.size):
+            self.readers.put(self.connect())
+
+    def connect(self) -> SQLConn:
+        conn = connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def configure(self, pragmas: Iterable[str]) -> None:
+        pragmas = [p for p in pragmas if p not in self.pragmas]
+        if not pragmas:
+            return None
+        conns = []
+        with self.write_lock:
+            self.pragmas.extend(pragmas)
+            for pragma in pragmas:
+                self.write_conn.execute(pragma).fetchall()
+            for _ in range(self.size):
+                conns.append(self.readers.get())
+            for conn in conns:
+                for pragma in pragmas:
+                    conn.execute(pragma).fetchall()
+                self.readers.put(conn)
+
+    @contextmanager
+    def reader(self) -> Iterator[SQLConn]:
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[SQLConn]:
+        with self.write_lock:
+            yield self.write_conn
+
+    def close(self) -> None:
+        with self.write_lock:
+            self.write_conn.close()
+        while not self.readers.empty():
+            self.readers.get().close()
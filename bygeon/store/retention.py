@@ -0,0 +1,79 @@
+import time
+from threading import Lock
+from typing import List, NamedTuple, Tuple
+
+import bygeon.logger as logger
+from bygeon.scheduler import scheduler, Timer
+from .store import MappingStore
+
+
+class RetentionPolicy(NamedTuple):
+    # seconds
+    max_age: float | None = None
+    max_rows: int | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age is not None or self.max_rows is not None
+
+
+class Pruner:
+    stores: List[Tuple[MappingStore, RetentionPolicy]]
+
+    def __init__(
+        self,
+        path: str,
+        interval: float = 600,
+        batch_size: int = 500,
+        pause: float = 0.05,
+        vacuum_pages: int = 1000,
+    ) -> None:
+        self.stores = []
+        self.lock = Lock()
+        self.interval = interval
+        self.batch_size = batch_size
+        # time to yield the write lock to the writer between batches
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.log = logger.log.bind(Pruner=path)
+
+        self.timer: Timer | None = None
+
+    def add(self, store: MappingStore, policy: RetentionPolicy) -> None:
+        if not policy.enabled:
+            return None
+        with self.lock:
+            self.stores.append((store, policy))
+            if self.timer is None:
+                self.timer = scheduler.call_every(self.interval, self.run)
+
+    def run(self) -> None:
+        try:
+            self.prune()
+        except Exception as e:
+            self.log.error("Pruning failed")
+            self.log.exception(e)
+
+    def prune(self) -> int:
+        with self.lock:
+            stores = list(self.stores)
+
+        total = 0
+        for store, policy in stores:
+            pruned = 0
+            while True:
+                deleted = store.prune(policy.max_age, policy.max_rows, self.batch_size)
+                pruned += deleted
+                if deleted < self.batch_size:
+                    break
+                time.sleep(self.pause)
+            if pruned > 0:
+                log = self.log if store.hub is None else self.log.bind(Hub=store.hub)
+                log.info(f"Pruned {pruned} rows")
+            total += pruned
+
+        # stores sharing a file only need to be vacuumed once
+        for store in {store.path: store for store, _ in stores}.values():
+            if (freed := store.vacuum(self.vacuum_pages)) > 0:
+                self.log.info(f"Freed {freed} pages", Path=store.path)
+        return total
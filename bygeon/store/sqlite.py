@@ -0,0 +1,219 @@
+import time
+from sqlite3 import Cursor as SQLCur
+from typing import List, Sequence, Tuple, cast
+
+from .pool import ConnectionPool
+from .store import MappingStore, Row, Insert, Update, Op, encode_id, decode_id
+
+TABLE = "messages"
+CREATED_AT = "created_at"
+HUB = "hub"
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class SQLiteStore(MappingStore):
+    clients: List[str]
+
+    # With a hub name the store shares its table with other hubs and only
+    # sees the rows tagged with that name.
+    def __init__(self, pool: ConnectionPool, hub: str | None = None) -> None:
+        self.pool = pool
+        self.hub = hub
+        self.clients = []
+
+        if hub is None:
+            self.scope, self.scope_args = "1", ()
+        else:
+            self.scope, self.scope_args = f"{quote(HUB)} = ?", (hub,)
+
+    @property
+    def path(self) -> str:
+        return self.pool.path
+
+    def init_table(self, clients: Sequence[str], keep_data: bool) -> None:
+        self.clients = list(clients)
+        with self.pool.writer() as conn:
+            if not keep_data:
+                if self.hub is None:
+                    conn.execute(f"DROP TABLE IF EXISTS {quote(TABLE)}")
+                elif self.table_columns(conn):
+                    conn.execute(
+                        f"DELETE FROM {quote(TABLE)} WHERE {self.scope}", self.scope_args
+                    )
+
+            # auto_vacuum only takes effect on a fresh file or after a full
+            # VACUUM, which is cheap here unless an old database is being kept
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+
+            # Columns are declared without a type so integers are stored
+            # compactly instead of being coerced to text.
+            extra = [CREATED_AT] if self.hub is None else [HUB, CREATED_AT]
+            columns = ", ".join(quote(c) for c in self.clients + extra)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {quote(TABLE)} ({columns})")
+
+            existing = self.table_columns(conn)
+            for c in extra + self.clients:
+                if c not in existing:
+                    conn.execute(f"ALTER TABLE {quote(TABLE)} ADD COLUMN {quote(c)}")
+            # rows from before the column existed start aging from now
+            # instead of being the first to go
+            if CREATED_AT not in existing:
+                conn.execute(
+                    f"UPDATE {quote(TABLE)} SET {quote(CREATED_AT)} = ? "
+                    f"WHERE {quote(CREATED_AT)} IS NULL",
+                    (int(time.time()),),
+                )
+
+            if self.hub is None:
+                for c in self.clients:
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {quote(f'{TABLE}_{c}')} "
+                        f"ON {quote(TABLE)} ({quote(c)})"
+                    )
+            else:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {quote(f'{TABLE}_{HUB}')} "
+                    f"ON {quote(TABLE)} ({quote(HUB)})"
+                )
+                for c in self.clients:
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {quote(f'{TABLE}_{HUB}_{c}')} "
+                        f"ON {quote(TABLE)} ({quote(HUB)}, {quote(c)})"
+                    )
+
+        # Identifiers cannot be bound, so build every statement once here and
+        # let sqlite3's statement cache keep them prepared.
+        select = ", ".join(quote(c) for c in self.clients)
+        placeholders = ", ".join("?" for _ in self.clients)
+        if self.hub is None:
+            self.insert_sql = (
+                f"INSERT INTO {quote(TABLE)} ({select}, {quote(CREATED_AT)}) "
+                f"VALUES ({placeholders}, ?)"
+            )
+        else:
+            self.insert_sql = (
+                f"INSERT INTO {quote(TABLE)} "
+                f"({select}, {quote(CREATED_AT)}, {quote(HUB)}) "
+                f"VALUES ({placeholders}, ?, ?)"
+            )
+        self.select_sql = {
+            c: f"SELECT {select} FROM {quote(TABLE)} "
+            f"WHERE {quote(c)} = ? AND {self.scope} LIMIT 1"
+            for c in self.clients
+        }
+        self.update_sql = {
+            (c, origin): f"UPDATE {quote(TABLE)} SET {quote(c)} = ? "
+            f"WHERE {quote(origin)} = ? AND {self.scope}"
+            for c in self.clients
+            for origin in self.clients
+        }
+
+    def table_columns(self, conn) -> List[str]:
+        return [r[1] for r in conn.execute(f"PRAGMA table_info({quote(TABLE)})")]
+
+    def find_row(self, client: str, m_id: str) -> Row | None:
+        if client not in self.select_sql:
+            return None
+        with self.pool.reader() as conn:
+            row = conn.execute(
+                self.select_sql[client], (encode_id(m_id), *self.scope_args)
+            ).fetchone()
+        if row is None:
+            return None
+        return {c: decode_id(v) for c, v in zip(self.clients, row)}
+
+    def insert(self, client: str, m_id: str) -> None:
+        with self.pool.writer() as conn:
+            self.apply(conn.cursor(), Insert(client, m_id))
+
+    def update(
+        self, origin: str, origin_m_id: str, client: str, sent_id: str | None
+    ) -> None:
+        with self.pool.writer() as conn:
+            self.apply(conn.cursor(), Update(origin, origin_m_id, client, sent_id))
+
+    def apply(self, cur: SQLCur, op: Op) -> None:
+        match op:
+            case Insert(client, m_id):
+                values = [encode_id(m_id) if c == client else None for c in self.clients]
+                cur.execute(
+                    self.insert_sql, (*values, int(time.time()), *self.scope_args)
+                )
+            case Update(origin, origin_m_id, client, sent_id):
+                cur.execute(
+                    self.update_sql[(client, origin)],
+                    (encode_id(sent_id), encode_id(origin_m_id), *self.scope_args),
+                )
+
+    def write_batch(self, ops: Sequence[Op]) -> None:
+        self.write_shared([(self, op) for op in ops])
+
+    # stores on the same file share the pool, so one transaction covers them
+    def write_shared(self, writes: Sequence[Tuple[MappingStore, Op]]) -> None:
+        with self.pool.writer() as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                for store, op in writes:
+                    cast(SQLiteStore, store).apply(cur, op)
+                # a busy COMMIT leaves the transaction open as well
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+
+    # Rows are only ever appended, so the oldest ones are those with the
+    # lowest rowid. Each call deletes at most one batch from the front.
+    def prune(
+        self, max_age: float | None, max_rows: int | None, batch_size: int
+    ) -> int:
+        deleted = 0
+        rowids = f"SELECT rowid FROM {quote(TABLE)} WHERE {self.scope}"
+        with self.pool.writer() as conn:
+            cur = conn.cursor()
+            if max_rows is not None:
+                row = cur.execute(
+                    f"{rowids} ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                    (*self.scope_args, max_rows),
+                ).fetchone()
+                if row is not None:
+                    cur.execute(
+                        f"DELETE FROM {quote(TABLE)} WHERE rowid IN ("
+                        f"{rowids} AND rowid <= ? ORDER BY rowid LIMIT ?)",
+                        (*self.scope_args, row[0], batch_size),
+                    )
+                    deleted += cur.rowcount
+            if max_age is not None and deleted < batch_size:
+                cur.execute(
+                    f"DELETE FROM {quote(TABLE)} WHERE rowid IN ("
+                    f"{rowids} ORDER BY rowid LIMIT ?) "
+                    f"AND {quote(CREATED_AT)} < ?",
+                    (*self.scope_args, batch_size - deleted, int(time.time() - max_age)),
+                )
+                deleted += cur.rowcount
+        return deleted
+
+    def vacuum(self, pages: int) -> int:
+        with self.pool.writer() as conn:
+            (free,) = conn.execute("PRAGMA freelist_count").fetchone()
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return min(free, pages)
+
+
+class TunedSQLiteStore(SQLiteStore):
+    # Trades memory for fewer syscalls: the database is read through mmap,
+    # the page cache is larger and temporary b-trees never touch disk.
+    PRAGMAS = (
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA cache_size=-65536",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def __init__(self, pool: ConnectionPool, hub: str | None = None) -> None:
+        pool.configure(self.PRAGMAS)
+        super().__init__(pool, hub)
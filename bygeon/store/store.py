@@ -0,0 +1,84 @@
+from itertools import groupby
+from typing import Dict, List, NamedTuple, Protocol, Sequence, Tuple
+
+Row = Dict[str, str | None]
+
+
+class Insert(NamedTuple):
+    client: str
+    m_id: str
+
+
+class Update(NamedTuple):
+    origin: str
+    origin_m_id: str
+    client: str
+    sent_id: str | None
+
+
+Op = Insert | Update
+
+
+# Discord snowflakes and QQ message ids are integers, store them as such.
+# Anything that does not round-trip (e.g. Slack's "1670000000.000100") stays text.
+def encode_id(m_id: str | int | None) -> str | int | None:
+    if m_id is None or isinstance(m_id, int):
+        return m_id
+    try:
+        n = int(m_id)
+    except ValueError:
+        return m_id
+    return n if str(n) == m_id else m_id
+
+
+def decode_id(value: str | int | None) -> str | None:
+    return None if value is None else str(value)
+
+
+class MappingStore(Protocol):
+    clients: List[str]
+    hub: str | None
+
+    @property
+    def path(self) -> str:
+        ...
+
+    # identifies the store's rows among those of stores sharing a writer
+    @property
+    def key(self) -> str:
+        return self.hub or ""
+
+    def init_table(self, clients: Sequence[str], keep_data: bool) -> None:
+        ...
+
+    def find_row(self, client: str, m_id: str) -> Row | None:
+        ...
+
+    def insert(self, client: str, m_id: str) -> None:
+        self.write_batch([Insert(client, m_id)])
+
+    def update(
+        self, origin: str, origin_m_id: str, client: str, sent_id: str | None
+    ) -> None:
+        self.write_batch([Update(origin, origin_m_id, client, sent_id)])
+
+    def write_batch(self, ops: Sequence[Op]) -> None:
+        ...
+
+    # Commits the writes of every store sharing this one's path, in order.
+    # Backends that can put them in a single transaction override this.
+    def write_shared(self, writes: Sequence[Tuple["MappingStore", Op]]) -> None:
+        for store, run in groupby(writes, key=lambda w: w[0]):
+            store.write_batch([op for _, op in run])
+
+    # delete at most batch_size of the oldest expired rows
+    def prune(
+        self, max_age: float | None, max_rows: int | None, batch_size: int
+    ) -> int:
+        ...
+
+    def vacuum(self, pages: int) -> int:
+        return 0
+
+    def close(self) -> None:
+        ...
@@ -0,0 +1,162 @@
+import sqlite3
+import time
+from queue import Queue, Empty
+from threading import Thread, Lock, Event
+from typing import Dict, List, Tuple
+
+import bygeon.logger as logger
+from .store import MappingStore, Row, Insert, Update, Op
+
+# (store key, client, id)
+Key = Tuple[str, str, str]
+Write = Tuple[MappingStore, Op]
+
+# a locked or full database, worth another try once it settles
+TRANSIENT = (sqlite3.OperationalError, OSError)
+
+
+class BatchWriter:
+    # Values written but not committed yet, keyed by the origin of their row.
+    # Readers overlay them on top of what the database returns.
+    overlays: Dict[Key, Row]
+    index: Dict[Key, Key]
+    in_flight: Dict[Key, int]
+
+    def __init__(
+        self,
+        name: str,
+        flush_interval: float = 0.05,
+        batch_size: int = 512,
+        max_retry_delay: float = 30,
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retry_delay = max_retry_delay
+        self.retry_delay = 0.0
+        self.failed: List[Write] = []
+        self.queue: Queue[Write | Event] = Queue()
+        self.lock = Lock()
+        self.overlays = {}
+        self.index = {}
+        self.in_flight = {}
+        self.log = logger.log.bind(Writer=name)
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def insert(self, store: MappingStore, client: str, m_id: str) -> None:
+        key = (store.key, client, str(m_id))
+        with self.lock:
+            self.track(key, client, m_id)
+        self.queue.put((store, Insert(client, m_id)))
+
+    def update(
+        self,
+        store: MappingStore,
+        origin: str,
+        origin_m_id: str,
+        client: str,
+        sent_id: str | None,
+    ) -> None:
+        key = (store.key, origin, str(origin_m_id))
+        with self.lock:
+            self.track(key, client, sent_id)
+        self.queue.put((store, Update(origin, origin_m_id, client, sent_id)))
+
+    def track(self, key: Key, client: str, m_id: str | None) -> None:
+        overlay = self.overlays.setdefault(key, {})
+        overlay[client] = None if m_id is None else str(m_id)
+        self.index[key] = key
+        if m_id is not None:
+            self.index[(key[0], client, str(m_id))] = key
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+    def find_row(self, store: MappingStore, client: str, m_id: str) -> Row | None:
+        with self.lock:
+            key = self.index.get((store.key, client, str(m_id)))
+            overlay = dict(self.overlays[key]) if key is not None else None
+        if overlay is None or key is None:
+            return store.find_row(client, m_id)
+
+        row = store.find_row(key[1], key[2])
+        if row is None:
+            row = {c: None for c in store.clients}
+        row.update(overlay)
+        return row
+
+    def flush(self) -> None:
+        done = Event()
+        self.queue.put(done)
+        done.wait()
+
+    def run(self) -> None:
+        while True:
+            # writes that failed to commit go first, keeping their order
+            batch, self.failed = self.failed, []
+            waiters: List[Event] = []
+            try:
+                item: Write | Event | None = self.queue.get(block=not batch)
+            except Empty:
+                item = None
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                if isinstance(item, Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except Empty:
+                    break
+
+            if batch:
+                self.failed = self.commit(batch)
+            for w in waiters:
+                w.set()
+            # back off while the database keeps failing, reads are served
+            # from the overlays meanwhile
+            if self.failed:
+                self.retry_delay = min(
+                    max(self.retry_delay * 2, self.flush_interval), self.max_retry_delay
+                )
+                time.sleep(self.retry_delay)
+            else:
+                self.retry_delay = 0.0
+
+    # returns the writes to try again, their overlays are kept until then
+    def commit(self, batch: List[Write]) -> List[Write]:
+        # one transaction per database file, keeping the order of the writes
+        files: Dict[str, List[Write]] = {}
+        for store, op in batch:
+            files.setdefault(store.path, []).append((store, op))
+        done: List[Write] = []
+        failed: List[Write] = []
+        for writes in files.values():
+            try:
+                writes[0][0].write_shared(writes)
+            except TRANSIENT as e:
+                self.log.warning(f"Failed to commit {len(writes)} writes, retrying: {e}")
+                failed += writes
+                continue
+            except Exception as e:
+                self.log.error(f"Failed to commit {len(writes)} writes")
+                self.log.exception(e)
+            done += writes
+
+        with self.lock:
+            for store, op in done:
+                key = (store.key, op[0], str(op[1]))
+                self.in_flight[key] -= 1
+                if self.in_flight[key] > 0:
+                    continue
+                del self.in_flight[key]
+                for c, v in self.overlays.pop(key).items():
+                    if v is not None and self.index.get((key[0], c, v)) == key:
+                        del self.index[(key[0], c, v)]
+                self.index.pop(key, None)
+        return failed
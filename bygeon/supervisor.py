@@ -0,0 +1,316 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from queue import Queue
+from threading import Thread
+from typing import Deque, Dict, List
+
+import bygeon.logger as logger
+from bygeon.ipc import Channel, destination
+from bygeon.main import (
+    LINKS,
+    configure,
+    create_client,
+    create_database,
+    create_hub,
+    hub_name,
+)
+from bygeon.message import message_from_dict
+from bygeon.messenger.cqhttp import CQHttp
+from bygeon.messenger.discord import Discord
+from bygeon.messenger.messenger import Hub, permanent
+from bygeon.messenger.proxy import ProxyHub, ProxyMessenger
+from bygeon.pipeline import Pipeline
+
+# frames kept for a worker while it is being restarted
+BACKLOG = 10000
+
+# hubs decide what to fetch by the capabilities of the real messengers
+CAPABILITIES = {"Discord": Discord.capabilities, "CQHttp": CQHttp.capabilities}
+
+
+class Worker:
+    # Frames are received on the main thread and handled on another, so a
+    # worker keeps draining its pipe while a handler blocks; otherwise it
+    # and the supervisor could block on each other's full pipes.
+    def __init__(self, name: str, config: dict, channel: Channel) -> None:
+        self.name = name
+        self.config = config
+        self.bygeon_config = config.get("Bygeon", {})
+        self.channel = channel
+        self.inbox: Queue[list] = Queue()
+        self.log = logger.log.bind(Worker=name)
+        configure(self.bygeon_config, name)
+        self.pipeline = Pipeline(
+            self.bygeon_config.get("workers", 4),
+            self.bygeon_config.get("lanes", 8),
+        )
+
+    # handle a frame on the receiving thread, False to queue it instead
+    def receive(self, frame: list) -> bool:
+        return False
+
+    def handle(self, frame: list) -> None:
+        ...
+
+    def dispatch(self) -> None:
+        while True:
+            frame = self.inbox.get()
+            try:
+                self.handle(frame)
+            except Exception as e:
+                self.log.error(f"Failed to handle {frame[0]}")
+                self.log.exception(e)
+
+    def run(self) -> None:
+        Thread(target=self.dispatch, daemon=True).start()
+        while True:
+            try:
+                frame = self.channel.recv()
+            except EOFError:
+                self.log.error("Lost the supervisor, exiting")
+                return None
+            if not self.receive(frame):
+                self.inbox.put(frame)
+
+
+class ConnectorWorker(Worker):
+    # Runs one messenger. Its hubs are proxies for the hub workers, and the
+    # hub workers' deliveries are run on its lanes.
+    def __init__(
+        self, name: str, config: dict, routes: Dict[str, str], channel: Channel
+    ) -> None:
+        super().__init__(name, config, channel)
+        self.client = create_client(name, config["Clients"][name])
+        self.client.pipeline = self.pipeline
+        for i, hub_config in enumerate(config["Hubs"]):
+            if (link := hub_config.get(name)) is None:
+                continue
+            hub = hub_name(i, hub_config)
+            proxy = ProxyHub(hub, routes[hub], channel, self.pipeline)
+            self.client.add_hub(link[LINKS[name]], proxy)  # type: ignore[arg-type]
+        self.client.start()
+
+    def handle(self, frame: list) -> None:
+        op, reply_to, request_id, *args = frame
+        # the channel id comes second for every operation
+        self.pipeline.deliver(
+            f"{self.name}:{args[1]}", self.serve, op, reply_to, request_id, args
+        )
+
+    def serve(self, op: str, reply_to: str, request_id: int, args: list) -> None:
+        error, refused = None, False
+        try:
+            match op:
+                case "send":
+                    m, c_id, ref_id = args
+                    self.client.send_message(message_from_dict(m), c_id, ref_id)
+                case "modify":
+                    m, c_id, m_id = args
+                    self.client.modify_message(message_from_dict(m), c_id, m_id)
+                case "recall":
+                    m_id, c_id = args
+                    self.client.recall_message(m_id, c_id)
+        except Exception as e:
+            self.log.exception(e)
+            error, refused = f"{type(e).__name__}: {e}", permanent(e)
+        self.channel.send(reply_to, "reply", self.name, request_id, error, refused)
+
+
+class HubWorker(Worker):
+    # Runs a group of hubs with their own database. Messengers are proxies
+    # for the connector workers.
+    def __init__(
+        self,
+        name: str,
+        config: dict,
+        indexes: List[int],
+        channel: Channel,
+        restarted: bool,
+    ) -> None:
+        super().__init__(name, config, channel)
+        # hub workers must not share a database file, so each group gets
+        # its own next to the configured one
+        bygeon_config = dict(self.bygeon_config)
+        if (path := bygeon_config.get("database")) is not None:
+            base, ext = os.path.splitext(path)
+            bygeon_config["database"] = f"{base}.{name.partition(':')[2]}{ext}"
+        database = create_database(bygeon_config)
+
+        self.proxies = {
+            client: ProxyMessenger(client, client, channel, name, CAPABILITIES[client])
+            for client, client_config in config["Clients"].items()
+            if client in LINKS and client_config
+        }
+        self.hubs: Dict[str, Hub] = {}
+        for i in indexes:
+            hub_config = config["Hubs"][i]
+            hub = create_hub(i, hub_config, bygeon_config, database, self.pipeline)
+            for client, proxy in self.proxies.items():
+                if (link := hub_config.get(client)) is not None:
+                    c_id = link[LINKS[client]]
+                    proxy.add_hub(c_id, hub)
+                    hub.add_linkee(proxy, c_id)
+            # keep what the crashed process recorded, including its outbox
+            hub.init_database(hub_config.get("keep_data", True) or restarted)
+            self.hubs[hub.name] = hub
+
+    # Replies and sent ids are handled right away: a lane waits for the
+    # reply, and the sent id has to be recorded before the lane moves on.
+    def receive(self, frame: list) -> bool:
+        match frame:
+            case ["reply", client, request_id, error, refused]:
+                self.proxies[client].resolve(request_id, error, refused)
+            case ["update", hub, m, client, sent_id]:
+                self.hubs[hub].update_entry(message_from_dict(m), client, sent_id)
+            case _:
+                return False
+        return True
+
+    def handle(self, frame: list) -> None:
+        match frame:
+            case ["new", hub, m]:
+                self.hubs[hub].new_hub_message(message_from_dict(m))
+            case ["modify", hub, m]:
+                self.hubs[hub].modify_hub_message(message_from_dict(m))
+            case ["recall", hub, orig, recalled_id]:
+                self.hubs[hub].recall_hub_message(orig, recalled_id)
+
+
+def run_worker(
+    kind: str,
+    name: str,
+    config: dict,
+    routes: Dict[str, str],
+    indexes: List[int],
+    conn: Connection,
+    restarted: bool,
+) -> None:
+    channel = Channel(conn)
+    if kind == "connector":
+        ConnectorWorker(name, config, routes, channel).run()
+    else:
+        HubWorker(name, config, indexes, channel, restarted).run()
+
+
+class Process:
+    def __init__(self, kind: str, name: str, indexes: List[int]) -> None:
+        self.kind = kind
+        self.name = name
+        self.indexes = indexes
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.conn: Connection | None = None
+        self.backlog: Deque[bytes] = deque(maxlen=BACKLOG)
+        self.started = 0.0
+        self.restart_at = 0.0
+        self.crashes = 0
+
+
+class Supervisor:
+    # Runs every client connector, and every group of hubs, in a worker
+    # process of its own and routes frames between them. Hubs are grouped
+    # by their "process" option. A worker that dies is started again, with
+    # a growing delay while it keeps crashing; frames for it wait in its
+    # backlog meanwhile.
+    MAX_DELAY = 60
+
+    def __init__(self, config: dict) -> None:
+        self.config = config
+        self.context = multiprocessing.get_context("spawn")
+        self.log = logger.log.bind(Supervisor="")
+
+        self.workers: Dict[str, Process] = {}
+        for client, client_config in config["Clients"].items():
+            if client in LINKS and client_config:
+                self.workers[client] = Process("connector", client, [])
+
+        self.routes: Dict[str, str] = {}
+        for i, hub_config in enumerate(config["Hubs"]):
+            name = f"hubs:{hub_config.get('process', 'default')}"
+            self.workers.setdefault(name, Process("hubs", name, [])).indexes.append(i)
+            self.routes[hub_name(i, hub_config)] = name
+
+    def spawn(self, worker: Process, restarted: bool) -> None:
+        conn, child = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(
+                worker.kind,
+                worker.name,
+                self.config,
+                self.routes,
+                worker.indexes,
+                child,
+                restarted,
+            ),
+            name=worker.name,
+            daemon=True,
+        )
+        worker.process.start()
+        child.close()
+        worker.conn = conn
+        worker.started = time.monotonic()
+        while worker.backlog:
+            conn.send_bytes(worker.backlog.popleft())
+
+    def crashed(self, worker: Process) -> None:
+        assert worker.process is not None and worker.conn is not None
+        # pass on what the worker sent before it died
+        try:
+            while worker.conn.poll():
+                self.forward(worker.conn.recv_bytes())
+        except (EOFError, OSError):
+            pass
+        worker.process.join()
+        worker.conn.close()
+        worker.conn = None
+        now = time.monotonic()
+        if now - worker.started > self.MAX_DELAY:
+            worker.crashes = 0
+        delay = min(2**worker.crashes, self.MAX_DELAY)
+        worker.crashes += 1
+        worker.restart_at = now + delay
+        self.log.error(
+            f"{worker.name} exited with {worker.process.exitcode}, "
+            f"restarting in {delay}s"
+        )
+
+    def forward(self, data: bytes) -> None:
+        if (worker := self.workers.get(destination(data))) is None:
+            self.log.warning(f"Dropping frame for unknown {destination(data)}")
+        elif worker.conn is None:
+            worker.backlog.append(data)
+        else:
+            try:
+                worker.conn.send_bytes(data)
+            except OSError:
+                # the worker died, its sentinel is handled next
+                worker.backlog.append(data)
+
+    def run(self) -> None:
+        for worker in self.workers.values():
+            self.spawn(worker, False)
+
+        while True:
+            live = [w for w in self.workers.values() if w.conn is not None]
+            conns = {w.conn: w for w in live}
+            sentinels = {w.process.sentinel: w for w in live}  # type: ignore[union-attr]
+            for ready in wait([*conns, *sentinels], timeout=1):
+                if (worker := conns.get(ready)) is not None:  # type: ignore[call-overload]
+                    if worker.conn is None:
+                        continue
+                    try:
+                        self.forward(worker.conn.recv_bytes())
+                    except EOFError:
+                        self.crashed(worker)
+                elif (worker := sentinels.get(ready)) is not None:  # type: ignore[call-overload]
+                    if worker.conn is not None:
+                        self.crashed(worker)
+
+            now = time.monotonic()
+            for worker in self.workers.values():
+                if worker.conn is None and worker.restart_at <= now:
+                    self.log.info(f"Restarting {worker.name}")
+                    self.spawn(worker, True)
@@ -0,0 +1,88 @@
+import time
+from threading import Lock
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import bygeon.logger as logger
+from bygeon.metrics import registry
+from bygeon.scheduler import scheduler
+
+
+class Transport:
+    # One keep-alive session per host, shared by every messenger, so calls
+    # to the same API reuse pooled connections instead of doing a TCP and
+    # TLS handshake each time.
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+    ) -> None:
+        self.pool_size = pool_size
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.sessions: Dict[str, requests.Session] = {}
+        self.lock = Lock()
+        self.log = logger.log.bind(Transport="")
+
+    def configure(
+        self,
+        pool_size: int | None = None,
+        connect_timeout: float | None = None,
+        read_timeout: float | None = None,
+    ) -> None:
+        # only affects sessions opened afterwards, call before start()
+        if pool_size is not None:
+            self.pool_size = pool_size
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else self.timeout[0],
+            read_timeout if read_timeout is not None else self.timeout[1],
+        )
+
+    def session(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            if (session := self.sessions.get(origin)) is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(f"{origin}/", adapter)
+                self.sessions[origin] = session
+            return session
+
+    def request(
+        self, method: str, url: str, endpoint: str | None = None, **kwargs
+    ) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        histogram = registry.histogram("http_request_seconds", endpoint or method)
+        start = time.perf_counter()
+        try:
+            return self.session(url).request(method, url, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def get(self, url: str, endpoint: str | None = None, **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    # open a few connections ahead of time so the first messages do not
+    # pay for the handshake
+    def prewarm(self, url: str, connections: int = 2) -> None:
+        def warm() -> None:
+            try:
+                self.request("HEAD", url, "prewarm", allow_redirects=False)
+            except requests.RequestException as e:
+                self.log.warning(f"Could not prewarm {url}: {e}")
+
+        for _ in range(min(connections, self.pool_size)):
+            scheduler.call_later(0, warm)
+
+    def close(self) -> None:
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+transport = Transport()
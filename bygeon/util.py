@@ -1,30 +1,8 @@
-from threading import Thread
-from typing import Callable
-import requests
-import os
-from pathlib import Path
-from sqlite3 import Connection as SQLConn, Cursor as SQLCur
-
-
-def run_in_thread(func: Callable, args: tuple):
-    thread = Thread(target=func, args=args)
-    thread.start()
+import bygeon.filecache as filecache
 
 
 def download_to_cache(url: str, directory: str, filename: str, headers=None):
-    Path(directory).mkdir(parents=True, exist_ok=True)
-
-    with requests.get(url, stream=True, headers=headers) as r:
-        r.raise_for_status()
-        content_type = r.headers["content-type"]
-
-        filename = rename_with_proper_suffix(filename, content_type)
-
-        file_path = os.path.join(directory, filename)
-        with open(file_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return file_path
+    return filecache.files.fetch(url, directory, filename, headers)
 
 
 def rename_with_proper_suffix(filename: str, content_type: str) -> str:
@@ -32,8 +10,3 @@ def rename_with_proper_suffix(filename: str, content_type: str) -> str:
     if not filename.endswith(suffix):
         filename += suffix
     return filename
-
-def update_db(conn: SQLConn, sql: str):
-    cur = conn.cursor()  
-    cur.execute(sql)
-    conn.commit()
@@ -0,0 +1,60 @@
+from bygeon.messenger.discord import Discord
+
+
+def message(sticker_items, attachments=()) -> dict:
+    return {
+        "id": "10",
+        "channel_id": "1",
+        "content": "",
+        "author": {"id": "2", "username": "someone"},
+        "attachments": list(attachments),
+        "referenced_message": None,
+        "sticker_items": sticker_items,
+    }
+
+
+def discord() -> Discord:
+    client = Discord("token")
+    client.hubs = {"1": object()}  # type: ignore[dict-item]
+    client.nickname_dict = {"1": {}}
+    client.bot_id = "3"
+    return client
+
+
+def test_every_sticker_is_forwarded() -> None:
+    stickers = [
+        {"id": "5", "format_type": 1},
+        {"id": "6", "format_type": 2},
+        {"id": "7", "format_type": 4},
+    ]
+    _, m = discord().parse_message_create(message(stickers))  # type: ignore[misc]
+    assert [(a.name, a.type) for a in m.attachments] == [
+        ("5.png", "image/png"),
+        ("6.apng", "image/apng"),
+        ("7.gif", "image/gif"),
+    ]
+    assert [a.source.url.rsplit("/", 1)[1] for a in m.attachments] == [
+        "5.png",
+        "6.png",
+        "7.gif",
+    ]
+
+
+def test_lottie_sticker_is_skipped() -> None:
+    _, m = discord().parse_message_create(  # type: ignore[misc]
+        message([{"id": "5", "format_type": 3}])
+    )
+    assert m.attachments == []
+
+
+def test_lottie_sticker_does_not_repeat_an_attachment() -> None:
+    upload = {
+        "id": "8",
+        "url": "https://cdn.example/8",
+        "content_type": "image/png",
+        "size": 3,
+    }
+    _, m = discord().parse_message_create(  # type: ignore[misc]
+        message([{"id": "5", "format_type": 3}], [upload])
+    )
+    assert [a.name for a in m.attachments] == ["8"]